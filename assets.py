@@ -0,0 +1,233 @@
+import argparse, hashlib, os, subprocess, sys, time, pygame
+from collections import OrderedDict
+from typing import Any, Callable
+from board import Piece, BLACK
+
+RESOURCES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resources")
+ATLAS_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "atlas-cache")
+ATLAS_VERSION = 1
+
+PIECE_FILES = [("wP", Piece.PAWN_W), ("wR", Piece.ROOK_W), ("wN", Piece.KNIGHT_W), ("wB", Piece.BISHOP_W), ("wQ", Piece.QUEEN_W), ("wK", Piece.KING_W), ("bP", Piece.PAWN_B), ("bR", Piece.ROOK_B), ("bN", Piece.KNIGHT_B), ("bB", Piece.BISHOP_B), ("bQ", Piece.QUEEN_B), ("bK", Piece.KING_B)]
+PROMOTION_PIECES = [Piece.QUEEN_W, Piece.KNIGHT_W, Piece.ROOK_W, Piece.BISHOP_W]
+
+ASSET_SIZES = 8
+
+source_hash: str | None = None
+
+class SizeCache:
+
+    def __init__(self, size: int = ASSET_SIZES) -> None:
+        self.size = size
+        self.entries: OrderedDict[tuple, Any] = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple, build: Callable[[], Any]) -> Any:
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry
+
+        self.misses += 1
+        entry = build()
+        self.entries[key] = entry
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+        return entry
+
+    def latest(self) -> Any:
+        return next(reversed(self.entries.values())) if len(self.entries) > 0 else None
+
+atlases = SizeCache()
+sprite_sets = SizeCache()
+menus = SizeCache(2 * ASSET_SIZES)
+marks = SizeCache(2 * ASSET_SIZES)
+
+stats = {"built": 0, "loaded": 0, "scaled": 0}
+
+def size_key(cell_size: tuple[float, float]) -> tuple[int, int]:
+    return (round(cell_size[0]), round(cell_size[1]))
+
+def asset_hash() -> str:
+    global source_hash
+
+    if source_hash == None:
+        digest = hashlib.sha1(bytes(f"{ATLAS_VERSION} {pygame.version.ver}", encoding="ascii"))
+        for file, _ in PIECE_FILES:
+            for ext in [".png", ".svg"]:
+                with open(os.path.join(RESOURCES, file + ext), "rb") as f:
+                    digest.update(f.read())
+        source_hash = digest.hexdigest()[:16]
+
+    return source_hash
+
+def rasterize(file: str, size: tuple[int, int]) -> pygame.Surface:
+    if hasattr(pygame.image, "load_sized_svg"):
+        try:
+            return pygame.image.load_sized_svg(os.path.join(RESOURCES, file + ".svg"), size)
+        except pygame.error:
+            pass
+
+    image = pygame.image.load(os.path.join(RESOURCES, file + ".png"))
+    if image.get_size() == size:
+        return image
+    return pygame.transform.smoothscale(image, size)
+
+def build_atlas(size: tuple[int, int]) -> pygame.Surface:
+    atlas = pygame.Surface((size[0] * len(PIECE_FILES), size[1]), pygame.SRCALPHA)
+    atlas.fill((0, 0, 0, 0))
+
+    for idx, (file, _) in enumerate(PIECE_FILES):
+        atlas.blit(rasterize(file, size), (idx * size[0], 0))
+
+    stats["built"] += 1
+    return atlas
+
+def atlas_path(size: tuple[int, int]) -> str:
+    return os.path.join(ATLAS_CACHE, f"atlas-{size[0]}x{size[1]}-{asset_hash()}.rgba")
+
+def read_atlas(size: tuple[int, int]) -> pygame.Surface:
+    path = atlas_path(size)
+    dims = (size[0] * len(PIECE_FILES), size[1])
+
+    try:
+        with open(path, "rb") as f:
+            atlas = pygame.image.frombytes(f.read(), dims, "RGBA")
+        stats["loaded"] += 1
+    except (OSError, ValueError):
+        atlas = build_atlas(size)
+
+        try:
+            os.makedirs(ATLAS_CACHE, exist_ok=True)
+            with open(path + ".tmp", "wb") as f:
+                f.write(pygame.image.tobytes(atlas, "RGBA"))
+            os.replace(path + ".tmp", path)
+        except OSError:
+            pass
+
+    return atlas.convert_alpha()
+
+def scale_atlas(size: tuple[int, int]) -> pygame.Surface:
+    source = atlases.latest()
+    if source == None:
+        return load_atlas(size)
+
+    stats["scaled"] += 1
+    return pygame.transform.smoothscale(source, (size[0] * len(PIECE_FILES), size[1]))
+
+def load_atlas(cell_size: tuple[float, float], preview: bool = False) -> pygame.Surface:
+    size = size_key(cell_size)
+
+    if preview and size not in atlases.entries:
+        return scale_atlas(size)
+
+    return atlases.get(size, lambda: read_atlas(size))
+
+def slice_atlas(atlas: pygame.Surface, size: tuple[int, int]) -> list[pygame.Surface | None]:
+    sprites: list[pygame.Surface | None] = [None for _ in range(15)]
+    for idx, (_, piece) in enumerate(PIECE_FILES):
+        sprites[piece.value] = atlas.subsurface((idx * size[0], 0, size[0], size[1]))
+
+    return sprites
+
+def load_sprites(cell_size: tuple[float, float], preview: bool = False) -> list[pygame.Surface | None]:
+    size = size_key(cell_size)
+
+    if preview and size not in sprite_sets.entries:
+        return sprite_sets.get(size + (True,), lambda: slice_atlas(load_atlas(size, True), size))
+
+    return sprite_sets.get(size, lambda: slice_atlas(load_atlas(size), size))
+
+def build_menu(cell_size: tuple[float, float], white: bool, sprites: list[pygame.Surface | None]) -> pygame.Surface:
+    color = 0 if white else BLACK
+
+    menu = pygame.Surface((2 * cell_size[0], 2 * cell_size[1]))
+    menu.fill((255, 255, 255))
+    for idx, piece in enumerate(PROMOTION_PIECES):
+        menu.blit(sprites[piece.value | color], ((idx % 2) * cell_size[0], (idx // 2) * cell_size[1]))
+    pygame.draw.rect(menu, (0, 0, 0), (0, 0, cell_size[0] * 2, cell_size[1] * 2), 1)
+
+    return menu
+
+def promotion_menu(cell_size: tuple[float, float], white: bool, preview: bool = False) -> pygame.Surface:
+    size = size_key(cell_size)
+    preview = preview and size not in sprite_sets.entries
+
+    return menus.get(size + (white, preview), lambda: build_menu(cell_size, white, load_sprites(cell_size, preview)))
+
+def check_circle(cell_size: tuple[float, float], color) -> pygame.Surface:
+    def build() -> pygame.Surface:
+        circle = pygame.Surface(cell_size, pygame.SRCALPHA)
+        circle.fill((0, 0, 0, 0))
+        pygame.draw.circle(circle, color, (cell_size[0] / 2, cell_size[1] / 2), cell_size[0] / 2)
+        return circle
+
+    return marks.get(size_key(cell_size) + ("check",) + tuple(color), build)
+
+def square_tint(cell_size: tuple[float, float], color) -> pygame.Surface:
+    def build() -> pygame.Surface:
+        tint = pygame.Surface(cell_size, pygame.SRCALPHA)
+        tint.fill(color)
+        return tint
+
+    return marks.get(size_key(cell_size) + ("tint",) + tuple(color), build)
+
+def clear_cache() -> None:
+    if os.path.isdir(ATLAS_CACHE):
+        for name in os.listdir(ATLAS_CACHE):
+            os.remove(os.path.join(ATLAS_CACHE, name))
+
+COLD_START = """
+import os, sys, time
+start = time.perf_counter()
+import pygame, client
+pygame.init()
+screen = pygame.display.set_mode((800, 800))
+ready = time.perf_counter()
+game = client.Game(None, screen, pygame.time.Clock())
+game.draw(screen)
+done = time.perf_counter()
+print(f"{(ready - start) * 1000:.1f} {(done - ready) * 1000:.1f}")
+"""
+
+def cold_start() -> tuple[float, float]:
+    env = dict(os.environ, SDL_VIDEODRIVER=os.environ.get("SDL_VIDEODRIVER", "dummy"), PYGAME_HIDE_SUPPORT_PROMPT="1")
+    out = subprocess.run([sys.executable, "-c", COLD_START], cwd=os.path.dirname(os.path.abspath(__file__)), env=env, capture_output=True, text=True, check=True).stdout
+    startup, game = out.split()[-2:]
+
+    return float(startup), float(game)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build the piece atlas cache, or time client cold starts with and without it")
+    parser.add_argument("--sizes", type=int, nargs="*", default=[100], help="cell sizes to build atlases for")
+    parser.add_argument("--clear", action="store_true", help="delete cached atlases first")
+    parser.add_argument("--bench", action="store_true", help="time client start-up in fresh processes with an empty and a warm cache")
+    parser.add_argument("--runs", type=int, default=5)
+
+    args = parser.parse_args()
+
+    if args.clear:
+        clear_cache()
+
+    if args.bench:
+        for label, clear in [("empty cache", True), ("warm cache", False)]:
+            runs = []
+            for _ in range(args.runs):
+                if clear:
+                    clear_cache()
+                runs.append(cold_start())
+
+            startup = sorted(run[0] for run in runs)[len(runs) // 2]
+            game = sorted(run[1] for run in runs)[len(runs) // 2]
+            print(f"{label}: imports and window {startup:.1f}ms, Game() and first frame {game:.1f}ms, total {startup + game:.1f}ms (median of {len(runs)})")
+    else:
+        pygame.init()
+        pygame.display.set_mode((1, 1), pygame.HIDDEN)
+
+        for cell in args.sizes:
+            start = time.perf_counter()
+            load_atlas((cell, cell))
+            print(f"{atlas_path(size_key((cell, cell)))}: {(time.perf_counter() - start) * 1000:.1f}ms")
@@ -0,0 +1,602 @@
+import os, sys, time, json, random
+from board import Board, START_POS, BLACK
+from movegen import WHITE, PAWN, ROOK, KNIGHT, BISHOP, QUEEN, KING, CASTLE_WK, CASTLE_WQ, CASTLE_BK, CASTLE_BQ, PERFT_SUITE
+
+M64 = (1 << 64) - 1
+
+MAGIC_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "magics.json")
+
+PROMOTION_CHARS = {QUEEN: 'Q', KNIGHT: 'N', ROOK: 'R', BISHOP: 'B'}
+PROMOTION_KINDS = {c: kind for kind, c in PROMOTION_CHARS.items()}
+SAN_CHARS = {KNIGHT: 'N', BISHOP: 'B', ROOK: 'R', QUEEN: 'Q', KING: 'K'}
+SAN_KINDS = {c: kind for kind, c in SAN_CHARS.items()}
+
+SQUARE_NAMES = [chr(ord('a') + sq % 8) + str(sq // 8 + 1) for sq in range(64)]
+
+ROOK_DIRS = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+BISHOP_DIRS = [(1, 1), (1, -1), (-1, 1), (-1, -1)]
+
+def _leaper(offsets: list[tuple[int, int]]) -> list[int]:
+    table = []
+    for sq in range(64):
+        rank, file = divmod(sq, 8)
+        bb = 0
+        for dr, df in offsets:
+            if 0 <= rank + dr < 8 and 0 <= file + df < 8:
+                bb |= 1 << ((rank + dr) * 8 + file + df)
+        table.append(bb)
+    return table
+
+def _slide(sq: int, occ: int, dirs: list[tuple[int, int]]) -> int:
+    bb = 0
+    for dr, df in dirs:
+        rank, file = divmod(sq, 8)
+        while 0 <= rank + dr < 8 and 0 <= file + df < 8:
+            rank += dr
+            file += df
+            bb |= 1 << (rank * 8 + file)
+            if occ & (1 << (rank * 8 + file)):
+                break
+    return bb
+
+def _mask(sq: int, dirs: list[tuple[int, int]]) -> int:
+    bb = 0
+    for dr, df in dirs:
+        rank, file = divmod(sq, 8)
+        while 0 <= rank + 2 * dr < 8 and 0 <= file + 2 * df < 8:
+            rank += dr
+            file += df
+            bb |= 1 << (rank * 8 + file)
+    return bb
+
+def _subsets(mask: int) -> list[int]:
+    subsets = [0]
+    occ = (0 - mask) & mask
+    while occ:
+        subsets.append(occ)
+        occ = (occ - mask) & mask
+    return subsets
+
+def _build_table(sq: int, mask: int, magic: int, dirs: list[tuple[int, int]]) -> list[int] | None:
+    shift = 64 - mask.bit_count()
+    table: list[int | None] = [None] * (1 << mask.bit_count())
+
+    for occ in _subsets(mask):
+        attacks = _slide(sq, occ, dirs)
+        idx = ((occ * magic) & M64) >> shift
+        if table[idx] is None:
+            table[idx] = attacks
+        elif table[idx] != attacks:
+            return None
+
+    return [0 if attacks is None else attacks for attacks in table]
+
+def _find_magic(sq: int, mask: int, dirs: list[tuple[int, int]], rng: random.Random) -> tuple[int, list[int]]:
+    shift = 64 - mask.bit_count()
+    subsets = _subsets(mask)
+    attacks = [_slide(sq, occ, dirs) for occ in subsets]
+
+    while True:
+        magic = rng.getrandbits(64) & rng.getrandbits(64) & rng.getrandbits(64)
+        if ((mask * magic) & 0xFF00000000000000).bit_count() < 6:
+            continue
+
+        table: list[int | None] = [None] * (1 << mask.bit_count())
+        for occ, att in zip(subsets, attacks):
+            idx = ((occ * magic) & M64) >> shift
+            if table[idx] is None:
+                table[idx] = att
+            elif table[idx] != att:
+                break
+        else:
+            return magic, [0 if att is None else att for att in table]
+
+def _init_sliders() -> tuple[list[int], list[int], list[list[int]], list[int], list[int], list[list[int]]]:
+    rook_masks = [_mask(sq, ROOK_DIRS) for sq in range(64)]
+    bishop_masks = [_mask(sq, BISHOP_DIRS) for sq in range(64)]
+
+    cached = None
+    try:
+        with open(MAGIC_CACHE) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        pass
+
+    rng = random.Random(0x5EED)
+    magics: dict[str, list[int]] = {"rook": [], "bishop": []}
+    tables: dict[str, list[list[int]]] = {"rook": [], "bishop": []}
+    dirty = False
+
+    for name, masks, dirs in [("rook", rook_masks, ROOK_DIRS), ("bishop", bishop_masks, BISHOP_DIRS)]:
+        for sq in range(64):
+            table = None
+            if cached is not None and len(cached.get(name, [])) == 64:
+                magic = cached[name][sq]
+                table = _build_table(sq, masks[sq], magic, dirs)
+
+            if table is None:
+                magic, table = _find_magic(sq, masks[sq], dirs, rng)
+                dirty = True
+
+            magics[name].append(magic)
+            tables[name].append(table)
+
+    if dirty:
+        try:
+            with open(MAGIC_CACHE, "w") as f:
+                json.dump(magics, f)
+        except OSError:
+            pass
+
+    return rook_masks, magics["rook"], tables["rook"], bishop_masks, magics["bishop"], tables["bishop"]
+
+KNIGHT_ATTACKS = _leaper([(-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)])
+KING_ATTACKS = _leaper(ROOK_DIRS + BISHOP_DIRS)
+PAWN_ATTACKS = [_leaper([(1, -1), (1, 1)]), _leaper([(-1, -1), (-1, 1)])]
+
+ROOK_MASKS, ROOK_MAGICS, ROOK_TABLES, BISHOP_MASKS, BISHOP_MAGICS, BISHOP_TABLES = _init_sliders()
+ROOK_SHIFTS = [64 - mask.bit_count() for mask in ROOK_MASKS]
+BISHOP_SHIFTS = [64 - mask.bit_count() for mask in BISHOP_MASKS]
+
+ROOK_EMPTY = [_slide(sq, 0, ROOK_DIRS) for sq in range(64)]
+BISHOP_EMPTY = [_slide(sq, 0, BISHOP_DIRS) for sq in range(64)]
+
+def rook_attacks(sq: int, occ: int) -> int:
+    return ROOK_TABLES[sq][(((occ & ROOK_MASKS[sq]) * ROOK_MAGICS[sq]) & M64) >> ROOK_SHIFTS[sq]]
+
+def bishop_attacks(sq: int, occ: int) -> int:
+    return BISHOP_TABLES[sq][(((occ & BISHOP_MASKS[sq]) * BISHOP_MAGICS[sq]) & M64) >> BISHOP_SHIFTS[sq]]
+
+def _between() -> tuple[list[list[int]], list[list[int]]]:
+    between = [[0] * 64 for _ in range(64)]
+    line = [[0] * 64 for _ in range(64)]
+
+    for a in range(64):
+        for b in range(64):
+            if a == b:
+                continue
+            for empty, attacks in [(ROOK_EMPTY, rook_attacks), (BISHOP_EMPTY, bishop_attacks)]:
+                if empty[a] & (1 << b):
+                    between[a][b] = attacks(a, 1 << b) & attacks(b, 1 << a)
+                    line[a][b] = (empty[a] & empty[b]) | (1 << a) | (1 << b)
+
+    return between, line
+
+BETWEEN, LINE = _between()
+
+CASTLE_MASK = [15] * 64
+CASTLE_MASK[4] = 15 & ~(CASTLE_WK | CASTLE_WQ)
+CASTLE_MASK[7] = 15 & ~CASTLE_WK
+CASTLE_MASK[0] = 15 & ~CASTLE_WQ
+CASTLE_MASK[60] = 15 & ~(CASTLE_BK | CASTLE_BQ)
+CASTLE_MASK[63] = 15 & ~CASTLE_BK
+CASTLE_MASK[56] = 15 & ~CASTLE_BQ
+
+PROMOTIONS = (QUEEN, KNIGHT, ROOK, BISHOP)
+
+def square_index(alg: str) -> int:
+    return (ord(alg[0]) - ord('a')) + 8 * (int(alg[1]) - 1)
+
+def encode_move(move: int) -> str:
+    prom = move >> 12
+    if prom:
+        return SQUARE_NAMES[move & 63] + SQUARE_NAMES[(move >> 6) & 63] + "=" + PROMOTION_CHARS[prom]
+    return SQUARE_NAMES[move & 63] + SQUARE_NAMES[(move >> 6) & 63]
+
+def decode_move(move: str) -> int:
+    packed = square_index(move[0:2]) | (square_index(move[2:4]) << 6)
+    if len(move) >= 6 and move[4] == '=':
+        packed |= PROMOTION_KINDS[move[5]] << 12
+    return packed
+
+class Position:
+
+    def __init__(self, fen: str = START_POS) -> None:
+        self.bb = [0] * 15
+        self.occ = [0, 0]
+        self.mailbox = [0] * 64
+
+        self.side = WHITE
+        self.castling = 0
+        self.ep = -1
+        self.halfmove = 0
+        self.fullmove = 1
+
+        self.history: list[tuple[int, int, int, int, int, int]] = []
+
+        self.load_fen(fen)
+
+    def load_fen(self, fen: str) -> None:
+        board = Board()
+        board.load_fen(fen)
+        self.load_board(board)
+
+    def load_board(self, board: Board) -> None:
+        self.bb = [0] * 15
+        self.occ = [0, 0]
+        self.mailbox = [0] * 64
+        self.history = []
+
+        for idx, piece in enumerate(board.squares):
+            if piece:
+                self.put(idx ^ 56, piece)
+
+        self.side = board.turn
+        self.castling = board.castling
+        self.ep = board.ep ^ 56 if board.ep is not None else -1
+        self.halfmove = board.halfmove
+        self.fullmove = board.fullmove
+
+    def to_board(self) -> Board:
+        board = Board()
+        board.squares[:] = bytes(self.mailbox[idx ^ 56] for idx in range(64))
+        board.rehash()
+        board.turn = self.side
+        board.castling = self.castling
+        board.ep = self.ep ^ 56 if self.ep >= 0 else None
+        board.halfmove = self.halfmove
+        board.fullmove = self.fullmove
+
+        return board
+
+    def to_fen(self) -> str:
+        return self.to_board().to_fen()
+
+    def ply(self) -> int:
+        return (self.fullmove - 1) * 2 + (self.side >> 3)
+
+    def san(self, move: int, legal: list[int]) -> str:
+        fr = move & 63
+        to = (move >> 6) & 63
+        kind = self.mailbox[fr] & 7
+
+        if kind == KING and to - fr == 2:
+            return "O-O"
+        if kind == KING and fr - to == 2:
+            return "O-O-O"
+
+        if kind == PAWN:
+            text = SQUARE_NAMES[fr][0] + "x" + SQUARE_NAMES[to] if (fr ^ to) & 7 else SQUARE_NAMES[to]
+            return text + "=" + PROMOTION_CHARS[move >> 12] if move >> 12 else text
+
+        others = [other & 63 for other in legal if (other >> 6) & 63 == to and other & 63 != fr and self.mailbox[other & 63] & 7 == kind]
+
+        text = SAN_CHARS[kind]
+        if len(others) > 0:
+            if all((other ^ fr) & 7 for other in others):
+                text += SQUARE_NAMES[fr][0]
+            elif all((other ^ fr) >> 3 for other in others):
+                text += SQUARE_NAMES[fr][1]
+            else:
+                text += SQUARE_NAMES[fr]
+
+        return text + ("x" if self.mailbox[to] else "") + SQUARE_NAMES[to]
+
+    def parse_san(self, text: str, legal: list[int]) -> int:
+        san = text.rstrip("+#!?")
+
+        if san in ["O-O", "0-0", "O-O-O", "0-0-0"]:
+            fr = self.bb[KING | self.side].bit_length() - 1
+            to = fr + 2 if len(san) == 3 else fr - 2
+            candidates = [move for move in legal if move & 63 == fr and (move >> 6) & 63 == to]
+        else:
+            prom = 0
+            if len(san) > 2 and san[-1] in PROMOTION_KINDS and san[0].islower():
+                prom = PROMOTION_KINDS[san[-1]]
+                san = san[:-2] if san[-2] == '=' else san[:-1]
+
+            kind = PAWN
+            if san[0] in SAN_KINDS:
+                kind = SAN_KINDS[san[0]]
+                san = san[1:]
+
+            san = san.replace("x", "").replace("-", "")
+            if len(san) < 2 or san[-2] not in "abcdefgh" or san[-1] not in "12345678":
+                raise Exception("Incorrect move", text)
+
+            to = square_index(san[-2:])
+            hint = san[:-2]
+
+            candidates = [move for move in legal if (move >> 6) & 63 == to and move >> 12 == prom and self.mailbox[move & 63] & 7 == kind
+                and all(c in SQUARE_NAMES[move & 63] for c in hint)]
+
+        if len(candidates) != 1:
+            raise Exception("Illegal or ambiguous move", text)
+
+        return candidates[0]
+
+    def check_suffix(self, legal: list[int]) -> str:
+        if not self.in_check():
+            return ""
+        return "#" if len(legal) == 0 else "+"
+
+    def put(self, sq: int, piece: int) -> None:
+        bit = 1 << sq
+        self.bb[piece] |= bit
+        self.occ[piece >> 3] |= bit
+        self.mailbox[sq] = piece
+
+    def attackers_to(self, sq: int, occ: int) -> int:
+        bb = self.bb
+        return ((KNIGHT_ATTACKS[sq] & (bb[KNIGHT] | bb[KNIGHT | BLACK]))
+            | (KING_ATTACKS[sq] & (bb[KING] | bb[KING | BLACK]))
+            | (PAWN_ATTACKS[0][sq] & bb[PAWN | BLACK])
+            | (PAWN_ATTACKS[1][sq] & bb[PAWN])
+            | (rook_attacks(sq, occ) & (bb[ROOK] | bb[ROOK | BLACK] | bb[QUEEN] | bb[QUEEN | BLACK]))
+            | (bishop_attacks(sq, occ) & (bb[BISHOP] | bb[BISHOP | BLACK] | bb[QUEEN] | bb[QUEEN | BLACK])))
+
+    def attacked(self, sq: int, by: int, occ: int) -> bool:
+        bb = self.bb
+        if KNIGHT_ATTACKS[sq] & bb[KNIGHT | by]:
+            return True
+        if PAWN_ATTACKS[(by >> 3) ^ 1][sq] & bb[PAWN | by]:
+            return True
+        if KING_ATTACKS[sq] & bb[KING | by]:
+            return True
+        queens = bb[QUEEN | by]
+        if rook_attacks(sq, occ) & (bb[ROOK | by] | queens):
+            return True
+        if bishop_attacks(sq, occ) & (bb[BISHOP | by] | queens):
+            return True
+        return False
+
+    def in_check(self) -> bool:
+        king = self.bb[KING | self.side]
+        return self.attacked(king.bit_length() - 1, self.side ^ BLACK, self.occ[0] | self.occ[1])
+
+    def legal_moves(self) -> list[int]:
+        us = self.side
+        them = us ^ BLACK
+        bb = self.bb
+        own = self.occ[us >> 3]
+        opp = self.occ[them >> 3]
+        occ = own | opp
+        ksq = bb[KING | us].bit_length() - 1
+
+        moves: list[int] = []
+        append = moves.append
+
+        occ_no_king = occ ^ (1 << ksq)
+        targets = KING_ATTACKS[ksq] & ~own
+        while targets:
+            low = targets & -targets
+            to = low.bit_length() - 1
+            targets ^= low
+            if not self.attacked(to, them, occ_no_king):
+                append(ksq | (to << 6))
+
+        checkers = self.attackers_to(ksq, occ) & opp
+        if checkers & (checkers - 1):
+            return moves
+
+        if checkers:
+            mask = BETWEEN[ksq][checkers.bit_length() - 1] | checkers
+        else:
+            mask = M64 ^ own
+
+        their_rq = bb[ROOK | them] | bb[QUEEN | them]
+        their_bq = bb[BISHOP | them] | bb[QUEEN | them]
+
+        pinned = 0
+        snipers = (ROOK_EMPTY[ksq] & their_rq) | (BISHOP_EMPTY[ksq] & their_bq)
+        while snipers:
+            low = snipers & -snipers
+            snipers ^= low
+            blockers = BETWEEN[ksq][low.bit_length() - 1] & occ
+            if blockers and not (blockers & (blockers - 1)) and blockers & own:
+                pinned |= blockers
+
+        line = LINE[ksq]
+
+        pieces = bb[KNIGHT | us] & ~pinned
+        while pieces:
+            low = pieces & -pieces
+            fr = low.bit_length() - 1
+            pieces ^= low
+            targets = KNIGHT_ATTACKS[fr] & mask
+            while targets:
+                low = targets & -targets
+                targets ^= low
+                append(fr | ((low.bit_length() - 1) << 6))
+
+        for sliders, attacks in [(bb[BISHOP | us] | bb[QUEEN | us], bishop_attacks), (bb[ROOK | us] | bb[QUEEN | us], rook_attacks)]:
+            while sliders:
+                low = sliders & -sliders
+                fr = low.bit_length() - 1
+                sliders ^= low
+                targets = attacks(fr, occ) & mask
+                if pinned & low:
+                    targets &= line[fr]
+                while targets:
+                    low = targets & -targets
+                    targets ^= low
+                    append(fr | ((low.bit_length() - 1) << 6))
+
+        empty = M64 ^ occ
+        if us == WHITE:
+            step, start_rank, last_rank = 8, 1, 7
+        else:
+            step, start_rank, last_rank = -8, 6, 0
+
+        pawn_attacks = PAWN_ATTACKS[us >> 3]
+        pawns = bb[PAWN | us]
+        while pawns:
+            low = pawns & -pawns
+            fr = low.bit_length() - 1
+            pawns ^= low
+
+            allowed = mask
+            if pinned & low:
+                allowed &= line[fr]
+
+            targets = pawn_attacks[fr] & opp & allowed
+            to = fr + step
+            if empty & (1 << to):
+                if allowed & (1 << to):
+                    targets |= 1 << to
+                if fr >> 3 == start_rank and empty & (1 << (to + step)) and allowed & (1 << (to + step)):
+                    targets |= 1 << (to + step)
+
+            while targets:
+                low = targets & -targets
+                targets ^= low
+                to = low.bit_length() - 1
+                if to >> 3 == last_rank:
+                    for prom in PROMOTIONS:
+                        append(fr | (to << 6) | (prom << 12))
+                else:
+                    append(fr | (to << 6))
+
+            if self.ep >= 0 and pawn_attacks[fr] & (1 << self.ep):
+                cap_sq = self.ep - step
+                occ_after = occ ^ (1 << fr) ^ (1 << self.ep) ^ (1 << cap_sq)
+                if not (self.attackers_to(ksq, occ_after) & (opp ^ (1 << cap_sq))):
+                    append(fr | (self.ep << 6))
+
+        if not checkers:
+            rights = self.castling >> (0 if us == WHITE else 2)
+            home = 4 if us == WHITE else 60
+            if rights & 1 and not (occ & (0b11 << (home + 1))) and not self.attacked(home + 1, them, occ) and not self.attacked(home + 2, them, occ):
+                append(home | ((home + 2) << 6))
+            if rights & 2 and not (occ & (0b111 << (home - 3))) and not self.attacked(home - 1, them, occ) and not self.attacked(home - 2, them, occ):
+                append(home | ((home - 2) << 6))
+
+        return moves
+
+    def make_move(self, move: int) -> None:
+        fr = move & 63
+        to = (move >> 6) & 63
+        prom = move >> 12
+
+        bb = self.bb
+        occ = self.occ
+        mailbox = self.mailbox
+
+        piece = mailbox[fr]
+        color = piece & BLACK
+        kind = piece & 7
+
+        captured = mailbox[to]
+        cap_sq = to
+        if kind == PAWN and to == self.ep:
+            cap_sq = to - 8 if color == WHITE else to + 8
+            captured = mailbox[cap_sq]
+
+        self.history.append((move, captured, cap_sq, self.castling, self.ep, self.halfmove))
+
+        if captured:
+            bit = 1 << cap_sq
+            bb[captured] ^= bit
+            occ[(color >> 3) ^ 1] ^= bit
+            mailbox[cap_sq] = 0
+
+        bits = (1 << fr) | (1 << to)
+        bb[piece] ^= bits
+        occ[color >> 3] ^= bits
+        mailbox[fr] = 0
+        mailbox[to] = piece
+
+        if prom:
+            bit = 1 << to
+            bb[piece] ^= bit
+            bb[prom | color] ^= bit
+            mailbox[to] = prom | color
+
+        if kind == KING and (to - fr == 2 or fr - to == 2):
+            rook_fr, rook_to = (fr + 3, fr + 1) if to > fr else (fr - 4, fr - 1)
+            bits = (1 << rook_fr) | (1 << rook_to)
+            bb[ROOK | color] ^= bits
+            occ[color >> 3] ^= bits
+            mailbox[rook_fr] = 0
+            mailbox[rook_to] = ROOK | color
+
+        self.castling &= CASTLE_MASK[fr] & CASTLE_MASK[to]
+        self.ep = (fr + to) >> 1 if kind == PAWN and (to - fr == 16 or fr - to == 16) else -1
+        self.halfmove = 0 if kind == PAWN or captured else self.halfmove + 1
+        if color == BLACK:
+            self.fullmove += 1
+        self.side ^= BLACK
+
+    def unmake_move(self) -> None:
+        move, captured, cap_sq, self.castling, self.ep, self.halfmove = self.history.pop()
+
+        fr = move & 63
+        to = (move >> 6) & 63
+        prom = move >> 12
+
+        bb = self.bb
+        occ = self.occ
+        mailbox = self.mailbox
+
+        self.side ^= BLACK
+        color = self.side
+        if color == BLACK:
+            self.fullmove -= 1
+
+        piece = mailbox[to]
+        if prom:
+            bit = 1 << to
+            bb[piece] ^= bit
+            piece = PAWN | color
+            bb[piece] ^= bit
+
+        bits = (1 << fr) | (1 << to)
+        bb[piece] ^= bits
+        occ[color >> 3] ^= bits
+        mailbox[to] = 0
+        mailbox[fr] = piece
+
+        if captured:
+            bit = 1 << cap_sq
+            bb[captured] ^= bit
+            occ[(color >> 3) ^ 1] ^= bit
+            mailbox[cap_sq] = captured
+
+        if piece & 7 == KING and (to - fr == 2 or fr - to == 2):
+            rook_fr, rook_to = (fr + 3, fr + 1) if to > fr else (fr - 4, fr - 1)
+            bits = (1 << rook_fr) | (1 << rook_to)
+            bb[ROOK | color] ^= bits
+            occ[color >> 3] ^= bits
+            mailbox[rook_to] = 0
+            mailbox[rook_fr] = ROOK | color
+
+    def perft(self, depth: int) -> int:
+        moves = self.legal_moves()
+        if depth == 1:
+            return len(moves)
+
+        nodes = 0
+        for move in moves:
+            self.make_move(move)
+            nodes += self.perft(depth - 1)
+            self.unmake_move()
+
+        return nodes
+
+TARGET_NPS = 1_000_000
+
+if __name__ == '__main__':
+    try:
+        max_depth = int(sys.argv[1])
+    except IndexError:
+        max_depth = 5
+
+    total_nodes = 0
+    total_time = 0.0
+
+    for fen, expected in PERFT_SUITE:
+        pos = Position(fen)
+        depth = min(max_depth, len(expected))
+
+        start = time.perf_counter()
+        nodes = pos.perft(depth)
+        elapsed = time.perf_counter() - start
+
+        total_nodes += nodes
+        total_time += elapsed
+
+        status = "ok" if nodes == expected[depth - 1] else f"FAIL (expected {expected[depth - 1]})"
+        print(f"{fen}  depth {depth}: {nodes} nodes in {elapsed:.3f}s ({nodes / max(elapsed, 1e-9):.0f} nodes/s) {status}")
+
+    nps = total_nodes / max(total_time, 1e-9)
+    print(f"Total: {total_nodes} nodes in {total_time:.3f}s ({nps:.0f} nodes/s, target {TARGET_NPS})")
@@ -0,0 +1,208 @@
+import sys, time, random
+from enum import Enum
+
+START_POS = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+class Piece(Enum):
+    NONE = 0
+
+    PAWN_W = 1
+    ROOK_W = 2
+    KNIGHT_W = 3
+    BISHOP_W = 4
+    QUEEN_W = 5
+    KING_W = 6
+
+    PAWN_B = 9
+    ROOK_B = 10
+    KNIGHT_B = 11
+    BISHOP_B = 12
+    QUEEN_B = 13
+    KING_B = 14
+
+PIECES = [Piece(value) if value in Piece._value2member_map_ else Piece.NONE for value in range(16)]
+
+BLACK = 8
+
+VIEW_WHITE = [[y * 8 + x for x in range(8)] for y in range(8)]
+VIEW_BLACK = [[(7 - y) * 8 + x for x in range(8)] for y in range(8)]
+
+FEN_CHARS = "PRNBQK"
+CASTLING_CHARS = "KQkq"
+
+FEN_TABLE = {ord(c): chr(value) for c, value in zip(FEN_CHARS + FEN_CHARS.lower(), list(range(1, 7)) + list(range(9, 15)))}
+FEN_TABLE.update({ord(str(n)): "\0" * n for n in range(1, 9)})
+FEN_TABLE[ord('/')] = None
+
+SQUARE_CHARS = bytes.maketrans(bytes(range(15)), b"1PRNBQK11prnbqk")
+EMPTY_RUNS = [("1" * n, str(n)) for n in range(8, 1, -1)]
+
+CASTLING_TABLE = {c: 1 << i for i, c in enumerate(CASTLING_CHARS)}
+
+SQUARE_NAMES = [chr(ord('a') + sq % 8) + str(8 - sq // 8) for sq in range(64)]
+SQUARE_INDEX = {name: sq for sq, name in enumerate(SQUARE_NAMES)}
+
+_zobrist_rng = random.Random(0x2B0B)
+ZOBRIST_PIECES = [0 if value == 0 else _zobrist_rng.getrandbits(64) for idx in range(64) for value in range(16)]
+ZOBRIST_TURN = [0] * BLACK + [_zobrist_rng.getrandbits(64)]
+ZOBRIST_CASTLING = [_zobrist_rng.getrandbits(64) for _ in range(16)]
+ZOBRIST_EP = {idx: _zobrist_rng.getrandbits(64) for idx in range(64)}
+ZOBRIST_EP[None] = 0
+
+class Board:
+
+    def __init__(self) -> None:
+        self.squares = bytearray(64)
+        self.turn = 0
+        self.castling = 0
+        self.ep: int | None = None
+        self.halfmove = 0
+        self.fullmove = 1
+
+        self.hash = 0
+
+        self.journal: list[tuple[int, int]] | None = None
+        self.journal_state: tuple[int, int, int | None, int, int] = (0, 0, None, 0, 1)
+
+    def __getitem__(self, idx: int) -> Piece:
+        return PIECES[self.squares[idx]]
+
+    def __setitem__(self, idx: int, piece: Piece) -> None:
+        self.put(idx, piece.value)
+
+    def put(self, idx: int, value: int) -> None:
+        old = self.squares[idx]
+        if self.journal is not None:
+            self.journal.append((idx, old))
+
+        self.hash ^= ZOBRIST_PIECES[idx * 16 + old] ^ ZOBRIST_PIECES[idx * 16 + value]
+        self.squares[idx] = value
+
+    def key(self) -> int:
+        return self.hash ^ ZOBRIST_TURN[self.turn] ^ ZOBRIST_CASTLING[self.castling] ^ ZOBRIST_EP[self.ep]
+
+    def rehash(self) -> None:
+        self.hash = 0
+        for idx, value in enumerate(self.squares):
+            self.hash ^= ZOBRIST_PIECES[idx * 16 + value]
+
+    def begin(self) -> None:
+        self.journal = []
+        self.journal_state = (self.turn, self.castling, self.ep, self.halfmove, self.fullmove)
+
+    def commit(self) -> None:
+        self.journal = None
+
+    def rollback(self) -> list[int]:
+        touched = []
+
+        if self.journal is not None:
+            for idx, value in reversed(self.journal):
+                self.hash ^= ZOBRIST_PIECES[idx * 16 + self.squares[idx]] ^ ZOBRIST_PIECES[idx * 16 + value]
+                self.squares[idx] = value
+                touched.append(idx)
+
+            self.turn, self.castling, self.ep, self.halfmove, self.fullmove = self.journal_state
+
+        self.journal = None
+
+        return touched
+
+    def advance(self, reset_halfmove: bool) -> None:
+        self.halfmove = 0 if reset_halfmove else self.halfmove + 1
+        if self.turn == BLACK:
+            self.fullmove += 1
+        self.turn ^= BLACK
+
+    def load_fen(self, fen: str) -> None:
+        fields = fen.split()
+        if len(fields) == 0:
+            raise Exception("Incorrect FEN string", fen)
+
+        ranks = [rank.translate(FEN_TABLE) for rank in fields[0].split('/')]
+        if len(ranks) != 8 or any(len(rank) != 8 for rank in ranks):
+            raise Exception("Incorrect FEN string", fen)
+
+        try:
+            squares = "".join(ranks).encode("latin-1")
+        except UnicodeEncodeError:
+            raise Exception("Incorrect FEN string", fen)
+
+        if max(squares) > 14:
+            raise Exception("Incorrect FEN string", fen)
+
+        self.squares[:] = squares
+        self.rehash()
+        self.turn = BLACK if len(fields) > 1 and fields[1] == 'b' else 0
+
+        self.castling = 0
+        if len(fields) > 2:
+            for c in fields[2]:
+                self.castling |= CASTLING_TABLE.get(c, 0)
+
+        self.ep = SQUARE_INDEX.get(fields[3]) if len(fields) > 3 else None
+        self.halfmove = int(fields[4]) if len(fields) > 4 else 0
+        self.fullmove = int(fields[5]) if len(fields) > 5 else 1
+
+    def to_fen(self) -> str:
+        chars = self.squares.translate(SQUARE_CHARS).decode("ascii")
+        ranks = []
+        for row in range(0, 64, 8):
+            rank = chars[row:row + 8]
+            for run, count in EMPTY_RUNS:
+                rank = rank.replace(run, count)
+            ranks.append(rank)
+
+        castling = "".join(c for c in CASTLING_CHARS if self.castling & CASTLING_TABLE[c]) or "-"
+        ep = SQUARE_NAMES[self.ep] if self.ep is not None else "-"
+
+        return f"{'/'.join(ranks)} {'b' if self.turn else 'w'} {castling} {ep} {self.halfmove} {self.fullmove}"
+
+    def ply(self) -> int:
+        return (self.fullmove - 1) * 2 + (self.turn >> 3)
+
+    def clear(self) -> None:
+        self.squares[:] = bytes(64)
+        self.hash = 0
+
+    def snapshot(self) -> bytes:
+        return bytes(self.squares)
+
+    def restore(self, snapshot: bytes) -> None:
+        self.squares[:] = snapshot
+        self.rehash()
+
+if __name__ == '__main__':
+    from bitboard import Position
+
+    try:
+        count = int(sys.argv[1])
+    except IndexError:
+        count = 20000
+
+    rng = random.Random(0)
+    corpus = []
+    pos = Position()
+    while len(corpus) < count:
+        moves = pos.legal_moves()
+        if len(moves) == 0 or pos.halfmove >= 100:
+            pos = Position()
+            continue
+        pos.make_move(rng.choice(moves))
+        corpus.append(pos.to_fen())
+
+    board = Board()
+
+    start = time.perf_counter()
+    for fen in corpus:
+        board.load_fen(fen)
+    parse_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for fen in corpus:
+        board.load_fen(fen)
+        if board.to_fen() != fen:
+            raise Exception("FEN round trip mismatch", fen, board.to_fen())
+    round_trip_time = time.perf_counter() - start
+
+    print(f"{count} positions: parse {parse_time * 1e6 / count:.2f}us/position, parse + serialize {round_trip_time * 1e6 / count:.2f}us/position")
@@ -1,196 +1,198 @@
-import sys, pygame
-from enum import Enum
-import socket, select
-from collections import deque
-import math, random
-import copy
-
-START_POS = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
-
-class Piece(Enum):
-    NONE = 0
-
-    PAWN_W = 1
-    ROOK_W = 2
-    KNIGHT_W = 3
-    BISHOP_W = 4
-    QUEEN_W = 5
-    KING_W = 6
-
-    PAWN_B = 9
-    ROOK_B = 10
-    KNIGHT_B = 11
-    BISHOP_B = 12
-    QUEEN_B = 13
-    KING_B = 14
+import argparse, time, pygame
+import socket
+import math
+from board import Piece, PIECES, BLACK, FEN_CHARS, SQUARE_INDEX
+from movegen import CASTLE_MASK
+from session import Session, RECONNECT_DELAYS, RECONNECT_TIMEOUT
+from render import Compositor, BoardView
+from assets import load_sprites, promotion_menu, check_circle, square_tint
+from netio import Connection, NET_MESSAGE, NET_CLOSED, NET_RESUMED
+from metrics import Metrics
+from protocol import MOVE_RE, split_clock
+
+RESIZE_SETTLE = 0.25
+MIN_CELL = 16
+CLOCK_BAR = 40
+OVERLAY_INTERVAL = 0.5
+OVERLAY_FONT = 20
+OVERLAY_KEY = pygame.K_F3
+BANNER_FONT = 48
 
 class CloseException(Exception):
     pass
 
-class Game:
+class Game(BoardView):
 
-    def __init__(self, sock: socket.socket, screen: pygame.Surface, clock: pygame.time.Clock) -> None:
-        self.sock = sock
+    def __init__(self, sock: socket.socket, screen: pygame.Surface, clock: pygame.time.Clock, room: str | None = None) -> None:
         self.clock = clock
 
-        self.screen_size = screen.get_size()
         self.screen = screen
 
-        self.board_size = self.screen_size
-        self.cell_size = (self.board_size[0] / 8, self.board_size[1] / 8)
-
         self.color_dark = (181, 136, 99)
         self.color_light = (240, 217, 181)
         self.color_pos = (100, 109, 64)
         self.color_check = (240, 20, 20, 180)
+        self.color_premove = (20, 30, 85, 110)
+        self.color_clock = (40, 40, 40)
+        self.color_clock_run = (230, 230, 230)
+        self.color_overlay = (20, 20, 20)
+        self.color_overlay_text = (220, 220, 220)
 
-        self.board: list[list[Piece]] = []
+        self.possible_moves = None
 
-        self.white = False
-        self.spectator = False
+        self.premoves: list[str] = []
+        self.arrived = 0.0
+        self.received: float | None = None
+        self.move_sent: float | None = None
+        self.cache_counted = (0, 0)
 
-        self.moved = False
+        BoardView.__init__(self, sock, room)
 
-        self.possible_moves = None
+        self.prom_menu_coords = None
+        self.prom_move = None
 
-        self.en_passant_tgt = None
+        self.cell_size = (0, 0)
+        self.preview = False
+        self.resized = 0.0
 
-        self.my_turn = False
+        self.clock_font: pygame.font.Font | None = None
+        self.clock_shown: tuple[str, str, int] | None = None
 
-        self.checked_me = False
-        self.checked_opp = False
+        self.overlay = False
+        self.overlay_font: pygame.font.Font | None = None
+        self.overlay_surface: pygame.Surface | None = None
+        self.overlay_at = 0.0
 
-        self.sync_board(START_POS)
+        self.reconnecting = False
+        self.banner_font: pygame.font.Font | None = None
+        self.banner_surface: pygame.Surface | None = None
 
-        self.sprites: list[pygame.Surface | None] = [None for _ in range(15)]
+        self.layout(screen.get_size())
 
-        for file, piece in [("wP", Piece.PAWN_W), ("wR", Piece.ROOK_W), ("wN", Piece.KNIGHT_W), ("wB", Piece.BISHOP_W), ("wQ", Piece.QUEEN_W), ("wK", Piece.KING_W), ("bP", Piece.PAWN_B), ("bR", Piece.ROOK_B), ("bN", Piece.KNIGHT_B), ("bB", Piece.BISHOP_B), ("bQ", Piece.QUEEN_B), ("bK", Piece.KING_B)]:
-            svg = pygame.image.load(f"resources/{file}.png")
-            img = pygame.transform.scale(svg, self.cell_size).convert_alpha()
-            self.sprites[piece.value] = img
+    def layout(self, screen_size: tuple[int, int], preview: bool = False) -> None:
+        cell = max(MIN_CELL, min(screen_size[0], screen_size[1] - self.clock_bar()) // 8)
 
-        self.prom_select_w = pygame.Surface((2 * self.cell_size[0], 2 * self.cell_size[1]))
-        self.prom_select_w.fill((255, 255, 255))
-        self.prom_select_w.blit(self.sprites[Piece.QUEEN_W.value], (0, 0))
-        self.prom_select_w.blit(self.sprites[Piece.KNIGHT_W.value], (self.cell_size[1], 0))
-        self.prom_select_w.blit(self.sprites[Piece.ROOK_W.value], (0, self.cell_size[0]))
-        self.prom_select_w.blit(self.sprites[Piece.BISHOP_W.value], (self.cell_size[1], self.cell_size[0]))
-        pygame.draw.rect(self.prom_select_w, (0, 0, 0), (0, 0, self.cell_size[0] * 2, self.cell_size[1] * 2), 1)
+        if self.cell_size == (cell, cell) and (preview or not self.preview):
+            self.screen_size = screen_size
+            self.redraw_all = True
+            return
 
-        self.prom_select_b = pygame.Surface((2 * self.cell_size[0], 2 * self.cell_size[1]))
-        self.prom_select_b.fill((255, 255, 255))
-        self.prom_select_b.blit(self.sprites[Piece.QUEEN_B.value], (0, 0))
-        self.prom_select_b.blit(self.sprites[Piece.KNIGHT_B.value], (self.cell_size[1], 0))
-        self.prom_select_b.blit(self.sprites[Piece.ROOK_B.value], (0, self.cell_size[0]))
-        self.prom_select_b.blit(self.sprites[Piece.BISHOP_B.value], (self.cell_size[1], self.cell_size[0]))
-        pygame.draw.rect(self.prom_select_b, (0, 0, 0), (0, 0, self.cell_size[0] * 2, self.cell_size[1] * 2), 1)
+        if self.prom_menu_coords != None:
+            scale = cell / self.cell_size[0]
+            self.prom_menu_coords = (self.prom_menu_coords[0] * scale, self.prom_menu_coords[1] * scale)
 
-        self.prom_menu_coords = None
-        self.prom_move = None
+        self.screen_size = screen_size
+        self.cell_size = (cell, cell)
+        self.board_size = (8 * cell, 8 * cell)
 
-        self.check_circle = pygame.Surface(self.cell_size, pygame.SRCALPHA)
-        self.check_circle.fill((0, 0, 0, 0))
-        pygame.draw.circle(self.check_circle, self.color_check, (self.cell_size[0] / 2, self.cell_size[1] / 2), self.cell_size[0] / 2)
+        self.preview = preview
+        if preview:
+            self.resized = time.perf_counter()
 
-    def __del__(self):
-        self.sock.close()
+        self.sprites = load_sprites(self.cell_size, preview)
+        self.check_circle = check_circle(self.cell_size, self.color_check)
+        self.premove_mark = square_tint(self.cell_size, self.color_premove)
+        self.layers = Compositor(self.cell_size, self.sprites, self.check_circle, self.color_dark, self.color_light, self.color_pos)
 
-    def sync_board(self, FEN: str) -> None:
-        self.board = []
-        rank: list[Piece] = []
-        for i, p in enumerate(FEN):
-            match p:
-                case 'P':
-                    rank.append(Piece.PAWN_W)
-                case 'R':
-                    rank.append(Piece.ROOK_W)
-                case 'N':
-                    rank.append(Piece.KNIGHT_W)
-                case 'B':
-                    rank.append(Piece.BISHOP_W)
-                case 'Q':
-                    rank.append(Piece.QUEEN_W)
-                case 'K':
-                    rank.append(Piece.KING_W)
-
-                case 'p':
-                    rank.append(Piece.PAWN_B)
-                case 'r':
-                    rank.append(Piece.ROOK_B)
-                case 'n':
-                    rank.append(Piece.KNIGHT_B)
-                case 'b':
-                    rank.append(Piece.BISHOP_B)
-                case 'q':
-                    rank.append(Piece.QUEEN_B)
-                case 'k':
-                    rank.append(Piece.KING_B)
-
-                case '/':
-                    if len(rank) != 8:
-                        raise Exception("Incorrect FEN string", FEN)
-
-                    self.board.append(rank.copy())
-                    rank.clear()
-
-                case ' ':
-                    if len(rank) != 8:
-                        raise Exception("Incorrect FEN string", FEN)
-
-                    self.board.append(rank.copy())
-                    break
-
-                case _:
-                    rank.extend([Piece.NONE for _ in range(int(p))])
+        self.redraw_all = True
+        self.pieces_stale = True
 
-    def start(self) -> None:
-        init_msg = self.read_socket()
+    def settle(self) -> bool:
+        if not self.preview or time.perf_counter() - self.resized < RESIZE_SETTLE:
+            return False
 
-        if init_msg == "wbs":
-            resp = random.choice("wb")
-            self.white = (resp == "w")
-            self.write_socket(resp)
+        self.layout(self.screen_size)
+        return True
 
-        elif init_msg == "ws":
-            self.white = True
-            self.write_socket("w")
+    def clock_bar(self) -> int:
+        return CLOCK_BAR if self.time_control != None else 0
 
-        elif init_msg == "bs":
-            self.white = False
-            self.write_socket("b")
+    def wait_time(self) -> int | None:
+        waits = []
 
-        else:
-            self.spectator = True
-            self.white = True
-            self.write_socket("s")
+        if self.preview:
+            waits.append(round(RESIZE_SETTLE * 1000))
 
-        pos = self.read_socket()
+        if self.time_control != None and self.clock_running:
+            ms = self.remaining(self.clock_side)
+            waits.append(ms % (100 if ms < 10000 else 1000) + 1)
 
-        init_msg = self.read_socket()
+        if self.overlay:
+            waits.append(round(OVERLAY_INTERVAL * 1000))
 
-        if init_msg == "initfail":
-            raise Exception("Failed to initialize connection")
-        
-        if init_msg != "initok":
-            raise Exception("Unknown initialization message")
+        metrics_wait = self.metrics.wait()
+        if metrics_wait != None:
+            waits.append(round(metrics_wait * 1000) + 1)
 
-        self.sync_board(pos)
+        return min(waits) if len(waits) > 0 else None
 
-        self.in_progress = True
+    def start(self) -> None:
+        self.handshake()
 
-        to_send = deque([])
+        if self.time_control != None:
+            self.layout(self.screen.get_size())
 
-        dragging = None
+        self.redraw_all = True
+        self.pieces_stale = True
 
-        if self.white and not self.spectator:
-            self.my_turn = True
+        self.conn = Connection(self.sock, self.read_messages, self.write_socket)
+        self.conn.start()
+
+        dragging = None
 
         while self.in_progress:
-            for event in pygame.event.get():
+            events = pygame.event.get()
+            if len(events) == 0 and dragging is None:
+                timeout = self.wait_time()
+                events = [pygame.event.wait(timeout) if timeout != None else pygame.event.wait()]
+
+            frame_start = time.perf_counter()
+            net_time = 0.0
+
+            for event in events:
                 if event.type == pygame.QUIT:
+                    self.conn.close()
                     raise CloseException()
 
+                if event.type == NET_MESSAGE:
+                    net_start = time.perf_counter()
+                    self.arrived = event.received
+                    for msg in event.msgs:
+                        self.handle_message(msg)
+                    net_time += time.perf_counter() - net_start
+                    continue
+
+                if event.type == NET_CLOSED:
+                    if event.conn is self.conn:
+                        if dragging is not None:
+                            self.mark_rect_dirty(dragging[1])
+                            dragging = None
+                        self.resume_connection()
+                    continue
+
+                if event.type == NET_RESUMED:
+                    if event.conn is self.conn:
+                        self.finish_resume(event.reply)
+                    continue
+
+                if event.type == pygame.VIDEORESIZE:
+                    self.layout(self.screen.get_size(), True)
+                    if dragging is not None:
+                        dragging[1].size = self.cell_size
+                    continue
+
+                if event.type == pygame.KEYDOWN and event.key == OVERLAY_KEY:
+                    self.toggle_overlay()
+                    continue
+
                 if event.type == pygame.MOUSEBUTTONDOWN:
+                    if self.reconnecting:
+                        continue
+
+                    if event.button == 3:
+                        self.clear_premoves()
+                        continue
+
                     if self.prom_menu_coords != None:
                         if event.pos[0] < self.prom_menu_coords[0] or event.pos[0] > self.prom_menu_coords[0] + 2 * self.cell_size[0] or event.pos[1] < self.prom_menu_coords[1] or event.pos[1] > self.prom_menu_coords[1] + 2 * self.cell_size[1]:
                             continue
@@ -205,22 +207,21 @@ class Game:
                             prom = Piece.BISHOP_W if self.white else Piece.BISHOP_B
 
                         orig_x, orig_y, x, y = self.prom_move
-                        to_send.append(self.encode_move(orig_x, orig_y, x, y, prom))
+                        self.send_move(self.encode_move(orig_x, orig_y, x, y, prom))
 
                         self.set_piece(y, x, prom)
 
+                        self.mark_rect_dirty(self.prom_menu_rect())
                         self.prom_menu_coords = None
                         continue
-                    if self.moved or not self.my_turn:
-                        continue
 
-                    if event.pos[0] > self.board_size[0] or event.pos[1] > self.board_size[1]:
+                    if self.spectator or event.pos[0] >= self.board_size[0] or event.pos[1] >= self.board_size[1]:
                         continue
 
-                    self.origboard = copy.deepcopy(self.board)
+                    premove = self.moved or not self.my_turn
 
                     x, y = math.floor(event.pos[0] / self.cell_size[0]), math.floor(event.pos[1] / self.cell_size[1])
-                    piece = self.get_piece(y, x)
+                    piece = PIECES[self.premove_squares()[self.view[y][x]]] if premove else self.get_piece(y, x)
 
                     if piece == Piece.NONE:
                         continue
@@ -233,22 +234,40 @@ class Game:
 
                     rect.topleft = event.pos
 
-                    dragging = (piece, rect, (x, y))
+                    dragging = (piece, rect, (x, y), premove)
 
-                    self.del_piece(y, x)
+                    if premove:
+                        continue
+
+                    query_start = time.perf_counter()
+                    origin = self.view[y][x]
+                    targets = [self.screen_coords(dst) for src, dst, _ in self.move_cache.get(self.board, piece.value & BLACK)[0] if src == origin]
+                    self.metrics.record("moves_query_ms", (time.perf_counter() - query_start) * 1000)
+                    self.set_possible_moves(((y, x), targets))
 
-                    to_send.append("moves " + self.encode_alg(x, y))
+                    self.board.begin()
+                    self.del_piece(y, x)
 
                 if event.type == pygame.MOUSEBUTTONUP:
                     if dragging is None:
                         continue
                     
-                    piece, rect, (orig_x, orig_y)  = dragging
+                    piece, rect, (orig_x, orig_y), premove = dragging
 
                     dragging = None
+                    self.mark_rect_dirty(rect)
+
+                    if premove:
+                        if 0 <= event.pos[0] < self.board_size[0] and 0 <= event.pos[1] < self.board_size[1]:
+                            x, y = math.floor(event.pos[0] / self.cell_size[0]), math.floor(event.pos[1] / self.cell_size[1])
+                            if x != orig_x or y != orig_y:
+                                prom = Piece.QUEEN_W if piece in [Piece.PAWN_W, Piece.PAWN_B] and y in [0, 7] else Piece.NONE
+                                self.queue_premove(self.encode_move(orig_x, orig_y, x, y, prom))
+                        continue
 
                     if event.pos[0] >= self.board_size[0] or event.pos[0] < 0 or event.pos[1] >= self.board_size[1] or event.pos[1] < 0:
                         self.set_piece(orig_y, orig_x, piece)
+                        self.board.commit()
 
                     else:
                         x, y = math.floor(event.pos[0] / self.cell_size[0]), math.floor(event.pos[1] / self.cell_size[1])
@@ -259,305 +278,471 @@ class Game:
                             if piece in [Piece.PAWN_W, Piece.PAWN_B] and y in [0, 7]:
                                 menu_x, menu_y = pygame.mouse.get_pos()
 
-                                if menu_x > self.screen_size[0] / 2:
+                                if menu_x > self.board_size[0] / 2:
                                     menu_x -= self.cell_size[0] * 2
-                                if menu_y > self.screen_size[1] / 2:
-                                    menu_y -= self.cell_size[0] * 2
+                                if menu_y > self.board_size[1] / 2:
+                                    menu_y -= self.cell_size[1] * 2
 
                                 self.prom_menu_coords = (menu_x, menu_y)
                                 self.prom_move = (orig_x, orig_y, x, y)
+                                self.mark_rect_dirty(self.prom_menu_rect())
 
                             if self.prom_menu_coords == None:
-                                to_send.append(self.encode_move(orig_x, orig_y, x, y))
+                                self.send_move(self.encode_move(orig_x, orig_y, x, y))
                             self.moved = True
-                            self.possible_moves = None
+                            self.set_possible_moves(None)
 
-                            if self.translate_coords(y, x) == self.en_passant_tgt:
+                            if piece in [Piece.PAWN_W, Piece.PAWN_B] and self.view[y][x] == self.board.ep:
                                 if y == 5:
                                     self.del_piece(4, x)
                                 else:
                                     self.del_piece(3, x)
 
-                            self.en_passant_tgt = None
+                            self.board.advance(piece in [Piece.PAWN_W, Piece.PAWN_B] or self.get_value(y, x) != 0)
+                            self.board.castling &= CASTLE_MASK[self.view[orig_y][orig_x]] & CASTLE_MASK[self.view[y][x]]
+                            self.board.ep = None
 
                             if piece in [Piece.PAWN_W, Piece.PAWN_B] and abs(y - orig_y) == 2:
-                                self.en_passant_tgt = self.translate_coords(round((y + orig_y)/2), x)
+                                self.board.ep = self.view[round((y + orig_y)/2)][x]
 
                             if piece in [Piece.KING_W, Piece.KING_B]:
                                 if x - orig_x == 2:
-                                    self.set_piece(orig_y, orig_x + 1, Piece(Piece.ROOK_W.value | (piece.value & 8)))
+                                    self.set_piece(orig_y, orig_x + 1, PIECES[Piece.ROOK_W.value | (piece.value & BLACK)])
                                     self.del_piece(orig_y, 7)
                                 elif x - orig_x == -2:
-                                    self.set_piece(orig_y, orig_x - 1, Piece(Piece.ROOK_W.value | (piece.value & 8)))
+                                    self.set_piece(orig_y, orig_x - 1, PIECES[Piece.ROOK_W.value | (piece.value & BLACK)])
                                     self.del_piece(orig_y, 0)
 
                         self.set_piece(y, x, piece)
-            
-            self.draw(self.screen)
+
+                        if not self.moved:
+                            self.board.commit()
+
+            self.settle()
 
             if dragging is not None:
-                piece, rect, _ = dragging
+                piece, rect, _, _ = dragging
+                prev_rect = rect.copy()
                 rect.center = pygame.mouse.get_pos()
-                self.screen.blit(self.sprites[piece.value], rect)
+                if rect != prev_rect:
+                    self.mark_rect_dirty(prev_rect)
+                    self.mark_rect_dirty(rect)
 
-            pygame.display.flip()
+            draw_start = time.perf_counter()
+            rects = self.draw_dirty(self.screen)
 
-            ready_read, ready_write, _ = select.select([self.sock], [self.sock], [], 0.008)
-            if len(ready_read) > 0:
-                try:
-                    msg = self.read_socket()
-                except:
-                    self.in_progress = False
-                    continue
+            if len(rects) > 0:
+                if dragging is not None:
+                    piece, rect, _, _ = dragging
+                    self.screen.blit(self.sprites[piece.value], rect)
 
-                if msg.startswith("ok"):
-                    self.checked_opp = False
-                    self.checked_me = False
-                    self.moved = False
-                    self.my_turn = False
-                    self.origboard = None
-                    self.possible_moves = None
-                    if msg[-1] == '+' or msg[-1] == '#':
-                        self.checked_opp = True
-                elif msg == "no":
-                    self.board = self.origboard
-                    self.origboard = None
-                    self.moved = False
-                    self.possible_moves = None
-                elif msg.startswith("moves "):
-                    moves: list[tuple[int, int]] = []
-                    origin = self.decode_alg(msg[6:8])
-                    for i in range(9, len(msg), 2):
-                        try:
-                            moves.append(self.decode_alg(msg[i:i+2]))
-                        except:
-                            continue
-                    self.possible_moves = (origin, moves)
-                elif msg.startswith("end "):
-                    self.score = msg[4:]
-                    print(msg[4:])
-                    self.in_progress = False
-                    continue
-                else:
-                    self.move_piece(msg)
-                    self.checked_me = False
-                    self.checked_opp = False
-                    if msg[-1] == '+' or msg[-1] == '#':
-                        self.checked_me = True
-                    if not self.spectator:
-                        self.my_turn = True
+                flip_start = time.perf_counter()
+                pygame.display.update(rects)
+                self.metrics.count("frames")
 
-            elif len(ready_write) > 0 and len(to_send) > 0:
-                self.write_socket(to_send.popleft())
+                self.record_frame(frame_start, draw_start, flip_start)
+            else:
+                self.metrics.count("frames_skipped")
 
-            dt = self.clock.tick(60) / 1000
+            if net_time > 0.0:
+                self.metrics.record("frame_net_ms", net_time * 1000)
+            self.metrics.record("send_queue", self.conn.pending())
+            self.record_move_cache()
+            self.metrics.tick()
 
+            if dragging is not None:
+                self.clock.tick(60)
+
+        self.conn.close()
         self.sock.close()
 
+    def record_frame(self, start: float, draw_start: float, flip_start: float) -> None:
+        end = time.perf_counter()
+        self.metrics.record("frame_ms", (end - start) * 1000)
+        self.metrics.record("frame_draw_ms", (flip_start - draw_start) * 1000)
+        self.metrics.record("frame_flip_ms", (end - flip_start) * 1000)
+
+    def record_move_cache(self) -> None:
+        hits, misses = self.move_cache.hits, self.move_cache.misses
+        self.metrics.count("move_cache_hits", hits - self.cache_counted[0])
+        self.metrics.count("move_cache_misses", misses - self.cache_counted[1])
+        self.cache_counted = (hits, misses)
+
+    def send(self, msg: str) -> None:
+        self.conn.send(msg)
+
+    def read_messages(self) -> list[str]:
+        msgs = Session.read_messages(self)
+
+        if "ping" in msgs:
+            self.conn.send("pong")
+            msgs = [msg for msg in msgs if msg != "ping"]
+
+        return msgs
+
+    def send_move(self, move: str, premove: bool = False) -> None:
+        self.sent_move = move
+        self.move_sent = time.perf_counter()
+        self.conn.send(move)
+
+        if self.received != None:
+            self.metrics.record("premove_reply_ms" if premove else "reply_ms", (time.perf_counter() - self.received) * 1000)
+            self.received = None
+
+    def premove_squares(self) -> bytearray:
+        squares = bytearray(self.board.squares)
+
+        for move in self.premoves:
+            src, dst = SQUARE_INDEX[move[0:2]], SQUARE_INDEX[move[2:4]]
+            piece = squares[src]
+            if len(move) >= 6:
+                piece = (FEN_CHARS.index(move[5]) + 1) | (piece & BLACK)
+            squares[src] = 0
+            squares[dst] = piece
+
+        return squares
+
+    def queue_premove(self, move: str) -> None:
+        self.premoves.append(move)
+        self.metrics.count("premoves_queued")
+        self.mark_premoves()
+
+        self.play_premove()
+
+    def clear_premoves(self) -> None:
+        self.mark_premoves()
+        self.metrics.count("premoves_cancelled", len(self.premoves))
+        self.premoves.clear()
+
+    def mark_premoves(self) -> None:
+        for move in self.premoves:
+            self.dirty.add(self.decode_alg(move[0:2]))
+            self.dirty.add(self.decode_alg(move[2:4]))
+
+    def play_premove(self) -> None:
+        if len(self.premoves) == 0 or self.moved or not self.my_turn or not self.in_progress or self.reconnecting:
+            return
+
+        self.mark_premoves()
+        move = self.premoves.pop(0)
+
+        color = 0 if self.white else BLACK
+        prom = (FEN_CHARS.index(move[5]) + 1) | color if len(move) >= 6 else 0
+        if (SQUARE_INDEX[move[0:2]], SQUARE_INDEX[move[2:4]], prom) not in self.move_cache.get(self.board, color)[0]:
+            self.metrics.count("premoves_rejected")
+            self.clear_premoves()
+            return
+
+        self.board.begin()
+        self.move_piece(move)
+        self.moved = True
+        self.set_possible_moves(None)
+
+        self.send_move(move, True)
+        self.metrics.count("premoves_sent")
+
+    def resume_connection(self) -> None:
+        if not self.in_progress:
+            self.conn.close()
+            return
+
+        if self.prom_menu_coords != None:
+            self.mark_rect_dirty(self.prom_menu_rect())
+            self.prom_menu_coords = None
+
+        self.retract()
+        self.set_possible_moves(None)
+        self.clear_premoves()
+
+        self.reconnecting = True
+        self.set_banner("Reconnecting...")
+
+        self.conn.resume(self.reconnect, RECONNECT_TIMEOUT)
+
+    def finish_resume(self, reply: str | None) -> None:
+        self.reconnecting = False
+        self.set_banner(None)
+
+        if reply == None:
+            self.in_progress = False
+            return
+
+        self.apply_resume(reply)
+        self.redraw_all = True
+
+        self.conn = Connection(self.sock, self.read_messages, self.write_socket)
+        self.conn.start()
+
+    def handle_message(self, msg: str) -> None:
+        if msg.startswith("moves "):
+            moves: list[tuple[int, int]] = []
+            origin = self.decode_alg(msg[6:8])
+            for i in range(9, len(msg), 2):
+                try:
+                    moves.append(self.decode_alg(msg[i:i+2]))
+                except:
+                    continue
+            self.set_possible_moves((origin, moves))
+            return
+
+        Session.handle_message(self, msg)
+
+        if (msg.startswith("ok") or msg == "no") and self.move_sent != None:
+            self.metrics.record("move_rtt_ms", (time.perf_counter() - self.move_sent) * 1000)
+            self.move_sent = None
+
+        if msg.startswith("ok"):
+            self.set_possible_moves(None)
+        elif msg == "no":
+            self.set_possible_moves(None)
+            self.clear_premoves()
+        elif msg.startswith("end "):
+            self.clear_premoves()
+            print(self.score)
+        elif self.my_turn and MOVE_RE.fullmatch(split_clock(msg)[0]) is not None:
+            self.received = self.arrived
+            self.play_premove()
+
     def draw(self, surface: pygame.Surface) -> None:
         surface.fill("darkgreen")
 
-        for i in range(8):
-            for j in range(8):
-                coords = (j * self.cell_size[1], i * self.cell_size[0])
-                pygame.draw.rect(surface, self.color_dark if (i + j) % 2 == int(self.white) else self.color_light, (coords, self.cell_size))
+        self.refresh_layers()
+        self.layers.draw_board(surface, self.overlays())
 
-                piece = self.get_piece(i, j)
+        if self.prom_menu_coords != None:
+            surface.blit(self.prom_select(), self.prom_menu_coords)
 
-                if self.possible_moves != None:
-                    if (i, j) == self.possible_moves[0]:
-                        pygame.draw.rect(surface, self.color_pos, (coords, self.cell_size))
-                    elif (i, j) in self.possible_moves[1]:
-                        if piece == Piece.NONE and self.translate_coords(i, j) != self.en_passant_tgt:
-                            pygame.draw.circle(surface, self.color_pos, (coords[0] + self.cell_size[1] / 2, coords[1] + self.cell_size[0] / 2), self.cell_size[0] / 6)
-                        else:
-                            pygame.draw.circle(surface, self.color_pos, (coords[0] + self.cell_size[1] / 2, coords[1] + self.cell_size[0] / 2), self.cell_size[0] / 2, round(self.cell_size[0] / 20))
+        self.clock_shown = None
+        self.draw_clocks(surface)
 
-                if piece == Piece.NONE:
-                    continue
+        if self.banner_surface != None:
+            surface.blit(self.banner_surface, self.banner_rect())
 
-                if self.checked_me:
-                    if piece == Piece(Piece.KING_W.value | ((1-int(self.white)) << 3)):
-                        surface.blit(self.check_circle, coords)
+        if self.overlay_surface != None:
+            surface.blit(self.overlay_surface, (0, 0))
 
-                if self.checked_opp:
-                    if piece == Piece(Piece.KING_W.value | (int(self.white) << 3)):
-                        surface.blit(self.check_circle, coords)
+        self.redraw_all = False
+        self.dirty.clear()
 
-                sprite = self.sprites[piece.value]
-                rect = sprite.get_rect()
-                rect = rect.move(self.cell_size[0] * j, self.cell_size[1] * i)
-                surface.blit(sprite, rect)
+    def draw_dirty(self, surface: pygame.Surface) -> list[pygame.Rect]:
+        self.refresh_overlay()
 
-        if self.prom_menu_coords != None:
-            prom_select = self.prom_select_w if self.white else self.prom_select_b
-            surface.blit(prom_select, self.prom_menu_coords)
+        if self.redraw_all:
+            self.draw(surface)
+            self.metrics.count("squares_drawn", 64)
+            return [surface.get_rect()]
 
-    def translate_coords(self, y: int, x: int) -> tuple[int, int]:
-        return (y, x) if self.white else (7-y, x)
+        rects: list[pygame.Rect] = []
 
-    def get_piece(self, y: int, x: int) -> Piece:
-        return self.board[y][x] if self.white else self.board[7-y][x]
+        if len(self.dirty) > 0:
+            self.refresh_layers()
+            overlays = self.overlays()
 
-    def del_piece(self, y: int, x: int) -> None:
-        if not self.white:
-            y = 7 - y
-        self.board[y][x] = Piece.NONE
+            rects = [self.layers.draw_square(surface, i, j, overlays.get((i, j))) for i, j in self.dirty]
+            self.metrics.count("squares_drawn", len(self.dirty))
+            self.dirty.clear()
 
-    def set_piece(self, y: int, x: int, piece: Piece) -> None:
-        if not self.white:
-            y = 7 - y
-        self.board[y][x] = piece
+            if self.prom_menu_coords != None:
+                prom_rect = self.prom_menu_rect()
+                if prom_rect.collidelist(rects) != -1:
+                    surface.blit(self.prom_select(), self.prom_menu_coords)
+                    rects.append(prom_rect)
 
-    def move_piece(self, move: str) -> None:
+        clock_rect = self.draw_clocks(surface)
+        if clock_rect != None:
+            rects.append(clock_rect)
 
-        if len(move) < 4:
-            raise Exception("Incorrect move", move)
+        if self.banner_surface != None:
+            banner_rect = self.banner_rect()
+            if banner_rect.collidelist(rects) != -1:
+                surface.blit(self.banner_surface, banner_rect)
+                rects.append(banner_rect)
 
-        src_r, src_f = self.decode_alg(move[0:2])
-        dst_r, dst_f = self.decode_alg(move[2:4])
+        if self.overlay_surface != None:
+            overlay_rect = self.overlay_surface.get_rect()
+            if overlay_rect.collidelist(rects) != -1:
+                surface.blit(self.overlay_surface, overlay_rect)
+                rects.append(overlay_rect)
 
-        if self.get_piece(src_r, src_f) == Piece.NONE:
-            raise Exception("Cannot move a NULL piece", move)
+        return rects
 
-        if self.translate_coords(dst_r, dst_f) == self.en_passant_tgt:
-            if dst_r == 5:
-                self.del_piece(4, dst_f)
-            else:
-                self.del_piece(3, dst_f)
+    def toggle_overlay(self) -> None:
+        self.overlay = not self.overlay
+        self.metrics.enabled = self.overlay or self.metrics.path != None
 
-        self.en_passant_tgt = None
+        self.overlay_surface = None
+        self.overlay_at = 0.0
+        self.redraw_all = True
 
-        piece = self.get_piece(src_r, src_f)
+    def refresh_overlay(self) -> None:
+        if not self.overlay or time.perf_counter() - self.overlay_at < OVERLAY_INTERVAL:
+            return
 
-        if piece in [Piece.PAWN_W, Piece.PAWN_B] and abs(dst_r - src_r) == 2:
-            self.en_passant_tgt = self.translate_coords(round((dst_r + src_r)/2), src_f)
+        self.overlay_at = time.perf_counter()
 
-        if piece in [Piece.KING_W, Piece.KING_B]:
-            if dst_f - src_f == 2:
-                self.set_piece(src_r, src_f + 1, Piece(Piece.ROOK_W.value | (piece.value & 8)))
-                self.del_piece(src_r, 7)
-            elif dst_f - src_f == -2:
-                self.set_piece(src_r, src_f - 1, Piece(Piece.ROOK_W.value | (piece.value & 8)))
-                self.del_piece(src_r, 0)
+        if self.overlay_font == None:
+            self.overlay_font = pygame.font.Font(None, OVERLAY_FONT)
 
-        if len(move) >= 6 and move[4] == '=':
-            prom = Piece.NONE
-            match move[5]:
-                case 'Q':
-                    prom = Piece.QUEEN_W
-                case 'N':
-                    prom = Piece.KNIGHT_W
-                case 'R':
-                    prom = Piece.ROOK_W
-                case 'B':
-                    prom = Piece.BISHOP_W
+        lines = [self.overlay_font.render(line, True, self.color_overlay_text) for line in self.metrics.lines(self.metrics.snapshot())]
+        if len(lines) == 0:
+            lines = [self.overlay_font.render("no metrics yet", True, self.color_overlay_text)]
 
-            piece = Piece(prom.value | (piece.value & 8))
+        overlay = pygame.Surface((max(line.get_width() for line in lines) + 8, sum(line.get_height() for line in lines) + 8))
+        overlay.fill(self.color_overlay)
 
-        self.set_piece(dst_r, dst_f, piece)
-        self.del_piece(src_r, src_f)
+        top = 4
+        for line in lines:
+            overlay.blit(line, (4, top))
+            top += line.get_height()
 
-    def encode_move(self, orig_x: int, orig_y: int, new_x: int, new_y: int, prom: Piece = Piece.NONE) -> str:
-        orig = self.encode_alg(orig_x, orig_y)
-        new = self.encode_alg(new_x, new_y)
+        prev = self.overlay_surface
+        self.overlay_surface = overlay
 
-        prom_str = ""
-        match prom:
-            case Piece.QUEEN_W | Piece.QUEEN_B:
-                prom_str = "=Q"
-            case Piece.KNIGHT_W | Piece.KNIGHT_B:
-                prom_str = "=N"
-            case Piece.ROOK_W | Piece.ROOK_B:
-                prom_str = "=R"
-            case Piece.BISHOP_W | Piece.BISHOP_B:
-                prom_str = "=B"
+        if prev != None and not overlay.get_rect().contains(prev.get_rect()):
+            self.redraw_all = True
+        else:
+            self.mark_rect_dirty(overlay.get_rect())
+
+    def set_banner(self, text: str | None) -> None:
+        if self.banner_surface != None:
+            self.mark_rect_dirty(self.banner_rect())
+            self.banner_surface = None
+
+        if text == None:
+            return
+
+        if self.banner_font == None:
+            self.banner_font = pygame.font.Font(None, BANNER_FONT)
 
-        return "".join([orig, new, prom_str])
+        label = self.banner_font.render(text, True, self.color_overlay_text)
+        self.banner_surface = pygame.Surface((label.get_width() + 24, label.get_height() + 16))
+        self.banner_surface.fill(self.color_overlay)
+        self.banner_surface.blit(label, (12, 8))
 
-    def decode_alg(self, alg: str) -> tuple[int, int]:
-        if len(alg) != 2:
-            raise Exception("Incorrect length of algebraic position", alg)
+        self.mark_rect_dirty(self.banner_rect())
 
-        file = ord(alg[0]) - ord('a')
-        rank = (8 - int(alg[1])) if self.white else (int(alg[1]) - 1)
+    def banner_rect(self) -> pygame.Rect:
+        return self.banner_surface.get_rect(center=(self.board_size[0] // 2, self.board_size[1] // 2))
 
-        if file < 0 or file >= 8 or rank < 0 or rank >= 8:
-            raise Exception("Incorrect position", alg)
+    def clock_text(self, color: int) -> str:
+        ms = self.remaining(color)
+        if ms < 10000:
+            return f"{ms // 1000}.{ms // 100 % 10}"
 
-        return (rank, file)
+        return f"{ms // 60000}:{ms // 1000 % 60:02d}"
 
-    def encode_alg(self, x: int, y: int) -> str:
-        if x >= 8 or x < 0 or y >= 8 or y < 0:
-            raise Exception("Incorrect position", x, y)
+    def draw_clocks(self, surface: pygame.Surface) -> pygame.Rect | None:
+        if self.time_control == None:
+            return None
 
-        file = chr(ord('a') + x)
-        rank = str((8 - y) if self.white else (y + 1))
+        shown = (self.clock_text(0), self.clock_text(BLACK), self.clock_side if self.clock_running else -1)
+        if shown == self.clock_shown:
+            return None
 
-        return "".join([file, rank])
+        self.clock_shown = shown
 
-    def read_socket(self) -> str:
+        if self.clock_font == None:
+            self.clock_font = pygame.font.Font(None, CLOCK_BAR)
 
-        buffer = bytearray(3)
-        chunks = memoryview(buffer)
-        total_recd = 0
+        bar = pygame.Rect(0, self.board_size[1], self.board_size[0], CLOCK_BAR)
+        surface.fill(self.color_clock, bar)
 
-        while total_recd < 3:
-            bytes_recd = self.sock.recv_into(chunks[total_recd:], min(3 - total_recd, 3))
-            if bytes_recd == 0:
-                raise Exception("Socket connection broken")
+        for idx, (label, color) in enumerate([("White", 0), ("Black", BLACK)]):
+            half = pygame.Rect(bar.left + idx * bar.width // 2, bar.top, bar.width // 2, bar.height)
+            running = shown[2] == color
+            if running:
+                surface.fill(self.color_clock_run, half.inflate(-4, -4))
 
-            total_recd += bytes_recd
+            text = self.clock_font.render(f"{label} {shown[idx]}", True, self.color_clock if running else self.color_clock_run)
+            surface.blit(text, text.get_rect(center=half.center))
 
-        bytes_expect = int(chunks[:total_recd])
+        return bar
+
+    def overlays(self) -> dict[tuple[int, int], list[pygame.Surface]]:
+        overlays: dict[tuple[int, int], list[pygame.Surface]] = {}
+
+        if self.possible_moves != None:
+            overlays[self.possible_moves[0]] = [self.layers.hint_origin]
+            for i, j in self.possible_moves[1]:
+                if self.get_value(i, j) == 0 and self.view[i][j] != self.board.ep:
+                    overlays[(i, j)] = [self.layers.hint_dot]
+                else:
+                    overlays[(i, j)] = [self.layers.hint_ring]
 
-        buffer = bytearray(bytes_expect)
-        chunks = memoryview(buffer)
-        total_recd = 0
+        for move in self.premoves:
+            overlays.setdefault(self.decode_alg(move[0:2]), []).append(self.premove_mark)
+            overlays.setdefault(self.decode_alg(move[2:4]), []).append(self.premove_mark)
 
-        while total_recd < bytes_expect:
-            bytes_recd = self.sock.recv_into(chunks[total_recd:], min(bytes_expect - total_recd, bytes_expect))
-            if bytes_recd == 0:
-                raise Exception("Socket connection broken")
+        self.mark_checks(overlays)
 
-            total_recd += bytes_recd
+        return overlays
 
-        return str(chunks[:total_recd], encoding="ascii").strip()
+    def mark_rect_dirty(self, rect: pygame.Rect) -> None:
+        left = max(0, math.floor(rect.left / self.cell_size[0]))
+        right = min(7, math.floor((rect.right - 1) / self.cell_size[0]))
+        top = max(0, math.floor(rect.top / self.cell_size[1]))
+        bottom = min(7, math.floor((rect.bottom - 1) / self.cell_size[1]))
 
-    def write_socket(self, msg: str) -> None:
-        msg = msg.strip()
-        msg = bytes(f"{str(len(msg)).rjust(3, '0')}{msg}", encoding="ascii")
+        for i in range(top, bottom + 1):
+            for j in range(left, right + 1):
+                self.dirty.add((i, j))
 
-        to_send = len(msg)
-        total_sent = 0
-        while total_sent < to_send:
-            sent = self.sock.send(msg[total_sent:])
+    def prom_select(self) -> pygame.Surface:
+        return promotion_menu(self.cell_size, self.white, self.preview)
 
-            if sent == 0:
-                raise Exception("Socket connection broken")
-            
-            total_sent += sent
+    def prom_menu_rect(self) -> pygame.Rect:
+        return pygame.Rect(self.prom_menu_coords, (math.ceil(2 * self.cell_size[0]), math.ceil(2 * self.cell_size[1])))
 
-def run(host: str, port: int):
+    def set_possible_moves(self, possible_moves: tuple[tuple[int, int], list[tuple[int, int]]] | None) -> None:
+        for moves in (self.possible_moves, possible_moves):
+            if moves != None:
+                self.dirty.add(moves[0])
+                self.dirty.update(moves[1])
+
+        self.possible_moves = possible_moves
+
+
+
+def run(host: str, port: int, room: str | None = None, metrics_path: str | None = None, overlay: bool = False, record_path: str | None = None):
     pygame.init()
     pygame.font.init()
 
     screen_size = width, height = 800, 800
-    screen = pygame.display.set_mode(screen_size)
+    screen = pygame.display.set_mode(screen_size, pygame.RESIZABLE)
     clock = pygame.time.Clock()
     running = True
     dt = 0
 
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.connect((host, port))
+    for delay in RECONNECT_DELAYS:
+        try:
+            sock = socket.create_connection((host, port))
+            break
+        except OSError:
+            time.sleep(delay)
+    else:
+        raise Exception("Could not connect to server", host, port)
 
-    game = Game(sock, screen, clock)
+    game = Game(sock, screen, clock, room)
+    game.metrics = Metrics(metrics_path != None, metrics_path)
+    if overlay:
+        game.toggle_overlay()
 
     try:
         game.start()
     except CloseException:
         running = False
 
+    if game.metrics.enabled:
+        print("\n".join(game.metrics.lines(game.metrics.snapshot())))
+        game.metrics.dump()
+
+    if record_path != None and not game.spectator:
+        from gamestore import GameWriter
+
+        store = GameWriter(record_path)
+        game.record(store)
+        store.close()
+
     if running:
         timer = 1.0
         game_over_font = pygame.font.SysFont("Inconsolata", 50)
@@ -585,17 +770,28 @@ def run(host: str, port: int):
 
         game_over = game_over_font.render(game_over_msg, True, (255, 255, 255), (0, 0, 0))
 
+    shown = False
+
     while running:
         for event in pygame.event.get():
             if event.type == pygame.QUIT or event.type == pygame.KEYDOWN:
                 running = False
+            elif event.type == pygame.VIDEORESIZE:
+                game.layout(screen.get_size(), True)
+                width, height = screen.get_size()
+                shown = False
+
+        if game.settle():
+            shown = False
 
-        game.draw(screen)
-        if timer <= 0:
-            go_rect = game_over.get_rect()
-            screen.blit(game_over, (width / 2 - go_rect.width / 2, height / 2 - go_rect.height / 2))
+        if not shown:
+            game.draw(screen)
+            if timer <= 0:
+                go_rect = game_over.get_rect()
+                screen.blit(game_over, (width / 2 - go_rect.width / 2, height / 2 - go_rect.height / 2))
+                shown = True
 
-        pygame.display.flip()
+            pygame.display.flip()
 
         dt = clock.tick(60) / 1000
         if timer > 0:
@@ -604,15 +800,14 @@ def run(host: str, port: int):
     pygame.quit()
 
 if __name__ == '__main__':
-    try:
-        host = sys.argv[1]
-    except IndexError:
-        host = "127.0.0.1"
-
-    try:
-        port = int(sys.argv[2])
-    except IndexError:
-        port = 40000
+    parser = argparse.ArgumentParser(description="Play or watch a game")
+    parser.add_argument("host", nargs="?", default="127.0.0.1")
+    parser.add_argument("port", nargs="?", type=int, default=40000)
+    parser.add_argument("room", nargs="?")
+    parser.add_argument("--metrics", help="record latency and throughput metrics and dump them to this JSON file periodically")
+    parser.add_argument("--overlay", action="store_true", help="record metrics and show them on screen (toggle with F3)")
+    parser.add_argument("--record", help="append the finished game to this game log, e.g. games.log")
 
-    run(host, port)
+    args = parser.parse_args()
 
+    run(args.host, args.port, args.room, args.metrics, args.overlay, args.record)
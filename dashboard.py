@@ -0,0 +1,235 @@
+import argparse, asyncio, math, selectors, socket, time, pygame
+from multiprocessing import Process
+from render import Compositor, BoardView
+from assets import load_sprites, check_circle
+from metrics import Metrics
+
+TARGET_FPS = 30
+TILE_GAP = 2
+
+COLOR_DARK = (181, 136, 99)
+COLOR_LIGHT = (240, 217, 181)
+COLOR_POS = (100, 109, 64)
+COLOR_CHECK = (240, 20, 20, 180)
+COLOR_OVER = (40, 40, 40)
+
+class Tile(BoardView):
+
+    def __init__(self, sock: socket.socket, room: str, rect: pygame.Rect, sprites: list[pygame.Surface | None], check_circle: pygame.Surface) -> None:
+        self.rect = rect
+
+        BoardView.__init__(self, sock, room)
+        self.watch = True
+
+        self.check_circle = check_circle
+        self.layers = Compositor((rect.width / 8, rect.height / 8), sprites, check_circle, COLOR_DARK, COLOR_LIGHT, COLOR_POS)
+
+    def receive(self) -> None:
+        try:
+            data = self.sock.recv(65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+
+        if len(data) == 0:
+            self.in_progress = False
+            self.redraw_all = True
+            return
+
+        msgs = self.reader.feed(data)
+        self.metrics.count("bytes_in", len(data))
+        self.metrics.count("msgs_in", len(msgs))
+
+        for msg in msgs:
+            self.handle_message(msg)
+
+        if not self.in_progress:
+            self.redraw_all = True
+
+    def draw(self, screen: pygame.Surface) -> list[pygame.Rect]:
+        if not self.redraw_all and len(self.dirty) == 0:
+            return []
+
+        self.refresh_layers()
+
+        surface = screen.subsurface(self.rect)
+        overlays = self.overlays()
+
+        if self.redraw_all:
+            self.layers.draw_board(surface, overlays)
+            if not self.in_progress:
+                pygame.draw.rect(surface, COLOR_OVER, surface.get_rect(), TILE_GAP)
+            rects = [self.rect]
+        else:
+            rects = [self.layers.draw_square(surface, i, j, overlays.get((i, j))).move(self.rect.topleft) for i, j in self.dirty]
+
+        self.redraw_all = False
+        self.dirty.clear()
+
+        return rects
+
+class Dashboard:
+
+    def __init__(self, screen: pygame.Surface, boards: int, metrics: Metrics | None = None) -> None:
+        self.screen = screen
+        self.metrics = metrics if metrics != None else Metrics()
+        self.clock = pygame.time.Clock()
+        self.selector = selectors.DefaultSelector()
+        self.tiles: list[Tile] = []
+
+        width, height = screen.get_size()
+        self.columns = math.ceil(math.sqrt(boards))
+        self.rows = math.ceil(boards / self.columns)
+        self.tile_size = min(width // self.columns, height // self.rows) - TILE_GAP
+        self.tile_size -= self.tile_size % 8
+
+        cell_size = (self.tile_size / 8, self.tile_size / 8)
+        self.sprites = load_sprites(cell_size)
+
+        self.check_circle = check_circle(cell_size, COLOR_CHECK)
+
+    def tile_rect(self, idx: int) -> pygame.Rect:
+        row, column = divmod(idx, self.columns)
+        step = self.tile_size + TILE_GAP
+        return pygame.Rect(column * step + TILE_GAP // 2, row * step + TILE_GAP // 2, self.tile_size, self.tile_size)
+
+    def watch(self, host: str, port: int, room: str) -> Tile:
+        tile = Tile(socket.create_connection((host, port)), room, self.tile_rect(len(self.tiles)), self.sprites, self.check_circle)
+        tile.metrics = self.metrics
+        tile.handshake()
+
+        for msg in tile.reader.parse():
+            tile.handle_message(msg)
+
+        tile.sock.setblocking(False)
+        self.selector.register(tile.sock, selectors.EVENT_READ, tile)
+        self.tiles.append(tile)
+
+        return tile
+
+    def run(self, seconds: float | None = None) -> None:
+        self.screen.fill(COLOR_OVER)
+        pygame.display.flip()
+
+        end = time.perf_counter() + seconds if seconds != None else None
+
+        while end == None or time.perf_counter() < end:
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    return
+
+            start = time.perf_counter()
+            ready = self.selector.select(0)
+            self.metrics.record("select_poll_ms", (time.perf_counter() - start) * 1000)
+
+            for key, _ in ready:
+                tile = key.data
+                moves = len(tile.moves)
+                tile.receive()
+                self.metrics.count("moves_shown", max(0, len(tile.moves) - moves))
+
+                if not tile.in_progress:
+                    self.selector.unregister(tile.sock)
+
+            draw_start = time.perf_counter()
+            rects = []
+            for tile in self.tiles:
+                squares = 64 if tile.redraw_all else len(tile.dirty)
+                drawn = tile.draw(self.screen)
+                if len(drawn) > 0:
+                    self.metrics.count("tiles_drawn")
+                    self.metrics.count("squares_drawn", squares)
+                rects.extend(drawn)
+
+            flip_start = time.perf_counter()
+            if len(rects) > 0:
+                pygame.display.update(rects)
+
+            done = time.perf_counter()
+            self.metrics.count("frames")
+
+            self.metrics.record("frame_net_ms", (draw_start - start) * 1000)
+            self.metrics.record("frame_draw_ms", (flip_start - draw_start) * 1000)
+            self.metrics.record("frame_flip_ms", (done - flip_start) * 1000)
+            self.metrics.record("frame_ms", (done - start) * 1000)
+            self.metrics.tick()
+
+            self.clock.tick(TARGET_FPS)
+
+    def report(self, elapsed: float) -> None:
+        if not self.metrics.enabled:
+            return
+
+        snapshot = self.metrics.snapshot()
+        totals = {name: counter["total"] for name, counter in snapshot["counters"].items()}
+        frames = totals.get("frames", 0)
+        frame_ms = snapshot["histograms"].get("frame_ms", {"p50": 0.0, "p99": 0.0})
+
+        print(f"{len(self.tiles)} boards, {frames} frames in {elapsed:.1f}s ({frames / max(elapsed, 1e-9):.1f} FPS, target {TARGET_FPS})")
+        print(f"Frame work p50 {frame_ms['p50']:.2f}ms, p99 {frame_ms['p99']:.2f}ms, budget {1000 / TARGET_FPS:.1f}ms")
+        print(f"{totals.get('moves_shown', 0)} moves shown, {totals.get('tiles_drawn', 0)} tile redraws, {totals.get('squares_drawn', 0)} squares redrawn ({64 * len(self.tiles) * frames} with full redraws)")
+
+        print("\n".join(self.metrics.lines(snapshot)))
+        self.metrics.dump()
+
+def run_players(host: str, port: int, games: int, think: float) -> None:
+    from headless import run_batch
+
+    asyncio.run(run_batch(host, port, games, 0, 0, [], 0.0, think))
+
+def run(host: str, port: int, rooms: list[str], size: int, seconds: float | None = None, metrics_path: str | None = None) -> None:
+    pygame.init()
+
+    screen = pygame.display.set_mode((size, size))
+    pygame.display.set_caption(f"Watching {len(rooms)} games")
+
+    dashboard = Dashboard(screen, len(rooms), Metrics(metrics_path != None or seconds != None, metrics_path))
+    for room in rooms:
+        dashboard.watch(host, port, room)
+
+    start = time.perf_counter()
+    dashboard.run(seconds)
+    dashboard.report(time.perf_counter() - start)
+
+    pygame.quit()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Watch many live games in one window")
+    parser.add_argument("rooms", nargs="*", help="rooms to watch")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=40000)
+    parser.add_argument("--batch", type=int, default=0, help="watch the rooms of a headless batch with this many games")
+    parser.add_argument("--size", type=int, default=1024, help="window width and height")
+    parser.add_argument("--seconds", type=float, help="stop after this long and report frame statistics from the metrics")
+    parser.add_argument("--bench", action="store_true", help="start a local server and headless players, then watch their games")
+    parser.add_argument("--think", type=float, default=0.5, help="seconds benchmark players wait before moving")
+    parser.add_argument("--metrics", help="record latency and throughput metrics and dump them to this JSON file periodically")
+
+    args = parser.parse_args()
+
+    rooms = args.rooms + [f"batch-0-{game}" for game in range(args.batch)]
+
+    if not args.bench:
+        run(args.host, args.port, rooms, args.size, args.seconds, args.metrics)
+    else:
+        from rooms import serve
+
+        with socket.socket() as probe:
+            probe.bind((args.host, 0))
+            port = probe.getsockname()[1]
+
+        games = args.batch if args.batch > 0 else 64
+        rooms = [f"batch-0-{game}" for game in range(games)]
+
+        server_proc = Process(target=serve, args=[args.host, port], daemon=True)
+        server_proc.start()
+        time.sleep(0.5)
+
+        players_proc = Process(target=run_players, args=[args.host, port, games, args.think], daemon=True)
+        players_proc.start()
+
+        run(args.host, port, rooms, args.size, args.seconds if args.seconds != None else 10.0, args.metrics)
+
+        players_proc.terminate()
+        server_proc.terminate()
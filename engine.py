@@ -0,0 +1,479 @@
+import argparse, select, socket, time
+from typing import Callable
+from board import BLACK, START_POS, ZOBRIST_PIECES, ZOBRIST_TURN, ZOBRIST_CASTLING, ZOBRIST_EP
+from movegen import WHITE, PAWN, ROOK, KNIGHT, BISHOP, QUEEN, KING, PERFT_SUITE
+from bitboard import Position, decode_move, encode_move
+from session import Session, RECONNECT_DELAYS
+from protocol import split_clock
+
+INFINITY = 1 << 20
+MATE = 1 << 16
+MAX_PLY = 64
+
+TT_SIZE = 1 << 18
+EXACT, LOWER, UPPER = 0, 1, 2
+
+CHECK_NODES = 1023
+POLL_NODES = 127
+
+MOVES_TO_GO = 30
+
+PIECE_VALUES = {PAWN: 100, KNIGHT: 320, BISHOP: 330, ROOK: 500, QUEEN: 900, KING: 0}
+ORDER_RANKS = {0: 0, PAWN: 1, KNIGHT: 2, BISHOP: 3, ROOK: 4, QUEEN: 5, KING: 6}
+
+PIECE_SQUARES = {
+    PAWN: [
+        0,  0,  0,  0,  0,  0,  0,  0,
+        50, 50, 50, 50, 50, 50, 50, 50,
+        10, 10, 20, 30, 30, 20, 10, 10,
+        5,  5, 10, 25, 25, 10,  5,  5,
+        0,  0,  0, 20, 20,  0,  0,  0,
+        5, -5,-10,  0,  0,-10, -5,  5,
+        5, 10, 10,-20,-20, 10, 10,  5,
+        0,  0,  0,  0,  0,  0,  0,  0],
+    KNIGHT: [
+        -50,-40,-30,-30,-30,-30,-40,-50,
+        -40,-20,  0,  0,  0,  0,-20,-40,
+        -30,  0, 10, 15, 15, 10,  0,-30,
+        -30,  5, 15, 20, 20, 15,  5,-30,
+        -30,  0, 15, 20, 20, 15,  0,-30,
+        -30,  5, 10, 15, 15, 10,  5,-30,
+        -40,-20,  0,  5,  5,  0,-20,-40,
+        -50,-40,-30,-30,-30,-30,-40,-50],
+    BISHOP: [
+        -20,-10,-10,-10,-10,-10,-10,-20,
+        -10,  0,  0,  0,  0,  0,  0,-10,
+        -10,  0,  5, 10, 10,  5,  0,-10,
+        -10,  5,  5, 10, 10,  5,  5,-10,
+        -10,  0, 10, 10, 10, 10,  0,-10,
+        -10, 10, 10, 10, 10, 10, 10,-10,
+        -10,  5,  0,  0,  0,  0,  5,-10,
+        -20,-10,-10,-10,-10,-10,-10,-20],
+    ROOK: [
+        0,  0,  0,  0,  0,  0,  0,  0,
+        5, 10, 10, 10, 10, 10, 10,  5,
+        -5,  0,  0,  0,  0,  0,  0, -5,
+        -5,  0,  0,  0,  0,  0,  0, -5,
+        -5,  0,  0,  0,  0,  0,  0, -5,
+        -5,  0,  0,  0,  0,  0,  0, -5,
+        -5,  0,  0,  0,  0,  0,  0, -5,
+        0,  0,  0,  5,  5,  0,  0,  0],
+    QUEEN: [
+        -20,-10,-10, -5, -5,-10,-10,-20,
+        -10,  0,  0,  0,  0,  0,  0,-10,
+        -10,  0,  5,  5,  5,  5,  0,-10,
+        -5,  0,  5,  5,  5,  5,  0, -5,
+        0,  0,  5,  5,  5,  5,  0, -5,
+        -10,  5,  5,  5,  5,  5,  0,-10,
+        -10,  0,  5,  0,  0,  0,  0,-10,
+        -20,-10,-10, -5, -5,-10,-10,-20],
+    KING: [
+        -30,-40,-40,-50,-50,-40,-40,-30,
+        -30,-40,-40,-50,-50,-40,-40,-30,
+        -30,-40,-40,-50,-50,-40,-40,-30,
+        -30,-40,-40,-50,-50,-40,-40,-30,
+        -20,-30,-30,-40,-40,-30,-30,-20,
+        -10,-20,-20,-20,-20,-20,-20,-10,
+        20, 20,  0,  0,  0,  0, 20, 20,
+        20, 30, 10,  0,  0, 10, 30, 20],
+}
+
+def _scores() -> list[int]:
+    scores = [0] * (16 * 64)
+    for kind, table in PIECE_SQUARES.items():
+        for sq in range(64):
+            scores[kind * 64 + sq] = PIECE_VALUES[kind] + table[sq ^ 56]
+            scores[(kind | BLACK) * 64 + sq] = -(PIECE_VALUES[kind] + table[sq])
+    return scores
+
+SCORES = _scores()
+
+PIECE_KEYS = [ZOBRIST_PIECES[(sq ^ 56) * 16 + piece] for sq in range(64) for piece in range(16)]
+SIDE_KEY = ZOBRIST_TURN[BLACK]
+EP_KEYS = {sq: ZOBRIST_EP[sq ^ 56] for sq in range(64)}
+EP_KEYS[-1] = 0
+
+BENCH_DEPTH = 4
+BENCH_SUITE = [fen for fen, _ in PERFT_SUITE] + [
+    "r1bqkb1r/pppp1ppp/2n2n2/4p2Q/2B1P3/8/PPPP1PPP/RNB1K1NR w KQkq - 4 4",
+    "6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1",
+]
+
+class Engine:
+
+    def __init__(self, tt_size: int = TT_SIZE) -> None:
+        self.table: list[tuple[int, int, int, int, int, int] | None] = [None] * tt_size
+        self.mask = tt_size - 1
+        self.generation = 0
+
+        self.killers = [[0, 0] for _ in range(MAX_PLY + 1)]
+        self.history = [0] * 4096
+
+        self.pos = Position()
+        self.key = 0
+        self.score = 0
+        self.stack: list[tuple[int, int]] = []
+        self.path: list[int] = []
+
+        self.nodes = 0
+        self.deadline = 0.0
+        self.stopped = False
+        self.best = 0
+        self.info: list[tuple[int, int, int, float, int]] = []
+        self.poll: Callable[[], None] | None = None
+
+    def set_position(self, pos: Position, history: list[int] | None = None) -> None:
+        self.pos = pos
+        self.key = pos.to_board().key()
+        self.score = sum(SCORES[piece * 64 + sq] for sq, piece in enumerate(pos.mailbox) if piece)
+        self.stack = []
+        self.path = (history if history != None else []) + [self.key]
+
+    def make(self, move: int) -> None:
+        pos = self.pos
+        fr = move & 63
+        to = (move >> 6) & 63
+        piece = pos.mailbox[fr]
+        castling = pos.castling
+        ep = pos.ep
+
+        pos.make_move(move)
+
+        _, captured, cap_sq, _, _, _ = pos.history[-1]
+        moved = pos.mailbox[to]
+
+        key = (self.key ^ PIECE_KEYS[fr * 16 + piece] ^ PIECE_KEYS[to * 16 + moved] ^ SIDE_KEY
+            ^ ZOBRIST_CASTLING[castling] ^ ZOBRIST_CASTLING[pos.castling] ^ EP_KEYS[ep] ^ EP_KEYS[pos.ep])
+        score = self.score - SCORES[piece * 64 + fr] + SCORES[moved * 64 + to]
+
+        if captured:
+            key ^= PIECE_KEYS[cap_sq * 16 + captured]
+            score -= SCORES[captured * 64 + cap_sq]
+
+        if piece & 7 == KING and (to - fr == 2 or fr - to == 2):
+            rook_fr, rook_to = (fr + 3, fr + 1) if to > fr else (fr - 4, fr - 1)
+            rook = ROOK | (piece & BLACK)
+            key ^= PIECE_KEYS[rook_fr * 16 + rook] ^ PIECE_KEYS[rook_to * 16 + rook]
+            score += SCORES[rook * 64 + rook_to] - SCORES[rook * 64 + rook_fr]
+
+        self.stack.append((self.key, self.score))
+        self.path.append(key)
+        self.key = key
+        self.score = score
+
+    def unmake(self) -> None:
+        self.pos.unmake_move()
+        self.path.pop()
+        self.key, self.score = self.stack.pop()
+
+    def evaluate(self) -> int:
+        return self.score if self.pos.side == WHITE else -self.score
+
+    def repeated(self) -> bool:
+        return self.key in self.path[max(0, len(self.path) - 1 - self.pos.halfmove):-1]
+
+    def probe(self) -> tuple[int, int, int, int, int, int] | None:
+        entry = self.table[self.key & self.mask]
+        return entry if entry != None and entry[0] == self.key else None
+
+    def store(self, depth: int, flag: int, score: int, move: int) -> None:
+        idx = self.key & self.mask
+        entry = self.table[idx]
+
+        if entry != None and entry[0] == self.key and move == 0:
+            move = entry[4]
+
+        if entry == None or entry[0] == self.key or entry[5] != self.generation or depth >= entry[1]:
+            self.table[idx] = (self.key, depth, flag, score, move, self.generation)
+
+    def mvv_lva(self, move: int) -> int:
+        mailbox = self.pos.mailbox
+        return ORDER_RANKS[mailbox[(move >> 6) & 63] & 7] * 8 + ORDER_RANKS[move >> 12] * 8 - ORDER_RANKS[mailbox[move & 63] & 7]
+
+    def order(self, moves: list[int], tt_move: int, ply: int) -> list[int]:
+        mailbox = self.pos.mailbox
+        killers = self.killers[ply]
+        history = self.history
+
+        def rank(move: int) -> int:
+            if move == tt_move:
+                return 1 << 30
+            if mailbox[(move >> 6) & 63] or move >> 12:
+                return (1 << 24) + self.mvv_lva(move)
+            if move == killers[0]:
+                return (1 << 23) + 1
+            if move == killers[1]:
+                return 1 << 23
+            return history[move & 4095]
+
+        return sorted(moves, key=rank, reverse=True)
+
+    def tick(self) -> None:
+        self.nodes += 1
+        if self.nodes & POLL_NODES == 0:
+            if self.poll != None:
+                self.poll()
+            if self.nodes & CHECK_NODES == 0 and time.perf_counter() > self.deadline:
+                self.stopped = True
+
+    def quiesce(self, alpha: int, beta: int, ply: int) -> int:
+        self.tick()
+        if self.stopped:
+            return 0
+
+        stand = self.evaluate()
+        if stand >= beta or ply >= MAX_PLY:
+            return stand
+        if stand > alpha:
+            alpha = stand
+
+        mailbox = self.pos.mailbox
+        captures = [move for move in self.pos.legal_moves() if mailbox[(move >> 6) & 63] or move >> 12]
+
+        for move in sorted(captures, key=self.mvv_lva, reverse=True):
+            self.make(move)
+            score = -self.quiesce(-beta, -alpha, ply + 1)
+            self.unmake()
+
+            if self.stopped:
+                return 0
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+
+        return alpha
+
+    def negamax(self, depth: int, alpha: int, beta: int, ply: int) -> int:
+        pos = self.pos
+        check = pos.in_check()
+        if check:
+            depth += 1
+
+        if depth <= 0 or ply >= MAX_PLY:
+            return self.quiesce(alpha, beta, ply)
+
+        self.tick()
+        if self.stopped:
+            return 0
+
+        if ply > 0 and (pos.halfmove >= 100 or self.repeated()):
+            return 0
+
+        tt_move = 0
+        entry = self.probe()
+        if entry != None:
+            _, tt_depth, flag, tt_score, tt_move, _ = entry
+            if tt_score > MATE - MAX_PLY:
+                tt_score -= ply
+            elif tt_score < MAX_PLY - MATE:
+                tt_score += ply
+
+            if ply > 0 and tt_depth >= depth and (flag == EXACT or (flag == LOWER and tt_score >= beta) or (flag == UPPER and tt_score <= alpha)):
+                return tt_score
+
+        moves = pos.legal_moves()
+        if len(moves) == 0:
+            return ply - MATE if check else 0
+
+        mailbox = pos.mailbox
+        best = -INFINITY
+        best_move = 0
+        flag = UPPER
+
+        for move in self.order(moves, tt_move, ply):
+            quiet = not mailbox[(move >> 6) & 63] and not move >> 12
+
+            self.make(move)
+            score = -self.negamax(depth - 1, -beta, -alpha, ply + 1)
+            self.unmake()
+
+            if self.stopped:
+                return 0
+
+            if score > best:
+                best = score
+                best_move = move
+
+            if score > alpha:
+                alpha = score
+                flag = EXACT
+
+            if alpha >= beta:
+                flag = LOWER
+                if quiet:
+                    killers = self.killers[ply]
+                    if killers[0] != move:
+                        killers[1] = killers[0]
+                        killers[0] = move
+                    self.history[move & 4095] += depth * depth
+                break
+
+        if ply == 0:
+            self.best = best_move
+
+        stored = best + ply if best > MATE - MAX_PLY else best - ply if best < MAX_PLY - MATE else best
+        self.store(depth, flag, stored, best_move)
+
+        return best
+
+    def search(self, pos: Position, limit: float | None = 1.0, max_depth: int = MAX_PLY, history: list[int] | None = None) -> int:
+        self.set_position(pos, history)
+
+        self.generation = (self.generation + 1) & 0xFF
+        self.killers = [[0, 0] for _ in range(MAX_PLY + 1)]
+        self.history = [value >> 2 for value in self.history]
+
+        start = time.perf_counter()
+        self.deadline = start + limit if limit != None else float("inf")
+        self.stopped = False
+        self.nodes = 0
+        self.info = []
+
+        best = 0
+        for depth in range(1, max_depth + 1):
+            score = self.negamax(depth, -INFINITY, INFINITY, 0)
+            if self.stopped:
+                break
+
+            best = self.best
+            elapsed = time.perf_counter() - start
+            self.info.append((depth, score, self.nodes, elapsed, best))
+
+            if abs(score) > MATE - MAX_PLY or (limit != None and elapsed > limit / 2):
+                break
+
+        if best == 0:
+            moves = pos.legal_moves()
+            best = self.order(moves, 0, 0)[0] if len(moves) > 0 else 0
+
+        return best
+
+class Bot(Session):
+
+    def __init__(self, sock: socket.socket, room: str | None = None, limit: float = 1.0) -> None:
+        Session.__init__(self, sock, room)
+
+        self.engine = Engine()
+        self.engine.poll = self.poll
+        self.limit = limit
+        self.inbox: list[str] = []
+
+    def start(self) -> None:
+        self.handshake()
+
+        while self.in_progress:
+            if self.my_turn and not self.moved:
+                self.play_move()
+                continue
+
+            msgs, self.inbox = self.inbox, []
+            for msg in msgs or self.read_messages():
+                self.handle_message(msg)
+
+    def poll(self) -> None:
+        if not self.in_progress:
+            return
+
+        received = self.reader.received
+        msgs = self.reader.parse()
+        if len(msgs) == 0 and len(select.select([self.sock], [], [], 0)[0]) > 0:
+            msgs = self.reader.recv(self.sock)
+
+        self.metrics.count("bytes_in", self.reader.received - received)
+        self.metrics.count("msgs_in", len(msgs))
+        for msg in msgs:
+            command = split_clock(msg)[0]
+            if command == "ping":
+                self.send("pong")
+            elif command.startswith("end "):
+                self.handle_message(msg)
+                self.engine.stopped = True
+            else:
+                self.inbox.append(msg)
+
+    def play_move(self) -> None:
+        self.poll()
+        if not self.in_progress:
+            return
+
+        pos = Position(self.start_fen)
+        history = []
+        for move in self.moves:
+            history.append(pos.to_board().key())
+            pos.make_move(decode_move(move))
+
+        move = self.engine.search(pos, self.time_budget(), MAX_PLY, history)
+        if move == 0 or not self.in_progress:
+            self.my_turn = False
+            return
+
+        text = encode_move(move)
+
+        self.board.begin()
+        self.move_piece(text)
+        self.moved = True
+
+        self.sent_move = text
+        self.write_socket(text)
+
+    def time_budget(self) -> float:
+        if self.time_control == None:
+            return self.limit
+
+        return min(self.limit, self.remaining(self.board.turn) / 1000 / MOVES_TO_GO + self.time_control[1] / 2000)
+
+def run_bot(host: str, port: int, room: str | None = None, limit: float = 1.0) -> None:
+    for delay in RECONNECT_DELAYS:
+        try:
+            sock = socket.create_connection((host, port))
+            break
+        except OSError:
+            time.sleep(delay)
+    else:
+        raise Exception("Could not connect to server", host, port)
+
+    bot = Bot(sock, room, limit)
+    bot.start()
+
+    print(f"Bot finished: {bot.score}")
+
+def bench(depth: int) -> None:
+    engine = Engine()
+    total_nodes = 0
+    total_time = 0.0
+
+    for fen in BENCH_SUITE:
+        engine.search(Position(fen), None, depth)
+        depth_reached, score, nodes, elapsed, best = engine.info[-1]
+
+        total_nodes += nodes
+        total_time += elapsed
+
+        to_depth = " ".join(f"d{d}:{t:.2f}s" for d, _, _, t, _ in engine.info)
+        print(f"{fen}  best {encode_move(best)} score {score} depth {depth_reached}: {nodes} nodes in {elapsed:.2f}s ({nodes / max(elapsed, 1e-9):.0f} nodes/s) [{to_depth}]")
+
+    print(f"Total: {total_nodes} nodes in {total_time:.2f}s ({total_nodes / max(total_time, 1e-9):.0f} nodes/s)")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Search a position, play as a bot against a server, or benchmark the engine")
+    parser.add_argument("--bench", action="store_true", help="search the position suite to a fixed depth and report nodes/s and time to depth")
+    parser.add_argument("--depth", type=int, help=f"search depth, default {BENCH_DEPTH} for --bench and unlimited otherwise")
+    parser.add_argument("--fen", default=START_POS, help="position to search")
+    parser.add_argument("--time", type=float, default=1.0, help="seconds per move")
+    parser.add_argument("--play", action="store_true", help="connect to a server and play as a bot")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=40000)
+    parser.add_argument("--room")
+
+    args = parser.parse_args()
+
+    if args.bench:
+        bench(args.depth if args.depth != None else BENCH_DEPTH)
+    elif args.play:
+        run_bot(args.host, args.port, args.room, args.time)
+    else:
+        engine = Engine()
+        engine.search(Position(args.fen), args.time, args.depth if args.depth != None else MAX_PLY)
+        for depth, score, nodes, elapsed, move in engine.info:
+            print(f"depth {depth} score {score} nodes {nodes} time {elapsed:.2f}s best {encode_move(move)}")
@@ -0,0 +1,262 @@
+import argparse, fcntl, mmap, os, random, struct, sys, time
+from typing import Iterable, Iterator
+from board import START_POS
+from bitboard import Position, decode_move
+
+GAMES_LOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "games.log")
+
+MAGIC = b"PYCHLOG1"
+
+INDEX = struct.Struct("<QIIHBx")
+
+RESULTS = ["*", "1-0", "0-1", "1/2-1/2"]
+RESULT_CODES = {result: code for code, result in enumerate(RESULTS)}
+
+FLUSH_GAMES = 64
+PGN_WIDTH = 79
+
+class GameWriter:
+
+    def __init__(self, path: str, flush_games: int = FLUSH_GAMES) -> None:
+        self.path = path
+        self.flush_games = flush_games
+
+        self.data = open(path, "ab")
+        self.index = open(path + ".idx", "ab")
+
+        self.count = self.index.tell() // INDEX.size
+        self.pending: list[tuple[bytes, int, int, int, int]] = []
+
+    def append(self, moves: list[str], result: str = "*", fen: str = START_POS) -> int:
+        return self.append_packed([decode_move(move) for move in moves], result, fen)
+
+    def append_packed(self, moves: list[int], result: str = "*", fen: str = START_POS) -> int:
+        setup = b"" if fen == START_POS else bytes(fen, encoding="ascii")
+
+        self.pending.append((setup + struct.pack(f"<{len(moves)}H", *moves), len(moves), int(time.time()), len(setup), RESULT_CODES.get(result, 0)))
+        self.count += 1
+
+        if len(self.pending) >= self.flush_games:
+            self.flush()
+
+        return self.count - 1
+
+    def flush(self) -> None:
+        if len(self.pending) == 0:
+            return
+
+        fcntl.flock(self.data.fileno(), fcntl.LOCK_EX)
+        try:
+            offset = self.data.seek(0, os.SEEK_END)
+            if offset == 0:
+                self.data.write(MAGIC)
+                offset = len(MAGIC)
+
+            entries = []
+            for record, plies, stamp, setup, result in self.pending:
+                entries.append(INDEX.pack(offset, plies, stamp, setup, result))
+                offset += len(record)
+
+            self.data.write(b"".join(record for record, _, _, _, _ in self.pending))
+            self.data.flush()
+
+            self.count = self.index.seek(0, os.SEEK_END) // INDEX.size + len(entries)
+            self.index.write(b"".join(entries))
+            self.index.flush()
+        finally:
+            fcntl.flock(self.data.fileno(), fcntl.LOCK_UN)
+
+        self.pending.clear()
+
+    def close(self) -> None:
+        self.flush()
+        self.data.close()
+        self.index.close()
+
+class GameReader:
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+        self.data_file = open(path, "rb")
+        self.index_file = open(path + ".idx", "rb")
+
+        self.data = self.map(self.data_file)
+        self.index = self.map(self.index_file)
+
+        if len(self.data) > 0 and self.data[:len(MAGIC)] != MAGIC:
+            raise Exception("Not a game log", path)
+
+    def map(self, f) -> mmap.mmap | bytes:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def refresh(self) -> None:
+        self.data = self.map(self.data_file)
+        self.index = self.map(self.index_file)
+
+    def __len__(self) -> int:
+        return len(self.index) // INDEX.size
+
+    def header(self, game: int) -> tuple[int, int, int, int, int]:
+        if game < 0 or game >= len(self):
+            raise Exception("No such game", game)
+
+        return INDEX.unpack_from(self.index, game * INDEX.size)
+
+    def fen(self, game: int) -> str:
+        offset, _, _, setup, _ = self.header(game)
+        return str(self.data[offset:offset + setup], encoding="ascii") if setup else START_POS
+
+    def result(self, game: int) -> str:
+        return RESULTS[self.header(game)[4]]
+
+    def moves(self, game: int, start: int = 0, stop: int | None = None) -> tuple[int, ...]:
+        offset, plies, _, setup, _ = self.header(game)
+
+        stop = plies if stop == None else min(stop, plies)
+        start = min(start, stop)
+
+        return struct.unpack_from(f"<{stop - start}H", self.data, offset + setup + 2 * start)
+
+    def position(self, game: int, ply: int) -> Position:
+        pos = Position(self.fen(game))
+        for move in self.moves(game, 0, ply):
+            pos.make_move(move)
+
+        return pos
+
+    def games(self) -> Iterator[tuple[str, tuple[int, ...], str]]:
+        for game in range(len(self)):
+            yield self.fen(game), self.moves(game), self.result(game)
+
+    def close(self) -> None:
+        for mapped in [self.data, self.index]:
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
+
+        self.data_file.close()
+        self.index_file.close()
+
+def movetext(fen: str, moves: Iterable[int], result: str) -> Iterator[str]:
+    pos = Position(fen)
+    legal = pos.legal_moves()
+
+    if pos.side != 0:
+        yield f"{pos.fullmove}..."
+
+    for move in moves:
+        number = f"{pos.fullmove}. " if pos.side == 0 else ""
+        text = pos.san(move, legal)
+
+        pos.make_move(move)
+        legal = pos.legal_moves()
+
+        yield number + text + pos.check_suffix(legal)
+
+    yield result
+
+def export_pgn(reader: GameReader, games: Iterable[int] | None = None) -> Iterator[str]:
+    for game in (range(len(reader)) if games == None else games):
+        _, _, stamp, _, _ = reader.header(game)
+        fen = reader.fen(game)
+        result = reader.result(game)
+
+        yield '[Event "?"]'
+        yield '[Site "?"]'
+        yield f'[Date "{time.strftime("%Y.%m.%d", time.gmtime(stamp))}"]'
+        yield f'[Round "{game + 1}"]'
+        yield '[White "?"]'
+        yield '[Black "?"]'
+        yield f'[Result "{result}"]'
+        if fen != START_POS:
+            yield '[SetUp "1"]'
+            yield f'[FEN "{fen}"]'
+        yield ""
+
+        line = ""
+        for token in movetext(fen, reader.moves(game), result):
+            if len(line) + 1 + len(token) > PGN_WIDTH:
+                yield line
+                line = ""
+            line = token if line == "" else line + " " + token
+
+        yield line
+        yield ""
+
+def random_game(rng: random.Random, plies: int) -> tuple[list[int], str]:
+    pos = Position()
+    moves = []
+
+    for _ in range(plies):
+        legal = pos.legal_moves()
+        if len(legal) == 0:
+            return moves, ("0-1" if pos.side == 0 else "1-0") if pos.in_check() else "1/2-1/2"
+
+        move = rng.choice(legal)
+        pos.make_move(move)
+        moves.append(move)
+
+    return moves, "*"
+
+def bench(path: str, games: int, plies: int, seed: int) -> None:
+    rng = random.Random(seed)
+    samples = [random_game(rng, plies) for _ in range(200)]
+
+    for name in [path, path + ".idx"]:
+        if os.path.exists(name):
+            os.remove(name)
+
+    writer = GameWriter(path)
+    start = time.perf_counter()
+    for game in range(games):
+        moves, result = samples[game % len(samples)]
+        writer.append_packed(moves, result)
+    writer.close()
+    elapsed = time.perf_counter() - start
+
+    size = os.path.getsize(path) + os.path.getsize(path + ".idx")
+    print(f"Wrote {games} games ({size / games:.1f} bytes/game) in {elapsed:.3f}s ({games / max(elapsed, 1e-9):.0f} games/s)")
+
+    reader = GameReader(path)
+    lookups = [(rng.randrange(len(reader)), rng.randrange(plies + 1)) for _ in range(10000)]
+
+    start = time.perf_counter()
+    for game, ply in lookups:
+        reader.moves(game, ply, ply + 1)
+    elapsed = time.perf_counter() - start
+    print(f"Seeked {len(lookups)} random game/ply records in {elapsed:.3f}s ({elapsed / len(lookups) * 1e6:.2f}us each)")
+
+    start = time.perf_counter()
+    for game, ply in lookups[:1000]:
+        reader.position(game, ply)
+    elapsed = time.perf_counter() - start
+    print(f"Replayed 1000 random positions in {elapsed:.3f}s ({elapsed:.3f}ms each)")
+
+    exported = min(1000, len(reader))
+    start = time.perf_counter()
+    lines = sum(1 for _ in export_pgn(reader, range(exported)))
+    elapsed = time.perf_counter() - start
+    print(f"Exported {exported} games ({lines} PGN lines) in {elapsed:.3f}s ({exported / max(elapsed, 1e-9):.0f} games/s)")
+
+    reader.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export games from an append-only game log as PGN, or benchmark the log")
+    parser.add_argument("path", nargs="?", default=GAMES_LOG)
+    parser.add_argument("--games", type=int, nargs="*", help="game numbers to export, default all")
+    parser.add_argument("--bench", action="store_true", help="write a scratch log at PATH and time writes, seeks, replays and export")
+    parser.add_argument("--count", type=int, default=100000, help="games written by the benchmark")
+    parser.add_argument("--plies", type=int, default=80, help="maximum plies per benchmark game")
+    parser.add_argument("--seed", type=int, default=0)
+
+    args = parser.parse_args()
+
+    if args.bench:
+        bench(args.path, args.count, args.plies, args.seed)
+    else:
+        reader = GameReader(args.path)
+        for line in export_pgn(reader, args.games):
+            sys.stdout.write(line + "\n")
+        reader.close()
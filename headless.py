@@ -0,0 +1,238 @@
+import asyncio, argparse, random, time
+from board import SQUARE_NAMES
+from movegen import ROOK, KNIGHT, BISHOP, QUEEN, Move
+from session import Session
+from rooms import RoomServer, parse_time_control
+
+PROMOTION_CHARS = {ROOK: 'R', KNIGHT: 'N', BISHOP: 'B', QUEEN: 'Q'}
+
+class Stats:
+
+    def __init__(self) -> None:
+        self.latencies: list[float] = []
+        self.players = 0
+        self.spectators = 0
+        self.rejected = 0
+        self.relayed = 0
+        self.finished = 0
+        self.resumed = 0
+        self.start = time.perf_counter()
+
+    def percentile(self, p: float) -> float:
+        if len(self.latencies) == 0:
+            return 0.0
+
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+    def merge(self, other: 'Stats') -> None:
+        self.latencies.extend(other.latencies)
+        self.players += other.players
+        self.spectators += other.spectators
+        self.rejected += other.rejected
+        self.relayed += other.relayed
+        self.finished += other.finished
+        self.resumed += other.resumed
+        self.start = min(self.start, other.start)
+
+    def report(self) -> None:
+        elapsed = time.perf_counter() - self.start
+        moves = len(self.latencies)
+
+        print(f"{self.players} players, {self.spectators} spectators, {self.finished} games finished, {self.resumed} connections resumed")
+        print(f"{moves} moves in {elapsed:.2f}s ({moves / max(elapsed, 1e-9):.0f} moves/s), {self.rejected} rejected, {self.relayed} relayed to spectators")
+        print(f"Latency p50 {self.percentile(0.5) * 1000:.2f}ms, p99 {self.percentile(0.99) * 1000:.2f}ms")
+
+class HeadlessPlayer(Session):
+
+    def __init__(self, stats: Stats, rng: random.Random, script: list[str] | None = None, room: str | None = None, drop: float = 0.0, think: float = 0.0, lag: float = 0.0) -> None:
+        Session.__init__(self, None, room)
+
+        self.stats = stats
+        self.rng = rng
+        self.script = script if script != None else []
+        self.drop = drop
+        self.think = think
+        self.lag = lag
+
+        self.stream: asyncio.StreamReader | None = None
+        self.writer: asyncio.StreamWriter | None = None
+        self.sent_at = 0.0
+
+    async def connect(self, host: str, port: int) -> None:
+        self.address = (host, port)
+        self.stream, self.writer = await asyncio.open_connection(host, port)
+
+    async def redial(self) -> None:
+        self.retract()
+        self.writer.close()
+        self.stream, self.writer = await asyncio.open_connection(*self.address)
+        self.reset_stream()
+
+        self.write_socket(self.resume_request(await self.next_message()))
+        self.apply_features()
+        self.apply_resume(await self.next_message())
+
+        self.stats.resumed += 1
+
+    async def play(self) -> None:
+        try:
+            offer = await self.next_message()
+            if self.wants_room(offer):
+                self.write_socket(self.room_request())
+                offer = await self.next_message()
+
+            self.write_socket(self.choose_role(offer))
+
+            pos = await self.next_message()
+            init_msg = await self.next_message()
+            while self.take_token(init_msg) or self.take_clock(init_msg):
+                init_msg = await self.next_message()
+
+            self.finish_handshake(pos, init_msg)
+
+            if self.spectator:
+                self.stats.spectators += 1
+            else:
+                self.stats.players += 1
+
+            while self.in_progress:
+                if self.my_turn and not self.moved:
+                    for msg in self.reader.parse():
+                        self.handle_message(msg)
+                    if not self.in_progress:
+                        break
+
+                    if self.think > 0:
+                        await self.think_for(self.think)
+                        if not self.in_progress:
+                            break
+                    self.play_move()
+                    await self.writer.drain()
+
+                if self.token != None and self.rng.random() < self.drop:
+                    await self.redial()
+                    continue
+
+                msg = await self.next_message()
+
+                if msg.startswith("ok"):
+                    self.stats.latencies.append(time.perf_counter() - self.sent_at)
+                elif msg == "no":
+                    self.stats.rejected += 1
+                elif self.spectator:
+                    self.stats.relayed += 1
+
+                self.handle_message(msg)
+
+            if self.white and not self.spectator and self.score != None:
+                self.stats.finished += 1
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.writer.close()
+
+    async def think_for(self, seconds: float) -> None:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + seconds
+
+        while self.in_progress and loop.time() < deadline:
+            try:
+                msg = await asyncio.wait_for(self.next_message(), deadline - loop.time())
+            except asyncio.TimeoutError:
+                return
+
+            self.handle_message(msg)
+
+    def play_move(self) -> None:
+        moves, _ = self.move_cache.get(self.board, self.board.turn)
+        if len(moves) == 0:
+            self.my_turn = False
+            return
+
+        move = self.choose_move(moves)
+
+        self.board.begin()
+        self.move_piece(move)
+        self.moved = True
+
+        self.sent_at = time.perf_counter()
+        self.sent_move = move
+        self.write_socket(move)
+
+    def choose_move(self, moves: list[Move]) -> str:
+        names = [SQUARE_NAMES[src] + SQUARE_NAMES[dst] + ("=" + PROMOTION_CHARS[prom & 7] if prom else "") for src, dst, prom in moves]
+
+        ply = self.board.ply()
+        if ply < len(self.script) and self.script[ply] in names:
+            return self.script[ply]
+
+        return self.rng.choice(names)
+
+    async def next_message(self) -> str:
+        msgs = self.reader.parse(1)
+        while len(msgs) == 0:
+            data = await self.stream.read(4096)
+            if len(data) == 0:
+                raise ConnectionError("Socket connection broken")
+
+            msgs = self.reader.feed(data, 1)
+
+        return msgs[0]
+
+    def write_socket(self, msg: str) -> None:
+        if self.lag > 0:
+            asyncio.get_running_loop().call_later(self.lag, self.write_late, self.writer, self.encode_frame(msg))
+        else:
+            self.writer.write(self.encode_frame(msg))
+
+    def write_late(self, writer: asyncio.StreamWriter, frame: bytes) -> None:
+        if not writer.is_closing():
+            writer.write(frame)
+
+async def run_batch(host: str, port: int, games: int, spectators: int, seed: int, script: list[str], drop: float = 0.0, think: float = 0.0, lag: float = 0.0) -> Stats:
+    stats = Stats()
+    rng = random.Random(seed)
+
+    players = [HeadlessPlayer(stats, random.Random(rng.getrandbits(32)), script, f"batch-{seed}-{game}", drop, think, lag) for game in range(games) for _ in range(2 + spectators)]
+    await asyncio.gather(*(player.connect(host, port) for player in players))
+    stats.start = time.perf_counter()
+
+    await asyncio.gather(*(player.play() for player in players))
+
+    return stats
+
+async def main(args: argparse.Namespace) -> None:
+    server = None
+    if args.local:
+        server = await RoomServer(not args.text, args.plies, 0, None, parse_time_control(args.clock) if args.clock != None else None).listen(args.host, args.port)
+        args.port = server.sockets[0].getsockname()[1]
+
+    stats = await run_batch(args.host, args.port, args.games, args.spectators, args.seed, args.script, args.drop, args.think, args.lag)
+    stats.report()
+
+    if server != None:
+        server.close()
+        await server.wait_closed()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Play many headless games against a server and report throughput and latency")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=40000)
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--spectators", type=int, default=1, help="spectators per game")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--script", nargs="*", default=[], help="opening moves to play before choosing randomly, e.g. e2e4 e7e5")
+    parser.add_argument("--drop", type=float, default=0.0, help="probability of dropping and resuming the connection before each read")
+    parser.add_argument("--think", type=float, default=0.0, help="seconds each player waits before moving")
+    parser.add_argument("--lag", type=float, default=0.0, help="seconds each player delays every write, as on a slow uplink")
+    parser.add_argument("--local", action="store_true", help="start a room server in the same process")
+    parser.add_argument("--text", action="store_true", help="local server does not offer the binary protocol")
+    parser.add_argument("--plies", type=int, default=200, help="local server ends games as drawn after this many plies")
+    parser.add_argument("--clock", help="local server time control in minutes plus increment in seconds, e.g. 3+2")
+
+    args = parser.parse_args()
+    if args.local and args.port == 40000:
+        args.port = 0
+
+    asyncio.run(main(args))
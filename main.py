@@ -1,21 +1,45 @@
+import argparse
+import socket, time
 import tkinter as tk
 from multiprocessing import Process
-import client
-import sys
-import os
-if os.path.exists('server/server.py'):
-    from server import server
 
-def join_game(host: str, port: int) -> None:
-    client.run(host, port)
+SERVER_START_TIMEOUT = 5.0
+SERVER_POLL = 0.05
 
-def create_game(port: int) -> None:
-    with server.Game() as game:
-        game.serve(port)
+def join_game(host: str, port: int, room: str | None) -> None:
+    import client
 
-def join(root: tk.Tk, host: str, port: int) -> Process:
+    client.run(host, port, room)
+
+def create_game(port: int, clock: str = "", legacy: bool = False) -> None:
+    if legacy:
+        from server import server
+
+        with server.Game() as game:
+            game.serve(port)
+    else:
+        import shards
+        from rooms import parse_time_control
+
+        shards.serve("0.0.0.0", port, time_control=parse_time_control(clock) if clock else None)
+
+def run_bot(host: str, port: int, room: str) -> None:
+    import engine
+
+    engine.run_bot(host, port, room)
+
+def wait_for_server(host: str, port: int, timeout: float = SERVER_START_TIMEOUT) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((host, port), SERVER_POLL).close()
+            return
+        except OSError:
+            time.sleep(SERVER_POLL)
+
+def join(root: tk.Tk, host: str, port: int, room: str) -> Process:
     global client_proc
-    client_proc = Process(target=join_game, args=[host, port])
+    client_proc = Process(target=join_game, args=[host, port, room or None])
 
     client_proc.start()
 
@@ -23,23 +47,48 @@ def join(root: tk.Tk, host: str, port: int) -> Process:
 
     return client_proc
 
-def create_and_join(root: tk.Tk, host: str, port: int) -> tuple[Process, Process]:
+def create_and_join(root: tk.Tk, host: str, port: int, room: str, clock: str) -> tuple[Process, Process]:
     global server_proc
     global client_proc
-    server_proc = Process(target=create_game, args=[port])
-    client_proc = Process(target=join_game, args=[host, port])
+    server_proc = Process(target=create_game, args=[port, clock, legacy_server])
+    client_proc = Process(target=join_game, args=[host, port, room or None])
 
     server_proc.start()
+    wait_for_server(host, port)
     client_proc.start()
 
     root.destroy()
 
     return (server_proc, client_proc)
 
+def play_computer(root: tk.Tk, host: str, port: int, room: str, clock: str) -> tuple[Process, Process, Process]:
+    global server_proc
+    global bot_proc
+    global client_proc
+    server_proc = Process(target=create_game, args=[port, clock, legacy_server])
+    bot_proc = Process(target=run_bot, args=[host, port, room or "computer"])
+    client_proc = Process(target=join_game, args=[host, port, room or "computer"])
+
+    server_proc.start()
+    wait_for_server(host, port)
+    bot_proc.start()
+    client_proc.start()
+
+    root.destroy()
+
+    return (server_proc, bot_proc, client_proc)
+
 client_proc = None
 server_proc = None
+bot_proc = None
+legacy_server = False
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Launch a game, a server or a game against the computer")
+    parser.add_argument("--legacy-server", action="store_true", help="host games with the server submodule instead of the room server")
+
+    legacy_server = parser.parse_args().legacy_server
+
     root = tk.Tk()
     root.title("Join a game")
 
@@ -59,18 +108,37 @@ if __name__ == '__main__':
     port_entry = tk.Entry(root, textvariable=port)
     port_entry.grid(row = 1, column = 1)
 
-    join_but = tk.Button(root, text="Join an existing game", command=lambda: join(root, host.get(), port.get()))
-    join_but.grid(row = 2, column = 0)
+    room_label = tk.Label(root, text="Room:", justify='right')
+    room_label.grid(row = 2, column = 0, sticky='E')
+
+    room = tk.StringVar(root, value='')
+
+    room_entry = tk.Entry(root, textvariable=room)
+    room_entry.grid(row = 2, column = 1)
+
+    clock_label = tk.Label(root, text="Clock (min+inc):", justify='right')
+    clock_label.grid(row = 3, column = 0, sticky='E')
+
+    clock = tk.StringVar(root, value='')
+
+    clock_entry = tk.Entry(root, textvariable=clock)
+    clock_entry.grid(row = 3, column = 1)
+
+    join_but = tk.Button(root, text="Join an existing game", command=lambda: join(root, host.get(), port.get(), room.get()))
+    join_but.grid(row = 4, column = 0)
+
+    create_but = tk.Button(root, text="Create a new game", command=lambda: create_and_join(root, host.get(), port.get(), room.get(), clock.get()))
+    create_but.grid(row = 4, column = 1)
 
-    create_but = tk.Button(root, text="Create a new game", command=lambda: create_and_join(root, host.get(), port.get()))
-    create_but.grid(row = 2, column = 1)
-    if 'server' not in sys.modules:
-        create_but['state'] = 'disable'
+    bot_but = tk.Button(root, text="Play against the computer", command=lambda: play_computer(root, host.get(), port.get(), room.get(), clock.get()))
+    bot_but.grid(row = 5, column = 0, columnspan = 2)
 
     root.mainloop()
 
     if client_proc != None:
         client_proc.join()
         client_proc.terminate()
+    if bot_proc != None:
+        bot_proc.terminate()
     if server_proc != None:
         server_proc.terminate()
\ No newline at end of file
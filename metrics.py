@@ -0,0 +1,159 @@
+import argparse, json, math, os, threading, time
+
+HISTOGRAM_STEPS = 8
+ZERO_BUCKET = -1 << 30
+DUMP_INTERVAL = 10.0
+RATE_INTERVAL = 1.0
+PERCENTILES = [("p50", 0.5), ("p90", 0.9), ("p99", 0.99)]
+
+class Histogram:
+
+    def __init__(self) -> None:
+        self.buckets: dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value: float) -> None:
+        bucket = math.floor(math.log2(value) * HISTOGRAM_STEPS) if value > 0 else ZERO_BUCKET
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p: float) -> float:
+        rank = p * self.count
+        seen = 0
+
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return 0.0 if bucket == ZERO_BUCKET else min(self.max, 2 ** ((bucket + 1) / HISTOGRAM_STEPS))
+
+        return self.max
+
+    def summary(self) -> dict[str, float]:
+        summary = {"count": self.count, "mean": self.total / self.count if self.count > 0 else 0.0, "max": self.max}
+        for name, p in PERCENTILES:
+            summary[name] = self.percentile(p)
+
+        return summary
+
+class Metrics:
+
+    def __init__(self, enabled: bool = False, path: str | None = None, interval: float = DUMP_INTERVAL) -> None:
+        self.enabled = enabled
+        self.path = path
+        self.interval = interval
+
+        self.lock = threading.Lock()
+        self.histograms: dict[str, Histogram] = {}
+        self.counters: dict[str, int] = {}
+
+        self.start = time.perf_counter()
+        self.rates: dict[str, float] = {}
+        self.rate_counters: dict[str, int] = {}
+        self.rate_at = self.start
+        self.next_rate = self.start + RATE_INTERVAL
+        self.next_dump = self.start + interval
+
+    def record(self, name: str, value: float) -> None:
+        if not self.enabled:
+            return
+
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.record(value)
+
+    def count(self, name: str, n: int = 1) -> None:
+        if not self.enabled:
+            return
+
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            counters = {name: {"total": total, "rate": self.rates.get(name, 0.0)} for name, total in self.counters.items()}
+            histograms = {name: histogram.summary() for name, histogram in self.histograms.items()}
+
+        return {"time": time.time(), "uptime": time.perf_counter() - self.start, "rate_window": RATE_INTERVAL, "histograms": histograms, "counters": counters}
+
+    def update_rates(self, now: float) -> None:
+        with self.lock:
+            elapsed = max(now - self.rate_at, 1e-9)
+            self.rates = {name: (total - self.rate_counters.get(name, 0)) / elapsed for name, total in self.counters.items()}
+            self.rate_counters = dict(self.counters)
+
+        self.rate_at = now
+        self.next_rate = now + RATE_INTERVAL
+
+    def tick(self) -> None:
+        if not self.enabled:
+            return
+
+        now = time.perf_counter()
+        if now >= self.next_rate:
+            self.update_rates(now)
+
+        if self.path != None and now >= self.next_dump:
+            self.next_dump = now + self.interval
+            self.dump()
+
+    def wait(self) -> float | None:
+        if not self.enabled:
+            return None
+
+        due = min(self.next_rate, self.next_dump) if self.path != None else self.next_rate
+        return max(0.0, due - time.perf_counter())
+
+    def dump(self) -> None:
+        if not self.enabled or self.path == None:
+            return
+
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(self.snapshot(), f, indent=1)
+        os.replace(self.path + ".tmp", self.path)
+
+    def lines(self, snapshot: dict) -> list[str]:
+        lines = []
+
+        for name, summary in sorted(snapshot["histograms"].items()):
+            lines.append(f"{name} p50 {summary['p50']:.2f} p99 {summary['p99']:.2f} max {summary['max']:.2f} n {summary['count']}")
+        for name, counter in sorted(snapshot["counters"].items()):
+            lines.append(f"{name} {counter['rate']:.0f}/s total {counter['total']}")
+
+        return lines
+
+def bench(calls: int) -> None:
+    for enabled in [False, True]:
+        metrics = Metrics(enabled)
+
+        start = time.perf_counter()
+        for idx in range(calls):
+            metrics.record("bench_ms", idx % 100 * 0.1)
+            metrics.count("bench")
+            metrics.tick()
+        elapsed = time.perf_counter() - start
+
+        print(f"{'on' if enabled else 'off'}: {elapsed * 1e9 / calls:.0f}ns per record, count and tick")
+
+    print("\n".join(metrics.lines(metrics.snapshot())))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Print a metrics dump, or time the cost of recording metrics")
+    parser.add_argument("path", nargs="?", help="metrics JSON written by a client or dashboard")
+    parser.add_argument("--bench", action="store_true", help="time recording with metrics off and on")
+    parser.add_argument("--calls", type=int, default=1000000)
+
+    args = parser.parse_args()
+
+    if args.bench:
+        bench(args.calls)
+    elif args.path != None:
+        with open(args.path) as f:
+            print("\n".join(Metrics().lines(json.load(f))))
@@ -0,0 +1,327 @@
+import sys, time
+from collections import OrderedDict
+from board import Board, BLACK
+
+WHITE = 0
+
+PAWN = 1
+ROOK = 2
+KNIGHT = 3
+BISHOP = 4
+QUEEN = 5
+KING = 6
+
+CASTLE_WK = 1
+CASTLE_WQ = 2
+CASTLE_BK = 4
+CASTLE_BQ = 8
+
+ROOK_DIRS = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+BISHOP_DIRS = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
+KNIGHT_OFFSETS = [(-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)]
+
+def _targets(offsets: list[tuple[int, int]]) -> list[list[int]]:
+    table = []
+    for sq in range(64):
+        row, file = divmod(sq, 8)
+        table.append([(row + dr) * 8 + file + df for dr, df in offsets if 0 <= row + dr < 8 and 0 <= file + df < 8])
+    return table
+
+def _rays(dirs: list[tuple[int, int]]) -> list[list[list[int]]]:
+    table = []
+    for sq in range(64):
+        rays = []
+        for dr, df in dirs:
+            row, file = divmod(sq, 8)
+            ray = []
+            while 0 <= row + dr < 8 and 0 <= file + df < 8:
+                row += dr
+                file += df
+                ray.append(row * 8 + file)
+            if len(ray) > 0:
+                rays.append(ray)
+        table.append(rays)
+    return table
+
+KNIGHT_TARGETS = _targets(KNIGHT_OFFSETS)
+KING_TARGETS = _targets(ROOK_DIRS + BISHOP_DIRS)
+ROOK_RAYS = _rays(ROOK_DIRS)
+BISHOP_RAYS = _rays(BISHOP_DIRS)
+QUEEN_RAYS = [ROOK_RAYS[sq] + BISHOP_RAYS[sq] for sq in range(64)]
+PAWN_ATTACKS = {WHITE: _targets([(-1, -1), (-1, 1)]), BLACK: _targets([(1, -1), (1, 1)])}
+
+CASTLE_MASK = [15] * 64
+CASTLE_MASK[60] = 15 & ~(CASTLE_WK | CASTLE_WQ)
+CASTLE_MASK[63] = 15 & ~CASTLE_WK
+CASTLE_MASK[56] = 15 & ~CASTLE_WQ
+CASTLE_MASK[4] = 15 & ~(CASTLE_BK | CASTLE_BQ)
+CASTLE_MASK[7] = 15 & ~CASTLE_BK
+CASTLE_MASK[0] = 15 & ~CASTLE_BQ
+
+Move = tuple[int, int, int]
+
+def attacked(squares: bytearray, sq: int, by: int) -> bool:
+    knight, king = KNIGHT | by, KING | by
+    rook, bishop, queen = ROOK | by, BISHOP | by, QUEEN | by
+
+    for t in KNIGHT_TARGETS[sq]:
+        if squares[t] == knight:
+            return True
+
+    for t in KING_TARGETS[sq]:
+        if squares[t] == king:
+            return True
+
+    pawn = PAWN | by
+    for t in PAWN_ATTACKS[by ^ BLACK][sq]:
+        if squares[t] == pawn:
+            return True
+
+    for ray in ROOK_RAYS[sq]:
+        for t in ray:
+            p = squares[t]
+            if p:
+                if p == rook or p == queen:
+                    return True
+                break
+
+    for ray in BISHOP_RAYS[sq]:
+        for t in ray:
+            p = squares[t]
+            if p:
+                if p == bishop or p == queen:
+                    return True
+                break
+
+    return False
+
+def king_square(squares: bytearray, color: int) -> int:
+    return squares.find(KING | color)
+
+def in_check(board: Board, color: int) -> bool:
+    sq = king_square(board.squares, color)
+    return sq >= 0 and attacked(board.squares, sq, color ^ BLACK)
+
+def pseudo_moves(board: Board, color: int) -> list[Move]:
+    squares = board.squares
+    moves: list[Move] = []
+    enemy = color ^ BLACK
+
+    for sq in range(64):
+        p = squares[sq]
+        if p == 0 or (p & BLACK) != color:
+            continue
+
+        kind = p & 7
+
+        if kind == PAWN:
+            step = -8 if color == WHITE else 8
+            dst = sq + step
+            last = dst < 8 if color == WHITE else dst >= 56
+
+            if squares[dst] == 0:
+                if last:
+                    for prom in (QUEEN, KNIGHT, ROOK, BISHOP):
+                        moves.append((sq, dst, prom | color))
+                else:
+                    moves.append((sq, dst, 0))
+                    if (sq >= 48 if color == WHITE else sq < 16) and squares[dst + step] == 0:
+                        moves.append((sq, dst + step, 0))
+
+            for dst in PAWN_ATTACKS[color][sq]:
+                q = squares[dst]
+                if (q != 0 and (q & BLACK) == enemy) or dst == board.ep:
+                    if last:
+                        for prom in (QUEEN, KNIGHT, ROOK, BISHOP):
+                            moves.append((sq, dst, prom | color))
+                    else:
+                        moves.append((sq, dst, 0))
+
+        elif kind == KNIGHT or kind == KING:
+            for dst in (KNIGHT_TARGETS[sq] if kind == KNIGHT else KING_TARGETS[sq]):
+                q = squares[dst]
+                if q == 0 or (q & BLACK) == enemy:
+                    moves.append((sq, dst, 0))
+
+        else:
+            for ray in (ROOK_RAYS[sq] if kind == ROOK else BISHOP_RAYS[sq] if kind == BISHOP else QUEEN_RAYS[sq]):
+                for dst in ray:
+                    q = squares[dst]
+                    if q == 0:
+                        moves.append((sq, dst, 0))
+                        continue
+                    if (q & BLACK) == enemy:
+                        moves.append((sq, dst, 0))
+                    break
+
+    home = 60 if color == WHITE else 4
+    rights = board.castling >> (0 if color == WHITE else 2)
+    if squares[home] == KING | color and rights & 3:
+        rook = ROOK | color
+        if rights & 1 and squares[home + 3] == rook and squares[home + 1] == 0 and squares[home + 2] == 0:
+            if not attacked(squares, home, enemy) and not attacked(squares, home + 1, enemy) and not attacked(squares, home + 2, enemy):
+                moves.append((home, home + 2, 0))
+        if rights & 2 and squares[home - 4] == rook and squares[home - 1] == 0 and squares[home - 2] == 0 and squares[home - 3] == 0:
+            if not attacked(squares, home, enemy) and not attacked(squares, home - 1, enemy) and not attacked(squares, home - 2, enemy):
+                moves.append((home, home - 2, 0))
+
+    return moves
+
+def make_move(board: Board, move: Move) -> tuple[int, int, int, int | None]:
+    src, dst, prom = move
+    squares = board.squares
+    piece = squares[src]
+    kind = piece & 7
+
+    captured, cap_sq = squares[dst], dst
+    if kind == PAWN and dst == board.ep:
+        cap_sq = dst + 8 if piece < BLACK else dst - 8
+        captured = squares[cap_sq]
+        squares[cap_sq] = 0
+
+    squares[dst] = prom or piece
+    squares[src] = 0
+
+    if kind == KING and abs(dst - src) == 2:
+        if dst > src:
+            squares[src + 1] = squares[src + 3]
+            squares[src + 3] = 0
+        else:
+            squares[src - 1] = squares[src - 4]
+            squares[src - 4] = 0
+
+    undo = (captured, cap_sq, board.castling, board.ep)
+
+    board.castling &= CASTLE_MASK[src] & CASTLE_MASK[dst]
+    board.ep = (src + dst) // 2 if kind == PAWN and abs(dst - src) == 16 else None
+
+    return undo
+
+def unmake_move(board: Board, move: Move, undo: tuple[int, int, int, int | None]) -> None:
+    src, dst, prom = move
+    squares = board.squares
+    captured, cap_sq, board.castling, board.ep = undo
+
+    piece = squares[dst]
+    if prom:
+        piece = PAWN | (piece & BLACK)
+
+    squares[src] = piece
+    squares[dst] = 0
+    squares[cap_sq] = captured
+
+    if piece & 7 == KING and abs(dst - src) == 2:
+        if dst > src:
+            squares[src + 3] = squares[src + 1]
+            squares[src + 1] = 0
+        else:
+            squares[src - 4] = squares[src - 1]
+            squares[src - 1] = 0
+
+def legal_moves(board: Board, color: int) -> list[Move]:
+    squares = board.squares
+    enemy = color ^ BLACK
+    king = king_square(squares, color)
+    moves: list[Move] = []
+
+    for move in pseudo_moves(board, color):
+        undo = make_move(board, move)
+        if not attacked(squares, move[1] if move[0] == king else king, enemy):
+            moves.append(move)
+        unmake_move(board, move, undo)
+
+    return moves
+
+def infer_castling(board: Board) -> int:
+    squares = board.squares
+    castling = 0
+
+    if squares[60] == KING:
+        if squares[63] == ROOK:
+            castling |= CASTLE_WK
+        if squares[56] == ROOK:
+            castling |= CASTLE_WQ
+    if squares[4] == KING | BLACK:
+        if squares[7] == ROOK | BLACK:
+            castling |= CASTLE_BK
+        if squares[0] == ROOK | BLACK:
+            castling |= CASTLE_BQ
+
+    return castling
+
+def perft(board: Board, color: int, depth: int) -> int:
+    moves = legal_moves(board, color)
+    if depth == 1:
+        return len(moves)
+
+    nodes = 0
+    for move in moves:
+        undo = make_move(board, move)
+        nodes += perft(board, color ^ BLACK, depth - 1)
+        unmake_move(board, move, undo)
+
+    return nodes
+
+class MoveCache:
+
+    def __init__(self, size: int = 4096) -> None:
+        self.size = size
+        self.entries: OrderedDict[tuple[int, int], tuple[list[Move], bool]] = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, board: Board, color: int) -> tuple[list[Move], bool]:
+        key = (board.key(), color)
+
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry
+
+        self.misses += 1
+        entry = (legal_moves(board, color), in_check(board, color))
+        self.entries[key] = entry
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+        return entry
+
+def load_position(fen: str) -> tuple[Board, int]:
+    board = Board()
+    board.load_fen(fen)
+
+    return board, board.turn
+
+PERFT_SUITE = [
+    ("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1", [20, 400, 8902, 197281, 4865609, 119060324]),
+    ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1", [48, 2039, 97862, 4085603]),
+    ("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", [14, 191, 2812, 43238, 674624, 11030083]),
+    ("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1", [6, 264, 9467, 422333]),
+    ("rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8", [44, 1486, 62379, 2103487]),
+]
+
+if __name__ == '__main__':
+    try:
+        max_depth = int(sys.argv[1])
+    except IndexError:
+        max_depth = 3
+
+    total_nodes = 0
+    total_time = 0.0
+
+    for fen, expected in PERFT_SUITE:
+        board, color = load_position(fen)
+        for depth in range(1, min(max_depth, len(expected)) + 1):
+            start = time.perf_counter()
+            nodes = perft(board, color, depth)
+            elapsed = time.perf_counter() - start
+
+            total_nodes += nodes
+            total_time += elapsed
+
+            status = "ok" if nodes == expected[depth - 1] else f"FAIL (expected {expected[depth - 1]})"
+            print(f"{fen}  depth {depth}: {nodes} nodes in {elapsed:.3f}s {status}")
+
+    print(f"Total: {total_nodes} nodes in {total_time:.3f}s ({total_nodes / max(total_time, 1e-9):.0f} nodes/s)")
@@ -0,0 +1,77 @@
+import pygame
+import socket, threading, queue, time
+from typing import Callable
+
+NET_MESSAGE = pygame.event.custom_type()
+NET_CLOSED = pygame.event.custom_type()
+NET_RESUMED = pygame.event.custom_type()
+
+class Connection:
+
+    def __init__(self, sock: socket.socket, read: Callable[[], list[str]], write: Callable[[str], None]) -> None:
+        self.sock = sock
+        self.read = read
+        self.write = write
+
+        self.outgoing: queue.Queue[str | None] = queue.Queue()
+
+        self.reader = threading.Thread(target=self.read_loop, daemon=True)
+        self.writer = threading.Thread(target=self.write_loop, daemon=True)
+
+        self.closed = False
+
+    def start(self) -> None:
+        self.reader.start()
+        self.writer.start()
+
+    def send(self, msg: str) -> None:
+        self.outgoing.put(msg)
+
+    def pending(self) -> int:
+        return self.outgoing.qsize()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+
+        self.closed = True
+        self.outgoing.put(None)
+
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def join(self, timeout: float) -> None:
+        self.writer.join(timeout)
+        self.reader.join(timeout)
+
+    def resume(self, reconnect: Callable[[], str | None], timeout: float) -> None:
+        self.close()
+        threading.Thread(target=self.resume_loop, args=[reconnect, timeout], daemon=True).start()
+
+    def resume_loop(self, reconnect: Callable[[], str | None], timeout: float) -> None:
+        self.join(timeout)
+        pygame.event.post(pygame.event.Event(NET_RESUMED, conn=self, reply=reconnect()))
+
+    def read_loop(self) -> None:
+        try:
+            while True:
+                msgs = self.read()
+                pygame.event.post(pygame.event.Event(NET_MESSAGE, msgs=msgs, received=time.perf_counter()))
+        except Exception:
+            if not self.closed:
+                pygame.event.post(pygame.event.Event(NET_CLOSED, conn=self))
+
+    def write_loop(self) -> None:
+        while True:
+            msg = self.outgoing.get()
+            if msg is None:
+                return
+
+            try:
+                self.write(msg)
+            except Exception:
+                if not self.closed:
+                    pygame.event.post(pygame.event.Event(NET_CLOSED, conn=self))
+                return
@@ -0,0 +1,172 @@
+import argparse, os, random, re, sys, time
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool
+from typing import Iterable, Iterator
+from board import START_POS
+from bitboard import Position, encode_move
+from gamestore import GameWriter, movetext, random_game
+
+TAG_RE = re.compile(r'\[(\w+)\s+"((?:[^"\\]|\\.)*)"\]')
+TOKEN_RE = re.compile(r'\{[^}]*\}?|;.*|\$\d+|\(|\)|[^\s{}();$]+')
+NUMBER_RE = re.compile(r'^\d+\.+')
+
+RESULTS = {"1-0", "0-1", "1/2-1/2", "*"}
+
+BATCH_GAMES = 256
+
+def read_games(lines: Iterable[str]) -> Iterator[tuple[dict[str, str], list[str], str]]:
+    headers: dict[str, str] = {}
+    moves: list[str] = []
+    depth = 0
+    comment = False
+
+    for line in lines:
+        if comment:
+            end = line.find("}")
+            if end < 0:
+                continue
+            line = line[end + 1:]
+            comment = False
+
+        if depth == 0 and line.startswith("["):
+            if len(moves) > 0:
+                yield headers, moves, headers.get("Result", "*")
+                headers, moves = {}, []
+
+            for name, value in TAG_RE.findall(line):
+                headers[name] = value
+            continue
+
+        for token in TOKEN_RE.findall(line):
+            if token[0] == "{":
+                comment = token[-1] != "}"
+            elif token == "(":
+                depth += 1
+            elif token == ")":
+                depth = max(0, depth - 1)
+            elif depth > 0 or token[0] in ";$":
+                continue
+            elif token in RESULTS:
+                yield headers, moves, token
+                headers, moves = {}, []
+            else:
+                token = NUMBER_RE.sub("", token)
+                if len(token) > 0:
+                    moves.append(token)
+
+    if len(moves) > 0 or len(headers) > 0:
+        yield headers, moves, headers.get("Result", "*")
+
+def replay_game(game: tuple[dict[str, str], list[str], str]) -> tuple[str, list[int], str, str, int] | None:
+    headers, sans, result = game
+    fen = headers.get("FEN", START_POS)
+
+    try:
+        pos = Position(fen)
+        moves = []
+
+        for san in sans:
+            move = pos.parse_san(san, pos.legal_moves())
+            pos.make_move(move)
+            moves.append(move)
+    except Exception:
+        return None
+
+    return fen, moves, result, pos.to_fen(), pos.to_board().key()
+
+def replay_batch(batch: list[tuple[dict[str, str], list[str], str]]) -> list[tuple[str, list[int], str, str, int] | None]:
+    return [replay_game(game) for game in batch]
+
+def batches(games: Iterator, size: int) -> Iterator[list]:
+    while True:
+        batch = list(islice(games, size))
+        if len(batch) == 0:
+            return
+        yield batch
+
+def replay_all(games: Iterator[tuple[dict[str, str], list[str], str]], processes: int = 1) -> Iterator[tuple[str, list[int], str, str, int] | None]:
+    if processes <= 1:
+        yield from map(replay_game, games)
+        return
+
+    with Pool(processes) as pool:
+        window = deque()
+
+        for batch in batches(games, BATCH_GAMES):
+            window.append(pool.apply_async(replay_batch, [batch]))
+            if len(window) >= 2 * processes:
+                yield from window.popleft().get()
+
+        while len(window) > 0:
+            yield from window.popleft().get()
+
+def import_pgn(path: str, processes: int, store: GameWriter | None, out, output: str = "fen") -> tuple[int, int, float]:
+    games = failed = 0
+    start = time.perf_counter()
+
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for record in replay_all(read_games(f), processes):
+            if record == None:
+                failed += 1
+                continue
+
+            fen, moves, result, final, key = record
+            games += 1
+
+            if store != None:
+                store.append_packed(moves, result, fen)
+            if out == None:
+                continue
+
+            if output == "hash":
+                out.write(f"{key:016x}\n")
+            elif output == "moves":
+                out.write(" ".join(encode_move(move) for move in moves) + "\n")
+            else:
+                out.write(final + "\n")
+
+    return games, failed, time.perf_counter() - start
+
+def write_sample(path: str, games: int, plies: int, seed: int) -> None:
+    rng = random.Random(seed)
+    samples = [random_game(rng, plies) for _ in range(min(games, 200))]
+
+    with open(path, "w") as f:
+        for game in range(games):
+            moves, result = samples[game % len(samples)]
+            f.write(f'[Event "sample"]\n[Round "{game + 1}"]\n[Result "{result}"]\n\n')
+            f.write(" ".join(movetext(START_POS, moves, result)) + "\n\n")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Stream games from a PGN file, replay them and print final FENs, position hashes or coordinate moves")
+    parser.add_argument("path", nargs="?")
+    parser.add_argument("--processes", type=int, default=os.cpu_count(), help="replay worker processes")
+    parser.add_argument("--output", choices=["fen", "hash", "moves"], default="fen", help="print each game's final FEN, its Zobrist key, or its moves in the coordinate form the client plays")
+    parser.add_argument("--quiet", action="store_true", help="only report throughput")
+    parser.add_argument("--store", help="append the imported games to this game log")
+    parser.add_argument("--bench", action="store_true", help="write a sample PGN to PATH and time imports with 1, 2, 4 and 8 processes")
+    parser.add_argument("--games", type=int, default=5000, help="games in the benchmark sample")
+    parser.add_argument("--plies", type=int, default=80)
+
+    args = parser.parse_args()
+    if args.path == None and not args.bench:
+        parser.error("a PGN file is required")
+
+    path = args.path if args.path != None else "sample.pgn"
+
+    if args.bench:
+        write_sample(path, args.games, args.plies, 0)
+        print(f"Sample: {args.games} games, {os.path.getsize(path) / 1e6:.1f}MB")
+
+        for processes in [1, 2, 4, 8]:
+            games, failed, elapsed = import_pgn(path, processes, None, None)
+            print(f"{processes} processes: {games} games ({failed} failed) in {elapsed:.2f}s ({games / max(elapsed, 1e-9):.0f} games/s)")
+    else:
+        store = GameWriter(args.store) if args.store != None else None
+
+        games, failed, elapsed = import_pgn(path, args.processes, store, None if args.quiet else sys.stdout, args.output)
+        print(f"{games} games ({failed} failed) in {elapsed:.2f}s ({games / max(elapsed, 1e-9):.0f} games/s)", file=sys.stderr)
+
+        if store != None:
+            store.close()
@@ -0,0 +1,278 @@
+import socket
+import re
+
+HEADER_LEN = 3
+MAX_FRAME = 1 << 16
+
+FEATURES = ["bin", "resume", "clock"]
+
+MSG_TEXT = 0
+MSG_MOVE = 1
+MSG_OK = 4
+MSG_NO = 7
+MSG_QUERY = 8
+MSG_MOVES = 9
+
+SUFFIXES = {'+': 1, '#': 2}
+SUFFIX_CHARS = ["", "+", "#"]
+
+PROMOTIONS = "QNRB"
+
+MOVE_RE = re.compile(r"[a-h][1-8][a-h][1-8](=[QNRB])?[+#]?")
+SQUARE_RE = re.compile(r"[a-h][1-8]")
+CLOCK_RE = re.compile(r"(\S+) (\d+) (\d+)")
+
+SQUARE_NAMES = [chr(ord('a') + sq % 8) + str(sq // 8 + 1) for sq in range(64)]
+
+class ProtocolError(ConnectionError):
+    pass
+
+class FrameReader:
+
+    def __init__(self, size: int = 65536) -> None:
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+        self.received = 0
+
+        self.binary = False
+
+    def recv(self, sock: socket.socket, limit: int | None = None) -> list[str]:
+        if self.end == len(self.buffer):
+            self.compact()
+
+        bytes_recd = sock.recv_into(self.view[self.end:])
+        if bytes_recd == 0:
+            raise Exception("Socket connection broken")
+
+        self.end += bytes_recd
+        self.received += bytes_recd
+
+        return self.parse(limit)
+
+    def feed(self, data: bytes, limit: int | None = None) -> list[str]:
+        if self.end + len(data) > len(self.buffer):
+            self.compact(len(data))
+
+        self.buffer[self.end:self.end + len(data)] = data
+        self.end += len(data)
+        self.received += len(data)
+
+        return self.parse(limit)
+
+    def parse(self, limit: int | None = None) -> list[str]:
+        msgs: list[str] = []
+
+        while limit is None or len(msgs) < limit:
+            msg = self.parse_binary() if self.binary else self.parse_text()
+            if msg is None:
+                break
+            msgs.append(msg)
+
+        if self.start == self.end:
+            self.start = self.end = 0
+
+        return msgs
+
+    def parse_text(self) -> str | None:
+        if self.end - self.start < HEADER_LEN:
+            return None
+
+        body_start = self.start + HEADER_LEN
+        header = bytes(self.buffer[self.start:body_start])
+        if not header.isdigit():
+            raise ProtocolError("Bad frame header", header)
+
+        bytes_expect = int(header)
+
+        if self.end - body_start < bytes_expect:
+            if body_start + bytes_expect > len(self.buffer):
+                self.compact(bytes_expect)
+            return None
+
+        self.start = body_start + bytes_expect
+
+        return str(self.view[body_start:self.start], encoding="ascii").strip()
+
+    def parse_binary(self) -> str | None:
+        buffer = self.buffer
+        pos = self.start
+        bytes_expect = 0
+        shift = 0
+
+        while True:
+            if pos == self.end:
+                return None
+
+            byte = buffer[pos]
+            pos += 1
+            bytes_expect |= (byte & 0x7f) << shift
+            shift += 7
+
+            if bytes_expect > MAX_FRAME:
+                raise ProtocolError("Frame too long", bytes_expect)
+
+            if byte < 0x80:
+                break
+
+        if self.end - pos < bytes_expect:
+            if pos + bytes_expect > len(buffer):
+                self.compact(bytes_expect)
+            return None
+
+        self.start = pos + bytes_expect
+
+        return decode_binary(self.view[pos:self.start])
+
+    def pending(self) -> bytes:
+        return bytes(self.view[self.start:self.end])
+
+    def compact(self, extra: int = 0) -> None:
+        pending = self.end - self.start
+        if pending + HEADER_LEN + extra > len(self.buffer):
+            self.view.release()
+            self.buffer.extend(bytes(pending + HEADER_LEN + extra))
+            self.view = memoryview(self.buffer)
+
+        self.buffer[:pending] = self.buffer[self.start:self.end]
+        self.start = 0
+        self.end = pending
+
+def encode_frame(msg: str) -> bytes:
+    msg = msg.strip()
+    if len(msg) > 999:
+        raise Exception("Message too long", msg)
+
+    return bytes(f"{str(len(msg)).rjust(3, '0')}{msg}", encoding="ascii")
+
+def encode_binary_frame(msg: str) -> bytes:
+    payload = encode_binary(msg.strip())
+    return encode_varint(len(payload)) + payload
+
+def encode_varint(value: int) -> bytes:
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+    return bytes(out)
+
+def decode_varint(data: memoryview, pos: int) -> tuple[int, int]:
+    value = 0
+    shift = 0
+
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+
+        if byte < 0x80:
+            return value, pos
+
+def split_clock(msg: str) -> tuple[str, tuple[int, int] | None]:
+    match = CLOCK_RE.fullmatch(msg)
+    if match is None or not (match[1] in ["ok", "ok+", "ok#"] or MOVE_RE.fullmatch(match[1]) is not None):
+        return msg, None
+
+    return match[1], (int(match[2]), int(match[3]))
+
+def square_index(alg: str) -> int:
+    return (ord(alg[0]) - ord('a')) + 8 * (int(alg[1]) - 1)
+
+def pack_move(move: str) -> int:
+    packed = square_index(move[0:2]) | (square_index(move[2:4]) << 6)
+
+    if len(move) >= 6 and move[4] == '=':
+        packed |= 0x4000 | (PROMOTIONS.index(move[5]) << 12)
+
+    return packed
+
+def unpack_move(packed: int) -> str:
+    move = SQUARE_NAMES[packed & 63] + SQUARE_NAMES[(packed >> 6) & 63]
+
+    if packed & 0x4000:
+        move += "=" + PROMOTIONS[(packed >> 12) & 3]
+
+    return move
+
+def encode_binary(msg: str) -> bytes:
+    msg, clock = split_clock(msg)
+    if clock != None:
+        return encode_binary(msg) + encode_varint(clock[0]) + encode_varint(clock[1])
+
+    suffix = SUFFIXES.get(msg[-1], 0) if len(msg) > 0 else 0
+
+    if msg == "no":
+        return bytes((MSG_NO,))
+
+    if msg in ["ok", "ok+", "ok#"]:
+        return bytes((MSG_OK + suffix,))
+
+    if msg.startswith("moves "):
+        origin = square_index(msg[6:8])
+        if len(msg) == 8:
+            return bytes((MSG_QUERY, origin))
+
+        mask = 0
+        for i in range(9, len(msg), 2):
+            if SQUARE_RE.fullmatch(msg[i:i+2]) is not None:
+                mask |= 1 << square_index(msg[i:i+2])
+
+        return bytes((MSG_MOVES, origin)) + mask.to_bytes(8, "little")
+
+    if MOVE_RE.fullmatch(msg) is not None:
+        return bytes((MSG_MOVE + suffix,)) + pack_move(msg).to_bytes(2, "little")
+
+    return bytes((MSG_TEXT,)) + bytes(msg, encoding="ascii")
+
+def decode_binary(payload: memoryview) -> str:
+    try:
+        return decode_payload(payload)
+    except (IndexError, ValueError):
+        raise ProtocolError("Malformed binary message", bytes(payload))
+
+def decode_payload(payload: memoryview) -> str:
+    kind = payload[0]
+
+    if kind == MSG_TEXT:
+        return str(payload[1:], encoding="ascii")
+
+    if kind == MSG_NO:
+        return "no"
+
+    if MSG_OK <= kind < MSG_NO:
+        return "ok" + SUFFIX_CHARS[kind - MSG_OK] + decode_clock(payload, 1)
+
+    if MSG_MOVE <= kind < MSG_OK:
+        if len(payload) < 3:
+            raise ProtocolError("Truncated move", bytes(payload))
+        return unpack_move(int.from_bytes(payload[1:3], "little")) + SUFFIX_CHARS[kind - MSG_MOVE] + decode_clock(payload, 3)
+
+    if kind == MSG_QUERY:
+        return "moves " + SQUARE_NAMES[payload[1]]
+
+    if kind == MSG_MOVES:
+        if len(payload) < 10:
+            raise ProtocolError("Truncated move list", bytes(payload))
+        mask = int.from_bytes(payload[2:10], "little")
+        targets = []
+        while mask:
+            low = mask & -mask
+            targets.append(SQUARE_NAMES[low.bit_length() - 1])
+            mask ^= low
+
+        return " ".join(["moves", SQUARE_NAMES[payload[1]], "".join(targets)]).strip()
+
+    raise ProtocolError("Unknown binary message", bytes(payload))
+
+def decode_clock(payload: memoryview, pos: int) -> str:
+    if pos >= len(payload):
+        return ""
+
+    white, pos = decode_varint(payload, pos)
+    black, _ = decode_varint(payload, pos)
+
+    return f" {white} {black}"
@@ -0,0 +1,160 @@
+import pygame
+import socket
+from typing import Callable
+from board import Piece
+from session import Session
+from assets import SizeCache
+
+backgrounds = SizeCache()
+
+class Compositor:
+
+    def __init__(self, cell_size: tuple[float, float], sprites: list[pygame.Surface | None], check_circle: pygame.Surface, color_dark, color_light, color_pos) -> None:
+        self.cell_size = cell_size
+        self.board_size = (round(cell_size[0] * 8), round(cell_size[1] * 8))
+
+        self.sprites = sprites
+        self.check_circle = check_circle
+
+        self.color_dark = color_dark
+        self.color_light = color_light
+        self.color_pos = color_pos
+
+        self.rects = [[self.square_rect(i, j) for j in range(8)] for i in range(8)]
+
+        self.background: pygame.Surface | None = None
+        self.background_key = None
+
+        self.pieces = pygame.Surface(self.board_size, pygame.SRCALPHA)
+        self.pieces.fill((0, 0, 0, 0))
+
+        size = self.rects[0][0].size
+
+        self.hint_origin = pygame.Surface(size)
+        self.hint_origin.fill(self.color_pos)
+
+        self.hint_dot = pygame.Surface(size, pygame.SRCALPHA)
+        self.hint_dot.fill((0, 0, 0, 0))
+        pygame.draw.circle(self.hint_dot, self.color_pos, (cell_size[0] / 2, cell_size[1] / 2), cell_size[0] / 6)
+
+        self.hint_ring = pygame.Surface(size, pygame.SRCALPHA)
+        self.hint_ring.fill((0, 0, 0, 0))
+        pygame.draw.circle(self.hint_ring, self.color_pos, (cell_size[0] / 2, cell_size[1] / 2), cell_size[0] / 2, round(cell_size[0] / 20))
+
+    def square_rect(self, i: int, j: int) -> pygame.Rect:
+        left, top = round(j * self.cell_size[0]), round(i * self.cell_size[1])
+        return pygame.Rect(left, top, round((j + 1) * self.cell_size[0]) - left, round((i + 1) * self.cell_size[1]) - top)
+
+    def render_background(self, white: bool) -> None:
+        key = (white, self.board_size)
+        if key == self.background_key:
+            return
+
+        self.background = backgrounds.get(key + (self.color_dark, self.color_light), lambda: self.build_background(white))
+        self.background_key = key
+
+    def build_background(self, white: bool) -> pygame.Surface:
+        background = pygame.Surface(self.board_size).convert()
+        for i in range(8):
+            for j in range(8):
+                pygame.draw.rect(background, self.color_dark if (i + j) % 2 == int(white) else self.color_light, self.rects[i][j])
+
+        return background
+
+    def render_pieces(self, get_piece: Callable[[int, int], int]) -> None:
+        self.pieces.fill((0, 0, 0, 0))
+        for i in range(8):
+            for j in range(8):
+                sprite = self.sprites[get_piece(i, j)]
+                if sprite is not None:
+                    self.pieces.blit(sprite, self.rects[i][j])
+
+    def update_piece(self, i: int, j: int, piece: int) -> None:
+        rect = self.rects[i][j]
+        self.pieces.fill((0, 0, 0, 0), rect)
+
+        sprite = self.sprites[piece]
+        if sprite is not None:
+            self.pieces.blit(sprite, rect)
+
+    def draw_board(self, surface: pygame.Surface, overlays: dict[tuple[int, int], list[pygame.Surface]]) -> pygame.Rect:
+        surface.blit(self.background, (0, 0))
+
+        for (i, j), layers in overlays.items():
+            for layer in layers:
+                surface.blit(layer, self.rects[i][j])
+
+        return surface.blit(self.pieces, (0, 0))
+
+    def draw_square(self, surface: pygame.Surface, i: int, j: int, overlays: list[pygame.Surface] | None) -> pygame.Rect:
+        rect = self.rects[i][j]
+        surface.blit(self.background, rect, rect)
+
+        if overlays is not None:
+            for layer in overlays:
+                surface.blit(layer, rect)
+
+        surface.blit(self.pieces, rect, rect)
+
+        return rect
+
+class BoardView(Session):
+
+    def __init__(self, sock: socket.socket | None, room: str | None = None) -> None:
+        self.dirty: set[tuple[int, int]] = set()
+        self.changed: set[tuple[int, int]] = set()
+        self.redraw_all = True
+        self.pieces_stale = True
+
+        Session.__init__(self, sock, room)
+
+    def sync_board(self, FEN: str) -> bool:
+        if Session.sync_board(self, FEN):
+            self.redraw_all = True
+            self.pieces_stale = True
+            return True
+
+        return False
+
+    def refresh_layers(self) -> None:
+        self.layers.render_background(self.white)
+
+        if self.pieces_stale:
+            self.layers.render_pieces(self.get_value)
+            self.pieces_stale = False
+        else:
+            for i, j in self.changed:
+                self.layers.update_piece(i, j, self.get_value(i, j))
+
+        self.changed.clear()
+
+    def overlays(self) -> dict[tuple[int, int], list[pygame.Surface]]:
+        overlays: dict[tuple[int, int], list[pygame.Surface]] = {}
+        self.mark_checks(overlays)
+
+        return overlays
+
+    def mark_checks(self, overlays: dict[tuple[int, int], list[pygame.Surface]]) -> None:
+        if not self.checked_me and not self.checked_opp:
+            return
+
+        for i in range(8):
+            for j in range(8):
+                value = self.get_value(i, j)
+                if (self.checked_me and value == Piece.KING_W.value | ((1-int(self.white)) << 3)) or (self.checked_opp and value == Piece.KING_W.value | (int(self.white) << 3)):
+                    overlays.setdefault((i, j), []).append(self.check_circle)
+
+    def set_checks(self, checked_me: bool, checked_opp: bool) -> None:
+        if checked_me == self.checked_me and checked_opp == self.checked_opp:
+            return
+
+        Session.set_checks(self, checked_me, checked_opp)
+
+        for i in range(8):
+            for j in range(8):
+                if self.get_value(i, j) & 7 == Piece.KING_W.value:
+                    self.dirty.add((i, j))
+
+    def square_changed(self, y: int, x: int) -> None:
+        self.dirty.add((y, x))
+        self.changed.add((y, x))
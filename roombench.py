@@ -0,0 +1,176 @@
+import asyncio, argparse, random, socket, time
+from multiprocessing import Process, Queue
+from protocol import encode_frame
+from bitboard import encode_move
+from rooms import RoomServer, Room, Peer, SPECTATOR_HIGH_WATER, SPECTATOR_LOW_WATER, parse_time_control
+
+class NullWriter:
+
+    def is_closing(self) -> bool:
+        return False
+
+    def write(self, data: bytes) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+class PausedWriter:
+
+    def __init__(self, writer: asyncio.StreamWriter) -> None:
+        self.writer = writer
+        self.transport = self
+        self.held: list[bytes] = []
+        self.size = 0
+
+    def is_closing(self) -> bool:
+        return self.writer.is_closing()
+
+    def write(self, data: bytes) -> None:
+        self.held.append(data)
+        self.size += len(data)
+
+    def get_write_buffer_size(self) -> int:
+        return self.size + self.writer.transport.get_write_buffer_size()
+
+    def close(self) -> None:
+        self.writer.write(b"".join(self.held))
+        self.held = []
+        self.size = 0
+        self.writer.close()
+
+async def bench_fanout(host: str, spectators: int, slow: int, binary: bool, seed: int, high_water: int = SPECTATOR_HIGH_WATER, low_water: int = SPECTATOR_LOW_WATER) -> None:
+    server = RoomServer(binary)
+    listener = await server.listen(host, 0)
+    port = listener.sockets[0].getsockname()[1]
+
+    room = server.join("fanout")
+    room.high_water = high_water
+    room.low_water = low_water
+    room.seats = 2
+    room.first_color.set_result("w")
+
+    players = [Peer(NullWriter()), Peer(NullWriter())]
+    room.claim(players[0], "w")
+    room.claim(players[1], "b")
+
+    received = [0]
+    slow_names = set()
+
+    async def watch(lagging: bool) -> None:
+        sock = socket.create_connection((host, port))
+        if lagging:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024)
+            slow_names.add(sock.getsockname())
+
+        stream, writer = await asyncio.open_connection(sock=sock)
+        writer.write(encode_frame("room fanout"))
+        writer.write(encode_frame("s" + (" bin" if binary else "")))
+
+        if lagging:
+            while not room.over:
+                await asyncio.sleep(0.05)
+
+        while True:
+            data = await stream.read(65536)
+            if len(data) == 0:
+                break
+            received[0] += len(data)
+
+        writer.close()
+
+    watchers = [asyncio.create_task(watch(i < slow)) for i in range(spectators)]
+    while len(room.peers) < spectators + 2:
+        await asyncio.sleep(0.01)
+
+    for peer in room.peers:
+        if peer.color == None and peer.writer.get_extra_info("peername") in slow_names:
+            peer.writer = PausedWriter(peer.writer)
+
+    rng = random.Random(seed)
+    while not room.over:
+        room.play(players[room.pos.side >> 3], encode_move(rng.choice(sorted(room.legal))))
+        await asyncio.sleep(0)
+
+    await asyncio.gather(*watchers)
+
+    listener.close()
+    await listener.wait_closed()
+
+    print(f"{room.plies} moves to {spectators} spectators ({slow} slow): {room.broadcast_time * 1e6 / room.plies:.0f}us per broadcast, {room.broadcast_time * 1e9 / (room.plies * spectators):.0f}ns per spectator")
+    print(f"{received[0]} bytes delivered, {room.snapshots} snapshots sent to lagging spectators")
+    print(f"{room.skipped_bytes} bytes of moves skipped for {room.snapshot_bytes} bytes of snapshots, {room.skipped_bytes - room.snapshot_bytes} bytes saved")
+
+class ClockBenchServer(RoomServer):
+
+    def __init__(self, time_control: tuple[float, float]) -> None:
+        RoomServer.__init__(self, True, None, 0, None, time_control)
+        self.played: dict[str, Room] = {}
+
+    def join(self, name: str) -> Room:
+        room = self.played[name] = RoomServer.join(self, name)
+        return room
+
+    async def serve_games(self, host: str, port: int, games: int) -> list[tuple[float | None, float, int, list[float]]]:
+        listener = await self.listen(host, port)
+
+        while len(self.played) < games or not all(room.over for room in self.played.values()):
+            await asyncio.sleep(0.1)
+
+        listener.close()
+        await listener.wait_closed()
+
+        return [(room.flag_late, room.lag_credit, room.charged, [peer.rtt for peer in room.players.values()]) for room in self.played.values()]
+
+def serve_clock_bench(host: str, port: int, games: int, time_control: tuple[float, float], results: Queue) -> None:
+    results.put(asyncio.run(ClockBenchServer(time_control).serve_games(host, port, games)))
+
+def bench_clocks(host: str, games: int, time_control: tuple[float, float], think: float, lag: float, seed: int) -> None:
+    from headless import run_batch
+
+    with socket.socket() as probe:
+        probe.bind((host, 0))
+        port = probe.getsockname()[1]
+
+    results = Queue()
+    server_proc = Process(target=serve_clock_bench, args=[host, port, games, time_control, results])
+    server_proc.start()
+    time.sleep(0.5)
+
+    stats = asyncio.run(run_batch(host, port, games, 0, seed, [], think=think, lag=lag))
+    rooms = results.get()
+    server_proc.join()
+
+    stats.report()
+
+    late = sorted(flag_late for flag_late, _, _, _ in rooms if flag_late != None)
+    credit = sum(lag_credit for _, lag_credit, _, _ in rooms)
+    charged = sum(charged for _, _, charged, _ in rooms)
+    rtts = sorted(rtt for _, _, _, peer_rtts in rooms for rtt in peer_rtts)
+
+    print(f"{games} games, {len(late)} lost on time, {lag * 1000:.0f}ms injected lag on every client write")
+    print(f"RTT p50 {rtts[len(rtts) // 2] * 1000:.2f}ms, max {rtts[-1] * 1000:.2f}ms, {credit * 1000 / max(charged, 1):.2f}ms credited per move over {charged} moves")
+    if len(late) > 0:
+        print(f"Flag lateness p50 {late[len(late) // 2] * 1000:.2f}ms, p99 {late[min(len(late) - 1, int(0.99 * len(late)))] * 1000:.2f}ms, max {late[-1] * 1000:.2f}ms")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark spectator fan-out or clock handling in the room server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--text", action="store_true", help="do not offer the binary protocol")
+    parser.add_argument("--fanout", type=int, default=0, help="broadcast one game to this many spectators and time the fan-out")
+    parser.add_argument("--slow", type=int, default=0, help="fan-out spectators whose server-side writes are held back until the game ends")
+    parser.add_argument("--high-water", type=int, default=256, help="spectator backlog in bytes that starts skipping moves in the fan-out benchmark, far below the server's since one game is about 1KB")
+    parser.add_argument("--low-water", type=int, default=64, help="spectator backlog in bytes that resumes with a snapshot in the fan-out benchmark")
+    parser.add_argument("--clock", help="time control in minutes plus increment in seconds for the clock benchmark, e.g. 3+2")
+    parser.add_argument("--clock-bench", type=int, default=0, help="serve this many timed games in a child process to headless clients and time the flag timers")
+    parser.add_argument("--think", type=float, default=0.5, help="seconds per move in the clock benchmark")
+    parser.add_argument("--lag", type=float, default=0.1, help="seconds the clock benchmark clients delay every write, pongs included")
+
+    args = parser.parse_args()
+
+    if args.fanout > 0:
+        asyncio.run(bench_fanout(args.host, args.fanout, args.slow, not args.text, 0, args.high_water, args.low_water))
+    elif args.clock_bench > 0:
+        bench_clocks(args.host, args.clock_bench, parse_time_control(args.clock) if args.clock != None else (6.0, 0.0), args.think, args.lag, 0)
+    else:
+        parser.print_help()
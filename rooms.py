@@ -0,0 +1,623 @@
+import asyncio, argparse, secrets, socket, time
+from typing import Callable
+from multiprocessing import Process
+from board import BLACK
+from protocol import FrameReader, MOVE_RE, SQUARE_RE, encode_frame, encode_binary_frame
+from bitboard import Position, WHITE, SQUARE_NAMES, decode_move, square_index
+from gamestore import GameWriter
+
+BACKLOG = 4096
+
+SPECTATOR_HIGH_WATER = 1 << 14
+SPECTATOR_LOW_WATER = 1 << 12
+
+RESUME_GRACE = 60.0
+
+MAX_LAG_COMP = 0.5
+RTT_WEIGHT = 0.25
+
+def offer_features(binary: bool, clocked: bool = False) -> str:
+    return (" bin" if binary else "") + " room resume" + (" clock" if clocked else "")
+
+def parse_time_control(text: str) -> tuple[float, float]:
+    base, _, increment = text.partition("+")
+
+    try:
+        return float(base) * 60, float(increment or 0)
+    except ValueError:
+        raise Exception("Incorrect time control", text)
+
+class Peer:
+
+    def __init__(self, writer: asyncio.StreamWriter) -> None:
+        self.writer = writer
+        self.encode_frame = encode_frame
+        self.color: int | None = None
+        self.lagging = False
+
+        self.token: str | None = None
+        self.abandon: asyncio.TimerHandle | None = None
+
+        self.clock = False
+        self.rtt = 0.0
+        self.ping_at: float | None = None
+
+    def send(self, msg: str) -> None:
+        self.write(self.encode_frame(msg))
+
+    def write(self, frame: bytes) -> None:
+        if not self.writer.is_closing():
+            self.writer.write(frame)
+
+    def backlog(self) -> int:
+        return self.writer.transport.get_write_buffer_size()
+
+    def ping(self, now: float) -> None:
+        self.ping_at = now
+        self.send("ping")
+
+    def pong(self, now: float) -> None:
+        if self.ping_at == None:
+            return
+
+        sample = now - self.ping_at
+        self.rtt = sample if self.rtt == 0 else self.rtt + RTT_WEIGHT * (sample - self.rtt)
+        self.ping_at = None
+
+    def lag(self) -> float:
+        return min(self.rtt, MAX_LAG_COMP)
+
+class Room:
+
+    def __init__(self, name: str | None = None, max_plies: int | None = None, store: GameWriter | None = None, time_control: tuple[float, float] | None = None) -> None:
+        self.name = name
+        self.max_plies = max_plies
+        self.store = store
+        self.loop = asyncio.get_running_loop()
+
+        self.pos = Position()
+        self.legal = set(self.pos.legal_moves())
+
+        self.log: list[str] = []
+        self.base_ply = self.pos.ply()
+        self.score: str | None = None
+
+        self.peers: list[Peer] = []
+        self.players: dict[int, Peer] = {}
+        self.seats = 0
+        self.first_color: asyncio.Future[str | None] = self.loop.create_future()
+
+        self.plies = 0
+        self.over = False
+
+        self.time_control = time_control
+        self.clock = [time_control[0], time_control[0]] if time_control != None else None
+        self.turn_start: float | None = None
+        self.flag_timer: asyncio.TimerHandle | None = None
+        self.flag_late: float | None = None
+        self.lag_credit = 0.0
+        self.charged = 0
+
+        self.high_water = SPECTATOR_HIGH_WATER
+        self.low_water = SPECTATOR_LOW_WATER
+
+        self.broadcast_time = 0.0
+        self.snapshots = 0
+        self.snapshot_bytes = 0
+        self.skipped_bytes = 0
+
+    def offer(self, seat: int, first_color: str | None) -> str:
+        if seat == 0:
+            return "wbs"
+        if seat == 1:
+            return ("b" if first_color == "w" else "w") + "s"
+        return "s"
+
+    def claim(self, peer: Peer, role: str) -> bool:
+        if role in ["w", "b"]:
+            color = WHITE if role == "w" else BLACK
+            if color in self.players or self.over:
+                return False
+
+            self.players[color] = peer
+            peer.color = color
+
+        self.peers.append(peer)
+
+        return True
+
+    def targets(self, origin: int) -> str:
+        return "".join(dict.fromkeys(SQUARE_NAMES[(move >> 6) & 63] for move in self.legal if move & 63 == origin))
+
+    def play(self, peer: Peer, msg: str) -> bool:
+        if self.over or peer.color != self.pos.side or self.players.get(peer.color) is not peer or MOVE_RE.fullmatch(msg) is None:
+            return False
+
+        move = decode_move(msg)
+        if move not in self.legal:
+            return False
+
+        now = self.loop.time()
+        if not self.charge(peer, now):
+            self.time_out()
+            return False
+
+        self.pos.make_move(move)
+        self.legal = set(self.pos.legal_moves())
+        self.plies += 1
+
+        check = self.pos.in_check()
+        suffix = ("#" if len(self.legal) == 0 else "+") if check else ""
+
+        self.log.append(msg + suffix)
+
+        stamp = self.stamp(now)
+        peer.send("ok" + suffix + (stamp if peer.clock else ""))
+        self.broadcast(msg + suffix, peer, stamp=stamp)
+
+        if len(self.legal) == 0:
+            self.finish(("0-1" if self.pos.side == WHITE else "1-0") if check else "1/2-1/2")
+        elif self.pos.halfmove >= 100 or (self.max_plies != None and self.plies >= self.max_plies):
+            self.finish("1/2-1/2")
+        elif self.clock != None:
+            mover = self.players.get(self.pos.side)
+            if mover != None and mover.clock:
+                mover.ping(now)
+
+        return True
+
+    def charge(self, peer: Peer, now: float) -> bool:
+        if self.clock == None or self.turn_start == None:
+            return True
+
+        elapsed = now - self.turn_start
+        credit = min(peer.lag(), elapsed)
+        self.lag_credit += credit
+        self.charged += 1
+
+        side = self.pos.side >> 3
+        self.clock[side] -= elapsed - credit
+
+        return self.clock[side] > 0
+
+    def stamp(self, now: float) -> str:
+        if self.clock == None:
+            return ""
+
+        self.clock[(self.pos.side ^ BLACK) >> 3] += self.time_control[1]
+        self.turn_start = now
+        self.schedule_flag()
+
+        return f" {round(self.clock[0] * 1000)} {round(self.clock[1] * 1000)}"
+
+    def deadline(self) -> float:
+        peer = self.players.get(self.pos.side)
+        return self.turn_start + (peer.lag() if peer != None else 0.0) + self.clock[self.pos.side >> 3]
+
+    def schedule_flag(self) -> None:
+        if self.flag_timer != None:
+            self.flag_timer.cancel()
+
+        self.flag_timer = self.loop.call_at(self.deadline(), self.check_flag)
+
+    def check_flag(self) -> None:
+        self.flag_timer = None
+        if self.over:
+            return
+
+        now = self.loop.time()
+        deadline = self.deadline()
+        if now < deadline:
+            self.flag_timer = self.loop.call_at(deadline, self.check_flag)
+            return
+
+        self.flag_late = now - deadline
+        self.clock[self.pos.side >> 3] = 0.0
+        self.time_out()
+
+    def time_out(self) -> None:
+        self.finish("0-1" if self.pos.side == WHITE else "1-0")
+
+    def pong(self, peer: Peer) -> None:
+        peer.pong(self.loop.time())
+
+        if self.turn_start != None and not self.over and self.players.get(self.pos.side) is peer:
+            self.schedule_flag()
+
+    def clock_frame(self) -> str:
+        clock = list(self.clock)
+        running = self.turn_start != None and not self.over
+        if running:
+            clock[self.pos.side >> 3] -= self.loop.time() - self.turn_start
+
+        base, increment = self.time_control
+        return f"clock {round(base * 1000)} {round(increment * 1000)} {max(0, round(clock[0] * 1000))} {max(0, round(clock[1] * 1000))} {int(running)}"
+
+    def catch_up(self, ply: int) -> str:
+        snapshot = "fen " + self.pos.to_fen()
+
+        start = ply - self.base_ply
+        if start < 0 or start > len(self.log):
+            return snapshot
+
+        replay = " ".join(["replay"] + self.log[start:])
+
+        return replay if len(replay) <= len(snapshot) else snapshot
+
+    def rejoin(self, old: Peer, peer: Peer) -> None:
+        if old.abandon != None:
+            old.abandon.cancel()
+
+        peer.color = old.color
+        peer.token = old.token
+        peer.rtt = old.rtt
+
+        if old in self.peers:
+            self.peers.remove(old)
+        self.peers.append(peer)
+
+        if peer.color != None:
+            self.players[peer.color] = peer
+
+    def broadcast(self, msg: str, skip: Peer | None = None, force: bool = False, stamp: str = "") -> None:
+        start = time.perf_counter()
+
+        frames: dict[tuple[Callable[[str], bytes], bool], bytes] = {}
+        snapshots: dict[Callable[[str], bytes], bytes] = {}
+        clocks: dict[Callable[[str], bytes], bytes] = {}
+
+        for peer in self.peers:
+            if peer is skip:
+                continue
+
+            frame = frames.get((peer.encode_frame, peer.clock))
+            if frame is None:
+                frame = frames[(peer.encode_frame, peer.clock)] = peer.encode_frame(msg + stamp if peer.clock else msg)
+
+            if peer.color == None and not force:
+                backlog = peer.backlog()
+                if backlog > self.high_water:
+                    peer.lagging = True
+                if peer.lagging and backlog > self.low_water:
+                    self.skipped_bytes += len(frame)
+                    continue
+
+            if peer.lagging:
+                peer.lagging = False
+                self.snapshots += 1
+
+                snapshot = snapshots.get(peer.encode_frame)
+                if snapshot is None:
+                    snapshot = snapshots[peer.encode_frame] = peer.encode_frame("fen " + self.pos.to_fen())
+                peer.write(snapshot)
+                self.snapshot_bytes += len(snapshot)
+
+                if peer.clock and self.clock != None:
+                    clock = clocks.get(peer.encode_frame)
+                    if clock is None:
+                        clock = clocks[peer.encode_frame] = peer.encode_frame(self.clock_frame())
+                    peer.write(clock)
+                    self.snapshot_bytes += len(clock)
+
+                if msg.startswith("end "):
+                    peer.write(frame)
+                else:
+                    self.skipped_bytes += len(frame)
+                continue
+
+            peer.write(frame)
+
+        self.broadcast_time += time.perf_counter() - start
+
+    def finish(self, score: str) -> None:
+        if self.over:
+            return
+
+        self.over = True
+        self.score = score
+
+        if self.flag_timer != None:
+            self.flag_timer.cancel()
+            self.flag_timer = None
+
+        if self.store != None and len(self.log) > 0:
+            self.store.append(self.log, score)
+
+        self.broadcast("end " + score, force=True)
+
+        for peer in self.peers:
+            peer.writer.close()
+
+class RoomServer:
+
+    def __init__(self, binary: bool = True, max_plies: int | None = None, shard: int = 0, store: GameWriter | None = None, time_control: tuple[float, float] | None = None) -> None:
+        self.binary = binary
+        self.max_plies = max_plies
+        self.shard = shard
+        self.store = store
+        self.time_control = time_control
+
+        self.sessions: dict[str, tuple[Room, Peer]] = {}
+
+        self.rooms: dict[str, Room] = {}
+        self.waiting: list[Room] = []
+        self.open_room: Room | None = None
+
+        self.stats = {"games": 0, "finished": 0, "moves": 0, "resumed": 0}
+        self.notify: Callable[[str], None] | None = None
+
+    async def listen(self, host: str, port: int) -> asyncio.Server:
+        return await asyncio.start_server(self.serve_client, host, port, backlog=BACKLOG)
+
+    async def serve_forever(self, host: str, port: int) -> None:
+        server = await self.listen(host, port)
+        async with server:
+            await server.serve_forever()
+
+    def join(self, name: str) -> Room:
+        room = self.rooms.get(name)
+        if room == None or room.over:
+            room = self.rooms[name] = Room(name, self.max_plies, self.store, self.time_control)
+
+        return room
+
+    def match(self, role: str) -> Room:
+        if role in ["w", "b"]:
+            color = WHITE if role == "w" else BLACK
+            for room in self.waiting:
+                if color not in room.players and not room.over:
+                    self.waiting.remove(room)
+                    return room
+
+            room = Room(None, self.max_plies, self.store, self.time_control)
+            self.waiting.append(room)
+            self.open_room = room
+            return room
+
+        if self.open_room == None or self.open_room.over:
+            self.open_room = Room(None, self.max_plies, self.store, self.time_control)
+
+        return self.open_room
+
+    def report(self, msg: str) -> None:
+        if self.notify != None:
+            self.notify(msg)
+
+    def new_token(self, room: Room, peer: Peer) -> str:
+        token = f"{self.shard}-{secrets.token_hex(8)}"
+        while token in self.sessions:
+            token = f"{self.shard}-{secrets.token_hex(8)}"
+
+        self.sessions[token] = (room, peer)
+
+        return token
+
+    def leave(self, room: Room, peer: Peer) -> None:
+        if peer.token != None and self.sessions.get(peer.token, (None, None))[1] is not peer:
+            return
+
+        if peer.token != None and not room.over:
+            peer.abandon = asyncio.get_running_loop().call_later(RESUME_GRACE, self.abandon, room, peer)
+            return
+
+        if peer in room.peers:
+            room.peers.remove(peer)
+
+        if peer.token != None:
+            del self.sessions[peer.token]
+
+        if peer.color != None:
+            room.finish("*")
+
+        if room.over:
+            if room.name != None and self.rooms.get(room.name) is room:
+                del self.rooms[room.name]
+            if room in self.waiting:
+                self.waiting.remove(room)
+                self.report("cancel " + ("w" if WHITE in room.players else "b"))
+            if self.open_room is room:
+                self.open_room = None
+
+    def abandon(self, room: Room, peer: Peer) -> None:
+        peer.abandon = None
+        peer.token, token = None, peer.token
+
+        if token != None:
+            del self.sessions[token]
+
+        self.leave(room, peer)
+
+    async def serve_client(self, stream: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        reader = FrameReader()
+
+        try:
+            writer.write(encode_frame("wbs" + offer_features(self.binary, self.time_control != None)))
+            reply = await self.next_message(stream, reader)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            writer.close()
+            return
+
+        await self.seat_client(stream, writer, reader, reply)
+
+    async def seat_client(self, stream: asyncio.StreamReader, writer: asyncio.StreamWriter, reader: FrameReader, reply: str) -> None:
+        peer = Peer(writer)
+        features = offer_features(self.binary, self.time_control != None)
+
+        if reply.startswith("resume "):
+            room = await self.resume_client(stream, writer, reader, peer, reply)
+            if room != None:
+                await self.serve_peer(stream, writer, reader, room, peer)
+            return
+
+        room = None
+        seat = None
+        try:
+            if reply.startswith("watch "):
+                room = self.join(reply[6:])
+                writer.write(encode_frame("s" + features))
+
+                reply = await self.next_message(stream, reader)
+            elif reply.startswith("room "):
+                room = self.join(reply[5:])
+                seat = room.seats
+                room.seats += 1
+
+                first_color = await room.first_color if seat == 1 else None
+                if seat == 1 and first_color == None:
+                    seat = 0
+                offer = room.offer(seat, first_color)
+                writer.write(encode_frame(offer + features))
+
+                reply = await self.next_message(stream, reader)
+                if seat == 0:
+                    room.first_color.set_result(reply.split(" ")[0])
+            else:
+                room = self.match(reply.split(" ")[0])
+
+            role, *accepted = reply.split(" ")
+
+            writer.write(encode_frame(room.pos.to_fen()))
+            if not room.claim(peer, role):
+                writer.write(encode_frame("initfail"))
+                return
+
+            if "resume" in accepted and peer.color != None:
+                peer.token = self.new_token(room, peer)
+                writer.write(encode_frame(f"token {peer.token}"))
+
+            if "clock" in accepted and room.clock != None:
+                peer.clock = True
+                writer.write(encode_frame(room.clock_frame()))
+
+            writer.write(encode_frame("initok"))
+
+            if len(room.players) == 2 and peer.color != None:
+                self.stats["games"] += 1
+
+            if "bin" in accepted:
+                peer.encode_frame = encode_binary_frame
+                reader.binary = True
+
+            if peer.clock and peer.color != None:
+                peer.ping(room.loop.time())
+        except (ConnectionError, asyncio.IncompleteReadError):
+            if room != None:
+                if seat == 0 and not room.first_color.done():
+                    room.seats -= 1
+                    first_color, room.first_color = room.first_color, room.loop.create_future()
+                    first_color.set_result(None)
+                self.leave(room, peer)
+            writer.close()
+            return
+
+        await self.serve_peer(stream, writer, reader, room, peer)
+
+    async def resume_client(self, stream: asyncio.StreamReader, writer: asyncio.StreamWriter, reader: FrameReader, peer: Peer, reply: str) -> Room | None:
+        _, token, ply, *accepted = reply.split(" ")
+
+        if "bin" in accepted:
+            peer.encode_frame = encode_binary_frame
+            reader.binary = True
+
+        room, old = self.sessions.get(token, (None, None))
+        if room == None or room.over or not ply.isdigit():
+            peer.send("end " + (room.score if room != None and room.score != None else "*"))
+            writer.close()
+            return None
+
+        room.rejoin(old, peer)
+        self.sessions[token] = (room, peer)
+        self.stats["resumed"] += 1
+
+        peer.send(room.catch_up(int(ply)))
+        if "clock" in accepted and room.clock != None:
+            peer.clock = True
+            peer.send(room.clock_frame())
+        old.writer.close()
+
+        return room
+
+    async def serve_peer(self, stream: asyncio.StreamReader, writer: asyncio.StreamWriter, reader: FrameReader, room: Room, peer: Peer) -> None:
+        try:
+            while not room.over:
+                self.handle_message(room, peer, await self.next_message(stream, reader))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.leave(room, peer)
+            writer.close()
+
+    def handle_message(self, room: Room, peer: Peer, msg: str) -> None:
+        if msg == "pong":
+            room.pong(peer)
+            return
+
+        if msg.startswith("moves "):
+            if SQUARE_RE.fullmatch(msg[6:]) is None:
+                peer.send("no")
+                return
+            peer.send(" ".join(["moves", msg[6:8], room.targets(square_index(msg[6:8]))]).strip())
+            return
+
+        if not room.play(peer, msg):
+            peer.send("no")
+            return
+
+        self.stats["moves"] += 1
+        if room.over:
+            self.stats["finished"] += 1
+
+    async def next_message(self, stream: asyncio.StreamReader, reader: FrameReader) -> str:
+        msgs = reader.parse(1)
+        while len(msgs) == 0:
+            data = await stream.read(4096)
+            if len(data) == 0:
+                raise ConnectionError("Socket connection broken")
+
+            msgs = reader.feed(data, 1)
+
+        return msgs[0]
+
+def serve(host: str, port: int, binary: bool = True, max_plies: int | None = None, store_path: str | None = None, time_control: tuple[float, float] | None = None) -> None:
+    store = GameWriter(store_path, 1) if store_path != None else None
+
+    try:
+        asyncio.run(RoomServer(binary, max_plies, 0, store, time_control).serve_forever(host, port))
+    finally:
+        if store != None:
+            store.close()
+
+if __name__ == '__main__':
+    from headless import run_batch
+
+    parser = argparse.ArgumentParser(description="Serve many games on one port, or benchmark the room server with headless clients")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=40000)
+    parser.add_argument("--bench", action="store_true", help="start the server in a child process and drive it with headless games")
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--spectators", type=int, default=0, help="spectators per game")
+    parser.add_argument("--plies", type=int, default=100, help="end benchmark games as drawn after this many plies")
+    parser.add_argument("--text", action="store_true", help="do not offer the binary protocol")
+    parser.add_argument("--store", help="append finished games to this game log")
+    parser.add_argument("--clock", help="time control in minutes plus increment in seconds, e.g. 3+2")
+
+    args = parser.parse_args()
+
+    time_control = parse_time_control(args.clock) if args.clock != None else None
+
+    if not args.bench:
+        serve(args.host, args.port, not args.text, None, args.store, time_control)
+    else:
+        with socket.socket() as probe:
+            probe.bind((args.host, 0))
+            port = probe.getsockname()[1]
+
+        server_proc = Process(target=serve, args=[args.host, port, not args.text, args.plies, args.store, time_control], daemon=True)
+        server_proc.start()
+        time.sleep(0.5)
+
+        stats = asyncio.run(run_batch(args.host, port, args.games, args.spectators, 0, []))
+        stats.report()
+
+        server_proc.terminate()
@@ -0,0 +1,423 @@
+import socket
+import random, time
+from typing import TYPE_CHECKING
+from board import Board, Piece, PIECES, BLACK, START_POS, VIEW_WHITE, VIEW_BLACK
+from movegen import CASTLE_MASK, MoveCache, infer_castling
+from metrics import Metrics
+from protocol import FrameReader, FEATURES, encode_frame, encode_binary_frame, split_clock
+
+if TYPE_CHECKING:
+    from gamestore import GameWriter
+
+RECONNECT_DELAYS = [0.5, 1.0, 2.0, 4.0, 8.0]
+RECONNECT_TIMEOUT = 5.0
+
+class Session:
+
+    def __init__(self, sock: socket.socket | None, room: str | None = None) -> None:
+        self.sock = sock
+        self.address = sock.getpeername() if sock is not None else None
+        self.room = room
+        self.watch = False
+        self.token: str | None = None
+        self.reader = FrameReader()
+        self.encode_frame = encode_frame
+        self.features: list[str] = []
+
+        self.board = Board()
+        self.start_fen = START_POS
+        self.moves: list[str] = []
+        self.sent_move: str | None = None
+
+        self.white = False
+        self.view = VIEW_BLACK
+        self.spectator = False
+
+        self.moved = False
+
+        self.my_turn = False
+
+        self.checked_me = False
+        self.checked_opp = False
+
+        self.in_progress = False
+        self.score = None
+
+        self.time_control: tuple[int, int] | None = None
+        self.clock_ms = [0, 0]
+        self.clock_at = 0.0
+        self.clock_side = 0
+        self.clock_running = False
+
+        self.move_cache = MoveCache()
+        self.metrics = Metrics()
+
+        self.sync_board(START_POS)
+
+    def __del__(self):
+        if self.sock is not None:
+            self.sock.close()
+
+    def sync_board(self, FEN: str) -> bool:
+        key = self.board.key()
+
+        self.board.commit()
+        self.board.load_fen(FEN)
+
+        self.start_fen = FEN
+        self.moves.clear()
+
+        if len(FEN.split()) < 3:
+            self.board.castling = infer_castling(self.board)
+
+        self.refresh_state()
+
+        return self.board.key() != key
+
+    def refresh_state(self) -> None:
+        _, check = self.move_cache.get(self.board, self.board.turn)
+        mine = self.board.turn == (0 if self.white else BLACK)
+        self.set_checks(check and mine, check and not mine)
+
+        self.moved = False
+        self.my_turn = not self.spectator and mine
+
+    def handshake(self) -> None:
+        offer = self.read_socket()
+        if self.wants_room(offer):
+            self.write_socket(self.room_request())
+            offer = self.read_socket()
+
+        self.write_socket(self.choose_role(offer))
+
+        pos = self.read_socket()
+        init_msg = self.read_socket()
+        while self.take_token(init_msg) or self.take_clock(init_msg):
+            init_msg = self.read_socket()
+
+        self.finish_handshake(pos, init_msg)
+
+    def take_token(self, msg: str) -> bool:
+        if not msg.startswith("token "):
+            return False
+
+        self.token = msg[6:]
+        return True
+
+    def take_clock(self, msg: str) -> bool:
+        if not msg.startswith("clock "):
+            return False
+
+        base, increment, white, black, running = [int(field) for field in msg[6:].split(" ")]
+        self.time_control = (base, increment)
+        self.set_clock(white, black, running == 1)
+        return True
+
+    def set_clock(self, white: int, black: int, running: bool = True) -> None:
+        self.clock_ms = [white, black]
+        self.clock_at = time.monotonic()
+        self.clock_side = self.board.turn
+        self.clock_running = running
+
+    def stop_clock(self) -> None:
+        self.clock_ms[self.clock_side >> 3] = self.remaining(self.clock_side)
+        self.clock_running = False
+
+    def remaining(self, color: int) -> int:
+        ms = self.clock_ms[color >> 3]
+        if self.clock_running and color == self.clock_side:
+            ms -= round((time.monotonic() - self.clock_at) * 1000)
+
+        return max(0, ms)
+
+    def wants_room(self, offer: str) -> bool:
+        return self.room != None and "room" in offer.split(" ")[1:]
+
+    def room_request(self) -> str:
+        return ("watch " if self.watch else "room ") + self.room
+
+    def choose_role(self, offer: str) -> str:
+        init_msg, *offered = offer.split(" ")
+
+        self.features = [feature for feature in offered if feature in FEATURES]
+        accept = "".join(" " + feature for feature in self.features)
+
+        if init_msg == "wbs":
+            resp = random.choice("wb")
+            self.white = (resp == "w")
+            return resp + accept
+
+        elif init_msg == "ws":
+            self.white = True
+            return "w" + accept
+
+        elif init_msg == "bs":
+            self.white = False
+            return "b" + accept
+
+        else:
+            self.spectator = True
+            self.white = True
+            return "s" + accept
+
+    def finish_handshake(self, pos: str, init_msg: str) -> None:
+        if init_msg == "initfail":
+            raise Exception("Failed to initialize connection")
+
+        if init_msg != "initok":
+            raise Exception("Unknown initialization message")
+
+        self.view = VIEW_WHITE if self.white else VIEW_BLACK
+
+        self.apply_features()
+        self.sync_board(pos)
+        self.clock_side = self.board.turn
+
+        self.in_progress = True
+
+    def apply_features(self) -> None:
+        if "bin" in self.features:
+            self.reader.binary = True
+            self.encode_frame = encode_binary_frame
+
+    def reset_stream(self) -> None:
+        self.reader = FrameReader()
+        self.encode_frame = encode_frame
+
+    def resume_request(self, offer: str) -> str:
+        if "resume" not in offer.split(" ")[1:]:
+            raise Exception("Server cannot resume games", offer)
+
+        return " ".join(["resume", self.token, str(self.board.ply())] + self.features)
+
+    def apply_resume(self, reply: str) -> None:
+        if reply.startswith("replay"):
+            for move in reply.split(" ")[1:]:
+                self.move_piece(move)
+                self.moves.append(move)
+            self.refresh_state()
+        else:
+            self.handle_message(reply)
+
+    def resume(self, sock: socket.socket) -> str:
+        if self.sock is not None:
+            self.sock.close()
+
+        self.sock = sock
+        self.reset_stream()
+
+        self.write_socket(self.resume_request(self.read_socket()))
+        self.apply_features()
+
+        return self.read_socket()
+
+    def reconnect(self) -> str | None:
+        if self.token == None or self.address == None:
+            return None
+
+        for delay in RECONNECT_DELAYS:
+            try:
+                reply = self.resume(socket.create_connection(self.address, RECONNECT_TIMEOUT))
+                self.sock.settimeout(None)
+                return reply
+            except Exception:
+                time.sleep(delay)
+
+        return None
+
+    def handle_message(self, msg: str) -> None:
+        msg, clock = split_clock(msg)
+
+        if msg.startswith("ok"):
+            if self.sent_move != None:
+                self.moves.append(self.sent_move)
+                self.sent_move = None
+            self.moved = False
+            self.my_turn = False
+            self.board.commit()
+            self.set_checks(False, msg[-1] == '+' or msg[-1] == '#')
+        elif msg == "no":
+            self.retract()
+            self.moved = False
+        elif msg.startswith("moves "):
+            pass
+        elif msg == "ping":
+            self.send("pong")
+        elif msg.startswith("clock "):
+            self.take_clock(msg)
+        elif msg.startswith("fen "):
+            self.sync_board(msg[4:])
+        elif msg.startswith("end "):
+            self.score = msg[4:]
+            self.in_progress = False
+            self.stop_clock()
+        else:
+            self.move_piece(msg)
+            self.moves.append(msg)
+            self.set_checks(msg[-1] == '+' or msg[-1] == '#', False)
+            if not self.spectator:
+                self.my_turn = True
+
+        if clock != None:
+            self.set_clock(*clock)
+
+    def retract(self) -> None:
+        self.sent_move = None
+
+        for idx in self.board.rollback():
+            self.square_changed(*self.screen_coords(idx))
+
+    def record(self, store: 'GameWriter') -> None:
+        if len(self.moves) > 0:
+            store.append(self.moves, self.score if self.score != None else "*", self.start_fen)
+
+    def set_checks(self, checked_me: bool, checked_opp: bool) -> None:
+        self.checked_me = checked_me
+        self.checked_opp = checked_opp
+
+    def square_changed(self, y: int, x: int) -> None:
+        pass
+
+    def screen_coords(self, idx: int) -> tuple[int, int]:
+        return divmod(self.view[idx // 8][idx % 8], 8)
+
+    def get_piece(self, y: int, x: int) -> Piece:
+        return PIECES[self.board.squares[self.view[y][x]]]
+
+    def get_value(self, y: int, x: int) -> int:
+        return self.board.squares[self.view[y][x]]
+
+    def del_piece(self, y: int, x: int) -> None:
+        self.square_changed(y, x)
+        self.board.put(self.view[y][x], 0)
+
+    def set_piece(self, y: int, x: int, piece: Piece) -> None:
+        self.square_changed(y, x)
+        self.board.put(self.view[y][x], piece.value)
+
+    def move_piece(self, move: str) -> None:
+
+        if len(move) < 4:
+            raise Exception("Incorrect move", move)
+
+        src_r, src_f = self.decode_alg(move[0:2])
+        dst_r, dst_f = self.decode_alg(move[2:4])
+
+        if self.get_piece(src_r, src_f) == Piece.NONE:
+            raise Exception("Cannot move a NULL piece", move)
+
+        piece = self.get_piece(src_r, src_f)
+
+        if piece in [Piece.PAWN_W, Piece.PAWN_B] and self.view[dst_r][dst_f] == self.board.ep:
+            if dst_r == 5:
+                self.del_piece(4, dst_f)
+            else:
+                self.del_piece(3, dst_f)
+
+        self.board.advance(piece in [Piece.PAWN_W, Piece.PAWN_B] or self.get_value(dst_r, dst_f) != 0)
+        self.board.castling &= CASTLE_MASK[self.view[src_r][src_f]] & CASTLE_MASK[self.view[dst_r][dst_f]]
+        self.board.ep = None
+
+        if piece in [Piece.PAWN_W, Piece.PAWN_B] and abs(dst_r - src_r) == 2:
+            self.board.ep = self.view[round((dst_r + src_r)/2)][src_f]
+
+        if piece in [Piece.KING_W, Piece.KING_B]:
+            if dst_f - src_f == 2:
+                self.set_piece(src_r, src_f + 1, PIECES[Piece.ROOK_W.value | (piece.value & BLACK)])
+                self.del_piece(src_r, 7)
+            elif dst_f - src_f == -2:
+                self.set_piece(src_r, src_f - 1, PIECES[Piece.ROOK_W.value | (piece.value & BLACK)])
+                self.del_piece(src_r, 0)
+
+        if len(move) >= 6 and move[4] == '=':
+            prom = Piece.NONE
+            match move[5]:
+                case 'Q':
+                    prom = Piece.QUEEN_W
+                case 'N':
+                    prom = Piece.KNIGHT_W
+                case 'R':
+                    prom = Piece.ROOK_W
+                case 'B':
+                    prom = Piece.BISHOP_W
+
+            piece = PIECES[prom.value | (piece.value & BLACK)]
+
+        self.set_piece(dst_r, dst_f, piece)
+        self.del_piece(src_r, src_f)
+
+    def encode_move(self, orig_x: int, orig_y: int, new_x: int, new_y: int, prom: Piece = Piece.NONE) -> str:
+        orig = self.encode_alg(orig_x, orig_y)
+        new = self.encode_alg(new_x, new_y)
+
+        prom_str = ""
+        match prom:
+            case Piece.QUEEN_W | Piece.QUEEN_B:
+                prom_str = "=Q"
+            case Piece.KNIGHT_W | Piece.KNIGHT_B:
+                prom_str = "=N"
+            case Piece.ROOK_W | Piece.ROOK_B:
+                prom_str = "=R"
+            case Piece.BISHOP_W | Piece.BISHOP_B:
+                prom_str = "=B"
+
+        return "".join([orig, new, prom_str])
+
+    def decode_alg(self, alg: str) -> tuple[int, int]:
+        if len(alg) != 2:
+            raise Exception("Incorrect length of algebraic position", alg)
+
+        file = ord(alg[0]) - ord('a')
+        rank = (8 - int(alg[1])) if self.white else (int(alg[1]) - 1)
+
+        if file < 0 or file >= 8 or rank < 0 or rank >= 8:
+            raise Exception("Incorrect position", alg)
+
+        return (rank, file)
+
+    def encode_alg(self, x: int, y: int) -> str:
+        if x >= 8 or x < 0 or y >= 8 or y < 0:
+            raise Exception("Incorrect position", x, y)
+
+        file = chr(ord('a') + x)
+        rank = str((8 - y) if self.white else (y + 1))
+
+        return "".join([file, rank])
+
+    def read_socket(self) -> str:
+        msgs = self.reader.parse(1)
+        while len(msgs) == 0:
+            msgs = self.reader.recv(self.sock, 1)
+
+        return msgs[0]
+
+    def read_messages(self) -> list[str]:
+        received = self.reader.received
+        msgs = self.reader.parse()
+        while len(msgs) == 0:
+            msgs = self.reader.recv(self.sock)
+
+        self.metrics.count("bytes_in", self.reader.received - received)
+        self.metrics.count("msgs_in", len(msgs))
+        return msgs
+
+    def send(self, msg: str) -> None:
+        self.write_socket(msg)
+
+    def write_socket(self, msg: str) -> None:
+        msg = self.encode_frame(msg)
+
+        start = time.perf_counter()
+        to_send = len(msg)
+        total_sent = 0
+        while total_sent < to_send:
+            sent = self.sock.send(msg[total_sent:])
+
+            if sent == 0:
+                raise Exception("Socket connection broken")
+
+            total_sent += sent
+
+        self.metrics.record("socket_write_ms", (time.perf_counter() - start) * 1000)
+        self.metrics.count("bytes_out", to_send)
+        self.metrics.count("msgs_out")
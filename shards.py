@@ -0,0 +1,246 @@
+import asyncio, argparse, os, socket, time, zlib
+from multiprocessing import Process, Queue
+from protocol import FrameReader, encode_frame
+from rooms import RoomServer, BACKLOG, offer_features, parse_time_control, serve as serve_rooms
+from gamestore import GameWriter
+
+HANDOFF_SIZE = 65536
+
+SHARDING = hasattr(socket, "AF_UNIX") and hasattr(socket, "SOCK_SEQPACKET") and hasattr(socket, "send_fds")
+
+def shard_for(reply: str, shards: int) -> int | None:
+    if reply.startswith("resume "):
+        prefix = reply[7:].split("-", 1)[0]
+        return int(prefix) % shards if prefix.isdigit() else 0
+
+    if reply.startswith("room "):
+        return zlib.crc32(reply[5:].encode("ascii")) % shards
+
+    if reply.startswith("watch "):
+        return zlib.crc32(reply[6:].encode("ascii")) % shards
+
+    return None
+
+class Worker:
+
+    def __init__(self, channel: socket.socket, binary: bool = True, max_plies: int | None = None, shard: int = 0, store: GameWriter | None = None, time_control: tuple[float, float] | None = None) -> None:
+        self.channel = channel
+        self.rooms = RoomServer(binary, max_plies, shard, store, time_control)
+        self.rooms.notify = self.notify
+        self.tasks: set[asyncio.Task] = set()
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        self.closed = loop.create_future()
+
+        self.channel.setblocking(False)
+        loop.add_reader(self.channel.fileno(), self.receive)
+
+        await self.closed
+        loop.remove_reader(self.channel.fileno())
+
+    def receive(self) -> None:
+        try:
+            msg, fds, _, _ = socket.recv_fds(self.channel, HANDOFF_SIZE, 1)
+        except BlockingIOError:
+            return
+
+        if len(fds) == 0:
+            if len(msg) == 0 and not self.closed.done():
+                self.closed.set_result(None)
+            return
+
+        reply, pending = msg.split(b"\0", 1)
+
+        task = asyncio.create_task(self.adopt(fds[0], str(reply, encoding="ascii"), pending))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def notify(self, msg: str) -> None:
+        try:
+            self.channel.send(bytes(msg, encoding="ascii"))
+        except OSError:
+            pass
+
+    async def adopt(self, fd: int, reply: str, pending: bytes) -> None:
+        stream, writer = await asyncio.open_connection(sock=socket.socket(fileno=fd))
+
+        reader = FrameReader()
+        reader.feed(pending, 0)
+
+        await self.rooms.seat_client(stream, writer, reader, reply)
+
+class Router:
+
+    def __init__(self, channels: list[socket.socket], binary: bool = True, clocked: bool = False) -> None:
+        self.channels = channels
+        self.binary = binary
+        self.clocked = clocked
+        self.tasks: set[asyncio.Task] = set()
+
+        self.routed = [0] * len(channels)
+
+        self.lobby: dict[str, list[int]] = {"w": [], "b": []}
+        self.next_lobby = 0
+        self.last_lobby = 0
+
+    async def serve_forever(self, host: str, port: int) -> None:
+        loop = asyncio.get_running_loop()
+
+        for shard, channel in enumerate(self.channels):
+            loop.add_reader(channel.fileno(), self.receive, shard)
+
+        listener = socket.create_server((host, port), backlog=BACKLOG)
+        listener.setblocking(False)
+
+        with listener:
+            while True:
+                conn, _ = await loop.sock_accept(listener)
+
+                task = asyncio.create_task(self.route(conn))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+
+    def receive(self, shard: int) -> None:
+        try:
+            msg = self.channels[shard].recv(HANDOFF_SIZE)
+        except BlockingIOError:
+            return
+
+        if len(msg) == 0:
+            asyncio.get_running_loop().remove_reader(self.channels[shard].fileno())
+            return
+
+        _, role = str(msg, encoding="ascii").split(" ")
+        if shard in self.lobby[role]:
+            self.lobby[role].remove(shard)
+
+    def lobby_shard(self, role: str) -> int:
+        other = {"w": "b", "b": "w"}.get(role)
+        if other == None:
+            return self.last_lobby
+
+        if len(self.lobby[other]) > 0:
+            self.last_lobby = self.lobby[other].pop(0)
+            return self.last_lobby
+
+        shard = self.next_lobby
+        self.next_lobby = (shard + 1) % len(self.channels)
+        self.lobby[role].append(shard)
+        return shard
+
+    async def route(self, conn: socket.socket) -> None:
+        loop = asyncio.get_running_loop()
+        reader = FrameReader()
+
+        try:
+            await loop.sock_sendall(conn, encode_frame("wbs" + offer_features(self.binary, self.clocked)))
+
+            msgs = reader.parse(1)
+            while len(msgs) == 0:
+                data = await loop.sock_recv(conn, 4096)
+                if len(data) == 0:
+                    raise ConnectionError("Socket connection broken")
+
+                msgs = reader.feed(data, 1)
+
+            reply = msgs[0]
+            shard = shard_for(reply, len(self.channels))
+            if shard == None:
+                shard = self.lobby_shard(reply.split(" ")[0])
+
+            socket.send_fds(self.channels[shard], [bytes(reply, encoding="ascii") + b"\0" + reader.pending()], [conn.fileno()])
+            self.routed[shard] += 1
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            conn.close()
+
+def run_worker(channel: socket.socket, binary: bool, max_plies: int | None, shard: int, store_path: str | None, time_control: tuple[float, float] | None = None, inherited: list[socket.socket] | None = None) -> None:
+    for sock in inherited or []:
+        sock.close()
+
+    store = GameWriter(f"{store_path}.{shard}", 1) if store_path != None else None
+
+    try:
+        asyncio.run(Worker(channel, binary, max_plies, shard, store, time_control).run())
+    finally:
+        if store != None:
+            store.close()
+
+def serve(host: str, port: int, workers: int | None = None, binary: bool = True, max_plies: int | None = None, store_path: str | None = None, time_control: tuple[float, float] | None = None) -> None:
+    if not SHARDING:
+        serve_rooms(host, port, binary, max_plies, store_path, time_control)
+        return
+
+    channels = []
+    procs = []
+
+    for shard in range(workers or os.cpu_count() or 1):
+        channel, child = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+
+        proc = Process(target=run_worker, args=[child, binary, max_plies, shard, store_path, time_control, channels + [channel]], daemon=True)
+        proc.start()
+        child.close()
+
+        channels.append(channel)
+        procs.append(proc)
+
+    try:
+        asyncio.run(Router(channels, binary, time_control != None).serve_forever(host, port))
+    finally:
+        for channel in channels:
+            channel.close()
+        for proc in procs:
+            proc.join(1)
+
+def run_clients(host: str, port: int, games: int, spectators: int, seed: int, results: Queue) -> None:
+    from headless import run_batch
+
+    results.put(asyncio.run(run_batch(host, port, games, spectators, seed, [])))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve rooms from one worker process per core behind a routing front end, or benchmark scaling")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=40000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--bench", action="store_true", help="measure throughput with 1, 2, 4 and 8 workers")
+    parser.add_argument("--clients", type=int, default=os.cpu_count(), help="client processes driving the benchmark")
+    parser.add_argument("--games", type=int, default=400)
+    parser.add_argument("--plies", type=int, default=60, help="end benchmark games as drawn after this many plies")
+    parser.add_argument("--text", action="store_true", help="do not offer the binary protocol")
+    parser.add_argument("--store", help="append finished games to one game log per worker, named PATH.N")
+    parser.add_argument("--clock", help="time control in minutes plus increment in seconds, e.g. 3+2")
+
+    args = parser.parse_args()
+
+    if not args.bench:
+        serve(args.host, args.port, args.workers, not args.text, None, args.store, parse_time_control(args.clock) if args.clock != None else None)
+    else:
+        for workers in [1, 2, 4, 8]:
+            with socket.socket() as probe:
+                probe.bind((args.host, 0))
+                port = probe.getsockname()[1]
+
+            server_proc = Process(target=serve, args=[args.host, port, workers, not args.text, args.plies])
+            server_proc.start()
+            time.sleep(0.5)
+
+            results: Queue = Queue()
+            clients = [Process(target=run_clients, args=[args.host, port, args.games // args.clients, 0, seed, results]) for seed in range(args.clients)]
+
+            for client in clients:
+                client.start()
+
+            stats = results.get()
+            for _ in clients[1:]:
+                stats.merge(results.get())
+
+            for client in clients:
+                client.join()
+
+            print(f"{workers} workers:")
+            stats.report()
+
+            server_proc.terminate()
+            server_proc.join()